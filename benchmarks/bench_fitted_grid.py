@@ -0,0 +1,32 @@
+"""
+Compare fitted vectors on the equal-area display grid against the per-point path.
+
+With plotdarn installed (``pip install -e .``) run ``python benchmarks/bench_fitted_grid.py``.
+"""
+import timeit
+import numpy as np
+from plotdarn.fitted_vectors import equal_area_grid, grid_fitted_vecs, sdarn_get_fitted
+
+HMB_LAT = 60.
+SPACING = 2.
+
+
+def per_point(coeffs, mlat, mlt):
+    return [sdarn_get_fitted(coeffs, HMB_LAT, mlat[i], mlt[i]) for i in range(len(mlat))]
+
+
+def main():
+    coeffs = np.random.RandomState(0).normal(0, 5, 49)
+    mlat, mlt = equal_area_grid(HMB_LAT, SPACING)
+    grid_fitted_vecs(coeffs, HMB_LAT, spacing=SPACING)
+
+    n = 3
+    point = timeit.timeit(lambda: per_point(coeffs, mlat, mlt), number=n) / n
+    grid = timeit.timeit(lambda: grid_fitted_vecs(coeffs, HMB_LAT, spacing=SPACING), number=n * 100) / (n * 100)
+    print('{} grid points at {} degree spacing'.format(len(mlat), SPACING))
+    print('per-point: {:10.3f} ms'.format(point * 1e3))
+    print('grid:      {:10.3f} ms  ({:.0f}x)'.format(grid * 1e3, point / grid))
+
+
+if __name__ == '__main__':
+    main()
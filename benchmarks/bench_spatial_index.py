@@ -0,0 +1,66 @@
+"""
+Measure the query latency of the vector index against a linear scan of the same points.
+
+With plotdarn installed (``pip install -e .``) run ``python benchmarks/bench_spatial_index.py [--points 300000]``.
+The points are split over several frames as in an index of neighbouring records.
+"""
+import time
+import argparse
+import numpy as np
+from plotdarn.spatial import VectorIndex
+
+
+def linear_nearest(points, x, y, k):
+    dist = np.hypot(points[:, 0] - x, points[:, 1] - y)
+    return np.argsort(dist)[:k]
+
+
+def linear_box(points, x0, y0, x1, y1):
+    return np.flatnonzero((points[:, 0] >= x0) & (points[:, 0] <= x1) & (points[:, 1] >= y0) & (points[:, 1] <= y1))
+
+
+def latency(func, queries):
+    start = time.perf_counter()
+    for query in queries:
+        func(*query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=300000)
+    parser.add_argument('--frames', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    points = rng.uniform(-40, 40, (args.points, 2))
+    index = VectorIndex()
+    start = time.perf_counter()
+    for key, frame in enumerate(np.array_split(points, args.frames)):
+        index.add_frame(key, frame[:, 0], frame[:, 1])
+    build = time.perf_counter() - start
+
+    centres = rng.uniform(-35, 35, (args.queries, 2))
+    polygon_x = np.array([-2., 2., 3., 0., -3.])
+    polygon_y = np.array([-2., -3., 1., 3., 1.])
+    results = [
+        ('nearest k=1', latency(lambda x, y: index.nearest(x, y), centres),
+         latency(lambda x, y: linear_nearest(points, x, y, 1), centres)),
+        ('nearest k=10', latency(lambda x, y: index.nearest(x, y, k=10), centres),
+         latency(lambda x, y: linear_nearest(points, x, y, 10), centres)),
+        ('radius r=1', latency(lambda x, y: index.radius(x, y, 1.), centres), None),
+        ('box 2 x 2', latency(lambda x, y: index.box(x - 1, y - 1, x + 1, y + 1), centres),
+         latency(lambda x, y: linear_box(points, x - 1, y - 1, x + 1, y + 1), centres)),
+        ('polygon', latency(lambda x, y: index.polygon(polygon_x + x, polygon_y + y), centres), None),
+    ]
+    print('{} points in {} frames, index built in {:.1f} ms'.format(args.points, args.frames, build * 1e3))
+    for name, indexed, linear in results:
+        line = '{:14s} {:8.3f} ms'.format(name, indexed * 1e3)
+        if linear is not None:
+            line += '  linear scan {:8.3f} ms  ({:.0f}x)'.format(linear * 1e3, linear / indexed)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
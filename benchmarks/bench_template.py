@@ -0,0 +1,70 @@
+"""
+Compare rendering a day of frames with a pre-serialized template against building and serializing each figure.
+
+With plotdarn installed (``pip install -e .``) run ``python benchmarks/bench_template.py [--frames 720] [--potential]``.
+Layers are computed before timing, so only figure building and serialization are measured.
+"""
+import time
+import argparse
+import warnings
+import numpy as np
+from plotdarn.plotdarn import frame_layers, render_layers
+from plotdarn.template import FrameTemplate
+
+
+def synthetic_record(i, order=6, n_vectors=300, latmin=60.0):
+    rng = np.random.RandomState(i)
+    boundary_mlon = np.arange(0, 360, 10.0)
+    minutes = 2 * i
+    return {
+        'start.year': 2012, 'start.month': 6, 'start.day': 15, 'start.hour': minutes // 60,
+        'start.minute': minutes % 60, 'start.second': 0.0,
+        'fit.order': order,
+        'latmin': latmin,
+        'N+2': rng.normal(0, 5, (order + 1) ** 2),
+        'boundary.mlat': latmin + 2 * np.cos(np.radians(boundary_mlon)),
+        'boundary.mlon': boundary_mlon,
+        'vector.mlat': rng.uniform(latmin - 5, 85, n_vectors),
+        'vector.mlon': rng.uniform(-180, 180, n_vectors),
+        'vector.kvect': rng.uniform(-180, 180, n_vectors),
+        'vector.vel.median': rng.uniform(0, 1000, n_vectors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=720)
+    parser.add_argument('--potential', action='store_true', help='include the potential image')
+    args = parser.parse_args()
+
+    from bokeh.embed import file_html
+    from bokeh.resources import CDN
+    # Bokeh installs its own filter for its deprecation warnings on import
+    warnings.simplefilter('ignore')
+    records = [synthetic_record(i) for i in range(args.frames)]
+    frames = [frame_layers(r, [], show_potential=args.potential, image_budget=0.005) for r in records]
+    titles = ['SuperDarn {:02d}:{:02d}'.format(r['start.hour'], r['start.minute']) for r in records]
+
+    start = time.perf_counter()
+    full = [file_html(render_layers(layers, title=title), CDN, title=title) for layers, title in zip(frames, titles)]
+    full_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    template = FrameTemplate(frames[0])
+    setup_time = time.perf_counter() - start
+    start = time.perf_counter()
+    spliced = [template.html(layers, title) for layers, title in zip(frames, titles)]
+    spliced_time = time.perf_counter() - start
+
+    full_size = sum(len(page.encode()) for page in full)
+    spliced_size = sum(len(page.encode()) for page in spliced)
+    print('{} frames{}'.format(args.frames, ' with potential image' if args.potential else ''))
+    print('figure + file_html: {:8.2f} s  {:8.1f} ms/frame  {:10.1f} MiB'.format(
+        full_time, full_time / args.frames * 1e3, full_size / 2. ** 20))
+    print('template:           {:8.2f} s  {:8.1f} ms/frame  {:10.1f} MiB  (setup {:.1f} ms)'.format(
+        spliced_time, spliced_time / args.frames * 1e3, spliced_size / 2. ** 20, setup_time * 1e3))
+    print('speedup {:.1f}x, size {:.0f}%'.format(full_time / spliced_time, 100. * spliced_size / full_size))
+
+
+if __name__ == '__main__':
+    main()
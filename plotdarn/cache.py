@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""Content-addressed cache of computed frame products
+
+Products are keyed by a hash of the inputs that determine them (record fields and computation parameters) rather
+than by object identity, so the same record re-read from disk or restyled still hits the cache.
+"""
+import os
+import hashlib
+import pickle
+import threading
+import datetime as dt
+from collections import OrderedDict
+import numpy as np
+
+
+def _update_hash(h, part):
+    if isinstance(part, np.ndarray):
+        h.update(b'ndarray')
+        h.update(str(part.dtype).encode())
+        h.update(str(part.shape).encode())
+        h.update(np.ascontiguousarray(part).tobytes())
+    elif isinstance(part, (list, tuple)):
+        h.update('{}{}'.format(type(part).__name__, len(part)).encode())
+        for item in part:
+            _update_hash(h, item)
+    elif isinstance(part, dict):
+        h.update('dict{}'.format(len(part)).encode())
+        for k in sorted(part):
+            _update_hash(h, k)
+            _update_hash(h, part[k])
+    elif isinstance(part, (dt.datetime, dt.date)):
+        h.update(part.isoformat().encode())
+    elif hasattr(part, 'cache_parts'):
+        # Frame contexts
+        _update_hash(h, part.cache_parts())
+    elif hasattr(part, 'wkb'):
+        # Shapely geometries
+        h.update(part.wkb)
+    elif part is None or isinstance(part, (bool, int, float, str, bytes, np.generic)):
+        h.update(repr(part).encode())
+    else:
+        # Sequences such as pandas/geopandas series
+        _update_hash(h, list(part))
+
+
+def content_key(name, *parts):
+    """
+    Return a hex digest identifying a product from its name and the inputs it is computed from
+    :param name: product name, e.g. 'coastlines'
+    :param parts: arrays, scalars, datetimes, geometries or (nested) lists of them
+    :return: str
+    """
+    h = hashlib.sha1(name.encode())
+    for part in parts:
+        _update_hash(h, part)
+    return h.hexdigest()
+
+
+class FrameCache(object):
+    """
+    LRU cache of frame products held in memory, optionally backed by a directory of pickles so products survive
+    between processes. A cache may be shared between threads: lookups, stores and statistics are made under a lock,
+    and products are computed outside it, so two threads missing the same product may both compute it.
+    """
+
+    def __init__(self, maxsize=256, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._items = OrderedDict()
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name, outcome):
+        # Called with the lock held
+        counts = self.counts.setdefault(name, {'hits': 0, 'disk_hits': 0, 'misses': 0})
+        counts[outcome] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def _store(self, name, key, value, outcome=None):
+        with self._lock:
+            if outcome is not None:
+                self._count(name, outcome)
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get_or_compute(self, name, parts, func):
+        """
+        Return the cached product for ``name`` and ``parts``, calling ``func()`` to compute it on a miss
+        :param name: product name
+        :param parts: sequence of inputs the product depends on
+        :param func: callable taking no arguments
+        :return: product
+        """
+        key = content_key(name, *parts)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self._count(name, 'hits')
+                return self._items[key]
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), 'rb') as fh:
+                value = pickle.load(fh)
+            self._store(name, key, value, 'disk_hits')
+            return value
+
+        with self._lock:
+            self._count(name, 'misses')
+        value = func()
+        self._store(name, key, value)
+        if self.directory is not None:
+            tmp = self._path(key) + '.tmp{}'.format(os.getpid())
+            with open(tmp, 'wb') as fh:
+                pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        return value
+
+    def stats(self):
+        """
+        Return hit/miss counts in total and per product
+        :return: dict
+        """
+        with self._lock:
+            total = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+            for counts in self.counts.values():
+                for k in total:
+                    total[k] += counts[k]
+            total['size'] = len(self._items)
+            total['products'] = {name: dict(counts) for name, counts in self.counts.items()}
+        return total
+
+    def clear(self):
+        """
+        Drop the in-memory items and statistics, files on disk are kept
+        """
+        with self._lock:
+            self._items.clear()
+            self.counts = {}
+
+    def __len__(self):
+        return len(self._items)
+
+
+def cached(cache, name, parts, func):
+    """
+    Call ``func()`` through ``cache`` if one is given, otherwise just call it
+    """
+    if cache is None:
+        return func()
+    return cache.get_or_compute(name, parts, func)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""Statistical convection maps accumulated over many map records
+
+Vectors are binned into the cells of fitted_vectors.equal_area_grid. Each cell keeps a count, the mean and variance
+of the speed (updated with the parallel form of Welford's algorithm, one batch per record) and the running sum of the
+velocity components, so accumulators filled by separate workers can be merged exactly.
+"""
+import numpy as np
+from plotdarn import convert
+from .fitted_vectors import equal_area_grid, fitted_vecs_mlt
+from .frame import FrameContext
+from .utils import scale_velocity
+
+KINDS = ['los', 'fit']
+
+
+class Climatology(object):
+    """
+    Per-cell statistics of line-of-sight ('los') and fitted ('fit') velocities on an equal-area mlat/MLT grid
+    :param latmin: lowest latitude of the grid
+    :param spacing: grid spacing in degrees
+    """
+
+    def __init__(self, latmin=50, spacing=2.0):
+        self.latmin = latmin
+        self.spacing = spacing
+        self.mlat, self.mlt = equal_area_grid(latmin, spacing)
+        bands = np.arange(90., latmin - 1e-9, -spacing)[:-1] - spacing / 2.
+        self._band_cells = np.array([np.count_nonzero(self.mlat == band) for band in bands])
+        self._band_start = np.concatenate([[0], np.cumsum(self._band_cells)[:-1]])
+        n_cells = len(self.mlat)
+        self.count = {kind: np.zeros(n_cells, dtype=np.int64) for kind in KINDS}
+        self.mean = {kind: np.zeros(n_cells) for kind in KINDS}
+        self.m2 = {kind: np.zeros(n_cells) for kind in KINDS}
+        self.north = {kind: np.zeros(n_cells) for kind in KINDS}
+        self.east = {kind: np.zeros(n_cells) for kind in KINDS}
+        self.n_records = 0
+
+    def __len__(self):
+        return len(self.mlat)
+
+    def cell_index(self, mlat, mlt):
+        """
+        Return the grid cell of each position, -1 for positions below the grid
+        :param mlat: ndarray of magnetic latitudes
+        :param mlt: ndarray of MLT
+        :return: ndarray of int
+        """
+        mlat = np.asarray(mlat, dtype=np.float64)
+        mlt = np.asarray(mlt, dtype=np.float64) % 24
+        band = np.floor((90. - mlat) / self.spacing).astype(int)
+        valid = (band >= 0) & (band < len(self._band_cells))
+        band = np.where(valid, band, 0)
+        n_lt = self._band_cells[band]
+        cell = self._band_start[band] + np.minimum((mlt * n_lt / 24.).astype(int), n_lt - 1)
+        return np.where(valid, cell, -1)
+
+    def _merge(self, kind, count, mean, m2, north, east):
+        n_a = self.count[kind]
+        n = n_a + count
+        delta = mean - self.mean[kind]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(n > 0, count / n, 0.)
+        self.mean[kind] += delta * weight
+        self.m2[kind] += m2 + delta ** 2 * n_a * weight
+        self.count[kind] = n
+        self.north[kind] += north
+        self.east[kind] += east
+
+    def add(self, mlat, mlt, speed, azimuth, kind='los'):
+        """
+        Add a batch of vectors
+        :param mlat: magnetic latitudes
+        :param mlt: magnetic local times
+        :param speed: velocity magnitudes in m/s
+        :param azimuth: velocity azimuths in degrees east of magnetic north
+        :param kind: 'los' or 'fit'
+        """
+        if kind not in KINDS:
+            raise ValueError("Unknown kind {}, expected one of {}".format(kind, KINDS))
+        cell = self.cell_index(mlat, mlt)
+        keep = cell >= 0
+        cell = cell[keep]
+        speed = np.asarray(speed, dtype=np.float64)[keep]
+        azimuth = np.radians(np.asarray(azimuth, dtype=np.float64)[keep])
+        n_cells = len(self)
+        count = np.bincount(cell, minlength=n_cells)
+        total = np.bincount(cell, weights=speed, minlength=n_cells)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, total / count, 0.)
+        m2 = np.bincount(cell, weights=(speed - mean[cell]) ** 2, minlength=n_cells)
+        north = np.bincount(cell, weights=speed * np.cos(azimuth), minlength=n_cells)
+        east = np.bincount(cell, weights=speed * np.sin(azimuth), minlength=n_cells)
+        self._merge(kind, count, mean, m2, north, east)
+
+    def add_record(self, record, fitted=True):
+        """
+        Add the line-of-sight vectors of a map record and, if fitted is True, the fitted velocities at their positions
+        :param record: dictionary as read by pydarn
+        """
+        frame = FrameContext.from_record(record)
+        mlat = np.asarray(record['vector.mlat'], dtype=np.float64)
+        mlt = frame.mlt(record['vector.mlon'])
+        self.add(mlat, mlt, record['vector.vel.median'], record['vector.kvect'], 'los')
+        if fitted:
+            azimuth, speed = fitted_vecs_mlt(frame.rotated_coeffs, mlat, mlt, frame.hmb_lat, frame.order)
+            self.add(mlat, mlt, speed, azimuth, 'fit')
+        self.n_records += 1
+
+    def add_records(self, records, fitted=True):
+        for record in records:
+            self.add_record(record, fitted)
+
+    def add_files(self, filenames, fitted=True, start=None, end=None):
+        """
+        Add every record of map files or store directories, see plotdarn.read_records
+        """
+        from .plotdarn import read_records
+        for filename in filenames:
+            self.add_records(read_records(filename, start, end), fitted)
+
+    def merge(self, other):
+        """
+        Merge the statistics of another accumulator over the same grid into this one
+        :param other: Climatology
+        :return: self
+        """
+        if (other.latmin, other.spacing) != (self.latmin, self.spacing):
+            raise ValueError("Cannot merge climatologies on different grids")
+        for kind in KINDS:
+            self._merge(kind, other.count[kind], other.mean[kind], other.m2[kind], other.north[kind],
+                        other.east[kind])
+        self.n_records += other.n_records
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def statistics(self, kind='los'):
+        """
+        Return the per-cell statistics
+        :return: dict of arrays mlat, mlt, count, mean, std, and the vector mean velocity as north, east, mag, azimuth
+        """
+        count = self.count[kind]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.m2[kind] / (count - 1))
+            north = self.north[kind] / count
+            east = self.east[kind] / count
+        return {
+            'mlat': np.array(self.mlat), 'mlt': np.array(self.mlt), 'count': count.copy(),
+            'mean': np.where(count > 0, self.mean[kind], np.nan), 'std': std,
+            'north': north, 'east': east, 'mag': np.hypot(north, east), 'azimuth': np.degrees(np.arctan2(east, north)),
+        }
+
+    def vector_columns(self, kind='los', min_count=1):
+        """
+        Return the vector mean velocity of the cells holding at least min_count vectors, in the layout of
+        plotting.vector_columns
+        :return: dict of arrays
+        """
+        stats = self.statistics(kind)
+        keep = stats['count'] >= min_count
+        mlat, mlt, mag, ang = stats['mlat'][keep], stats['mlt'][keep], stats['mag'][keep], stats['azimuth'][keep]
+        x, y = convert.mlat_mlt_to_xy(mlat, mlt)
+        return dict(x=x, y=y, m=mag, le=scale_velocity(mag), an=convert.xy_angle_to_origin(x, y, ang),
+                    mlat=mlat, mlt=mlt, ang=ang, count=stats['count'][keep], std=stats['std'][keep])
+
+    def layers(self, kind='los', min_count=1):
+        """
+        Return layers for plotdarn.render_layers, with the grid's lowest latitude drawn as the boundary
+        """
+        inside = self.vector_columns(kind, min_count)
+        outside = {name: values[:0] for name, values in inside.items()}
+        mlt = np.linspace(0, 24, 97)
+        return {
+            'coastlines': ([], []),
+            'boundary': convert.mlat_mlt_to_xy(np.full_like(mlt, self.latmin), mlt),
+            'vectors': (inside, outside),
+        }
+
+    def save(self, filename):
+        """
+        Write the accumulator to a .npz file
+        """
+        arrays = {'grid': np.array([self.latmin, self.spacing]), 'n_records': np.array(self.n_records)}
+        for kind in KINDS:
+            for name in ('count', 'mean', 'm2', 'north', 'east'):
+                arrays['{}.{}'.format(kind, name)] = getattr(self, name)[kind]
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read an accumulator written by save
+        :return: Climatology
+        """
+        with np.load(filename) as data:
+            latmin, spacing = data['grid']
+            clim = cls(float(latmin), float(spacing))
+            clim.n_records = int(data['n_records'])
+            for kind in KINDS:
+                for name in ('count', 'mean', 'm2', 'north', 'east'):
+                    getattr(clim, name)[kind] = data['{}.{}'.format(kind, name)]
+        return clim
@@ -1,8 +1,11 @@
 from .locations import Location
-import aacgmv2
+from .utils import get_precision
+import threading
 import datetime as dt
 import numpy as np
 
+_local = threading.local()
+
 
 def loc_mag_to_geo(loc, dtime):
     """
@@ -14,6 +17,7 @@ def loc_mag_to_geo(loc, dtime):
     :return:
         location.Location object with longitude and latitude in geodetic coords
     """
+    import aacgmv2
     dtime = _check_time(dtime)
 
     converted = aacgmv2.convert_latlon(loc.lat, loc.lon, 100, dtime, method_code='A2G')
@@ -30,6 +34,7 @@ def arr_mag_to_geo(latitudes, longitudes, dtime):
     :param dtime: datetime
     :return: array with lat and lon in that order
     """
+    import aacgmv2
     dtime = _check_time(dtime)
     _check_arrays(latitudes, longitudes)
 
@@ -47,6 +52,7 @@ def loc_geo_to_mag(loc, dtime):
     :return:
         location.Location object with longitude and latitude in geomagnetic coords
     """
+    import aacgmv2
     dtime = _check_time(dtime)
 
     converted = aacgmv2.convert_latlon(loc.lat, loc.lon, 100, dtime, method_code='G2A')
@@ -63,6 +69,7 @@ def arr_geo_to_mag(latitudes, longitudes, dtime):
     :param dtime: datetime
     :return: array with lat and lon in that order
     """
+    import aacgmv2
     dtime = _check_time(dtime)
     _check_arrays(latitudes, longitudes)
 
@@ -71,25 +78,69 @@ def arr_geo_to_mag(latitudes, longitudes, dtime):
 
 
 def mlon_to_mlt(mlon, dtime):
+    import aacgmv2
     return aacgmv2.convert_mlt(mlon, dtime, m2a=False)
 
 
-def mlat_mlt_to_xy(mlat, mlt):
+def mlat_mlt_to_xy(mlat, mlt, dtype=None, out=None, work=None):
+    """
+    Project magnetic latitude and MLT onto the polar plot plane
+    :param out: optional (x, y) float64 arrays to write into, in which case dtype is ignored
+    :param work: optional float64 scratch array shaped like the outputs, used with out. Defaults to this thread's
+        workspace buffer, see thread_workspace.
+    :return: x, y
+    """
+    if out is not None:
+        x, y = out
+        _project(np.asarray(mlat), np.asarray(mlt), x, y, _work(x, work))
+        return x, y
     r = (90. - np.abs(mlat))
     a = (np.array(mlt) - 6.) / 12. * np.pi
-    return r * np.cos(a), r * np.sin(a)
+    x, y = r * np.cos(a), r * np.sin(a)
+    dtype = get_precision(dtype)
+    if dtype != np.float64:
+        # Projected in float64 and rounded once
+        return np.asarray(x).astype(dtype), np.asarray(y).astype(dtype)
+    return x, y
 
 
-def xy_to_mlat_mlt(x, y):
-    x, y = np.array(x, ndmin=1), np.array(y, ndmin=1)
-    lat = 90 - np.sqrt(x**2 + y**2)
-    mlt = np.arctan2(y, x)*12/np.pi + 6
-    mlt[mlt < 0] += 24
-    mlt[mlt > 24] -= 24
+def xy_to_mlat_mlt(x, y, out=None):
+    """
+    Inverse of mlat_mlt_to_xy
+    :param out: optional (mlat, mlt) float64 arrays to write into
+    :return: mlat, mlt
+    """
+    if out is None:
+        x, y = np.array(x, ndmin=1), np.array(y, ndmin=1)
+        lat = 90 - np.sqrt(x**2 + y**2)
+        mlt = np.arctan2(y, x)*12/np.pi + 6
+        mlt[mlt < 0] += 24
+        mlt[mlt > 24] -= 24
+        return lat, mlt
+    lat, mlt = out
+    np.multiply(x, x, out=lat)
+    np.multiply(y, y, out=mlt)
+    np.add(lat, mlt, out=lat)
+    np.sqrt(lat, out=lat)
+    np.subtract(90, lat, out=lat)
+    np.arctan2(y, x, out=mlt)
+    np.multiply(mlt, 12, out=mlt)
+    np.divide(mlt, np.pi, out=mlt)
+    np.add(mlt, 6, out=mlt)
+    np.add(mlt, 24, out=mlt, where=mlt < 0)
+    np.subtract(mlt, 24, out=mlt, where=mlt > 24)
     return lat, mlt
 
 
-def xy_angle_to_origin(x, y, angle):
+def xy_angle_to_origin(x, y, angle, out=None, work=None):
+    """
+    Convert azimuths east of magnetic north at plot positions into screen angles
+    :param out: optional float64 array to write into
+    :param work: optional float64 scratch array shaped like out, this thread's workspace buffer by default
+    """
+    if out is not None:
+        _screen_angle(x, y, angle, out, _work(out, work))
+        return out
     if not isinstance(angle, np.ndarray):
         angle = np.array(angle)
     if not isinstance(x, np.ndarray):
@@ -102,6 +153,107 @@ def xy_angle_to_origin(x, y, angle):
     return result
 
 
+# The kernels below evaluate the same expressions as mlat_mlt_to_xy, xy_angle_to_origin and utils.scale_velocity, in
+# the same order so that results are bit for bit identical, but write every step into the given buffers.
+
+def _project(mlat, mlt, x, y, work):
+    np.subtract(mlt, 6., out=work)
+    np.divide(work, 12., out=work)
+    np.multiply(work, np.pi, out=work)
+    np.cos(work, out=x)
+    np.sin(work, out=y)
+    np.abs(mlat, out=work)
+    np.subtract(90., work, out=work)
+    np.multiply(work, x, out=x)
+    np.multiply(work, y, out=y)
+
+
+def _screen_angle(x, y, angle, out, work):
+    np.arctan2(y, x, out=out)
+    np.degrees(out, out=out)
+    np.subtract(180, angle, out=work)
+    np.subtract(180, work, out=work)
+    np.subtract(work, out, out=out)
+    np.subtract(180, out, out=out)
+    np.remainder(out, 360, out=out)
+
+
+class ProjectionWorkspace(object):
+    """
+    Reusable buffers for project_vectors, grown to the largest frame seen. The arrays returned by project are views
+    of the buffers, valid until the next call, so a workspace must not be shared between threads.
+    :param size: initial number of points
+    """
+
+    NAMES = ('x', 'y', 'an', 'le', 'work')
+
+    def __init__(self, size=0):
+        self.size = 0
+        self._buffers = {}
+        self.reserve(size)
+
+    def reserve(self, size):
+        """
+        Make room for at least size points
+        """
+        if size > self.size or not self._buffers:
+            self.size = max(size, self.size)
+            self._buffers = {name: np.empty(self.size) for name in self.NAMES}
+
+    def views(self, size):
+        self.reserve(size)
+        return {name: buffer[:size] for name, buffer in self._buffers.items()}
+
+    def project(self, mlat, mlt, ang, mag, length=5):
+        """
+        Plot positions, screen angles and scaled lengths of vectors in one pass, see project_vectors
+        :return: dict of x, y, an and le views
+        """
+        return project_vectors(mlat, mlt, ang, mag, length, workspace=self)
+
+
+def thread_workspace():
+    """
+    Return this thread's ProjectionWorkspace, created on first use
+    """
+    if not hasattr(_local, 'workspace'):
+        _local.workspace = ProjectionWorkspace()
+    return _local.workspace
+
+
+def _work(like, work=None):
+    # Scratch for the kernels from this thread's workspace, unless the caller gives its own
+    if work is not None:
+        return work
+    return thread_workspace().views(like.size)['work'].reshape(like.shape)
+
+
+def project_vectors(mlat, mlt, ang, mag, length=5, workspace=None):
+    """
+    Fused projection of vectors: plot x and y as mlat_mlt_to_xy, the screen angle 'an' as xy_angle_to_origin and the
+    scaled length 'le' as utils.scale_velocity, without temporary arrays
+    :param mlat: ndarray of magnetic latitudes
+    :param mlt: ndarray of MLT
+    :param ang: ndarray of azimuths in degrees east of magnetic north
+    :param mag: ndarray of speeds
+    :param length: plot length of 1000 m/s
+    :param workspace: ProjectionWorkspace providing the buffers, new arrays are allocated if None
+    :return: dict of float64 arrays x, y, an and le, views of the workspace buffers if one is given
+    """
+    mlat = np.asarray(mlat, dtype=np.float64)
+    n = len(mlat)
+    if workspace is None:
+        out = {name: np.empty(n) for name in ProjectionWorkspace.NAMES}
+    else:
+        out = workspace.views(n)
+    work = out.pop('work')
+    _project(mlat, np.asarray(mlt, dtype=np.float64), out['x'], out['y'], work)
+    _screen_angle(out['x'], out['y'], np.asarray(ang, dtype=np.float64), out['an'], work)
+    np.multiply(np.asarray(mag, dtype=np.float64), length / 1000, out=out['le'])
+    np.add(out['le'], 1e-10, out=out['le'])
+    return out
+
+
 def _check_time(dtime):
     if isinstance(dtime, str):
         try:
@@ -1,7 +1,7 @@
+import functools
 import numpy as np
-import copy
-import aacgmv2
-import scipy.special
+from plotdarn import convert
+from .utils import get_precision
 
 
 ORDER = 6
@@ -46,6 +46,7 @@ def sdarn_ylm(l, m, theta, phi):
     Calculate the spherical harmonic Ylm of degree l and order m (-l <= m <= l) for the values of
     theta and phi. In general Ylm is complex; return a [Re(Ylm), Im(Ylm)]
     """
+    import scipy.special
     if m >= 0:
         phase = 1
     else:
@@ -54,31 +55,141 @@ def sdarn_ylm(l, m, theta, phi):
     return ylm_intermediate * np.cos(m * phi), ylm_intermediate * np.sin(m * phi)
 
 
-def sdarn_get_potential(coeffs, hmb_lat, mag_lat, mag_LT):
+@functools.lru_cache(maxsize=None)
+def coeff_index(order):
     """
-    Expand the spherical harmonic series with the map-pot coefficients
-    to give the electrostatic potential at a particular magnetic latitude
-    and local time position
+    Index tables of the terms of an expansion of the given order, ordered by degree then order.
+    For m > 0 the cosine coefficient is at k and the sine coefficient at k + 1.
+    :param order: fit order
+    :return: arrays l, m and k
+    """
+    l = np.array([l for l in range(order + 1) for m in range(l + 1)])
+    m = np.array([m for l in range(order + 1) for m in range(l + 1)])
+    k = np.where(m == 0, l * l, l * l + 2 * m - 1)
+    for arr in (l, m, k):
+        arr.flags.writeable = False
+    return l, m, k
+
+
+@functools.lru_cache(maxsize=None)
+def _legendre_factors(order):
+    """
+    Recurrence factors for legendre: the starting factors (2m - 1)!! with Condon-Shortley phase for each m, and for
+    each term with l >= m + 2 the factors (2l - 1) / (l - m) and (l + m - 1) / (l - m)
+    """
+    m = np.arange(order + 1)
+    pmm = np.cumprod(np.concatenate([[1.0], -(2. * m[1:] - 1)]))
+    l, mm, _ = coeff_index(order)
+    a = (2. * l - 1) / np.maximum(l - mm, 1)
+    b = (l + mm - 1.) / np.maximum(l - mm, 1)
+    return pmm, a, b
+
+
+def legendre(order, x):
     """
+    Evaluate the associated Legendre functions P_l^m(x), including the Condon-Shortley phase as in
+    scipy.special.lpmv, for all 0 <= m <= l <= order using the stable upward recurrence in l
+    :param order: fit order
+    :param x: ndarray of values within [-1, 1]
+    :return: ndarray of shape (n_terms, len(x)) in the order of coeff_index
+    """
+    x = np.asarray(x, dtype=np.float64)
+    l, m, _ = coeff_index(order)
+    pmm, a, b = _legendre_factors(order)
+    somx2 = np.sqrt(np.clip((1. - x) * (1. + x), 0, None))
+    # Index of term (l, m) is l * (l + 1) / 2 + m
+    plm = np.empty((len(l),) + x.shape)
+    for mm in range(order + 1):
+        i_mm = mm * (mm + 1) // 2 + mm
+        plm[i_mm] = pmm[mm] * somx2 ** mm
+        if mm + 1 <= order:
+            i_next = (mm + 1) * (mm + 2) // 2 + mm
+            plm[i_next] = x * (2 * mm + 1) * plm[i_mm]
+        for ll in range(mm + 2, order + 1):
+            i = ll * (ll + 1) // 2 + mm
+            plm[i] = a[i] * x * plm[i - ll] - b[i] * plm[i - ll - (ll - 1)]
+    return plm
+
+
+def coeff_order(coeffs, order=None):
+    """
+    Return the fit order to use for a coefficient vector: ``order`` if given, otherwise the largest order whose
+    (order + 1) ** 2 terms the vector holds
+    """
+    if order is not None:
+        return order
+    n = int(np.sqrt(np.shape(coeffs)[-1]))
+    return n - 1 if n > 0 else ORDER
+
+
+def fit_order(record):
+    """
+    Return the fit order of a map record
+    """
+    return int(record.get('fit.order', ORDER))
+
+
+def potential_basis(hmb_lat, mag_lat, mag_LT, order=ORDER):
+    """
+    Matrix mapping a coefficient vector to the potential at each position, so that the potential is
+    ``potential_basis(...) @ coeffs[:(order + 1) ** 2]``. Rows of positions beyond the boundary are zero.
+    :param hmb_lat: Heppner-Maynard boundary latitude
+    :param mag_lat: ndarray of magnetic latitudes
+    :param mag_LT: ndarray of magnetic local times
+    :param order: fit order
+    :return: ndarray of shape (n_positions, (order + 1) ** 2)
+    """
+    mag_lat = np.atleast_1d(np.asarray(mag_lat, dtype=np.float64))
+    mag_LT = np.atleast_1d(np.asarray(mag_LT, dtype=np.float64))
     phi = 2 * np.pi * mag_LT / 24
     theta = np.pi * (90 - mag_lat) / (90 - abs(hmb_lat))
-    if theta > np.pi:
-        return 0
-    pot = 0.0
-    for l in range(ORDER + 1):
-        for m in range(l + 1):
-            if l == 0:
-                k = 0
-            elif m == 0:
-                k = l * l
-            else:
-                k = l * l + 2 * m - 1
-            ylm = sdarn_ylm(l, m, theta, phi)
-            pot = pot + coeffs[k] * ylm[0] + coeffs[k + 1] * ylm[1]
+    _, m, k = coeff_index(order)
+    plm = legendre(order, np.cos(theta))
+    plm[:, theta > np.pi] = 0
+    mphi = np.multiply.outer(m, phi)
+    basis = np.zeros(((order + 1) ** 2, len(phi)))
+    basis[k] = plm * np.cos(mphi)
+    sine = m > 0
+    basis[k[sine] + 1] = plm[sine] * np.sin(mphi[sine])
+    return basis.T
+
+
+def velocity_basis(hmb_lat, mag_lat, mag_LT, order=ORDER):
+    """
+    Matrices mapping a coefficient vector to the meridional and zonal plasma drift velocity at each position,
+    using the same finite differences as sdarn_get_efield
+    :return: meridional and zonal ndarrays of shape (n_positions, (order + 1) ** 2)
+    """
+    mag_lat = np.atleast_1d(np.asarray(mag_lat, dtype=np.float64))
+    mag_LT = np.atleast_1d(np.asarray(mag_LT, dtype=np.float64))
+    pot0 = potential_basis(hmb_lat, mag_lat, mag_LT, order)
+    pot1 = potential_basis(hmb_lat, mag_lat + DELTA_LAT, mag_LT, order)
+    pot2 = potential_basis(hmb_lat, mag_lat, mag_LT + DELTA_LT, order)
+
+    colat = np.deg2rad(90 - mag_lat)[:, np.newaxis]
+    e_meridional = (pot1 - pot0) / (2 * np.pi * RE * (DELTA_LAT / 360))
+    e_zonal = (pot2 - pot0) / (2 * np.pi * RE * np.sin(colat) * (DELTA_LT / 24))
+
+    b = BEQ * np.sqrt(1 + 3 * np.cos(colat) ** 2) * (RE / (RE + ALT)) ** 3
+    return -e_zonal / b, e_meridional / b
+
+
+def sdarn_get_potential(coeffs, hmb_lat, mag_lat, mag_LT, order=None):
+    """
+    Expand the spherical harmonic series with the map-pot coefficients
+    to give the electrostatic potential at a particular magnetic latitude
+    and local time position. Positions may be arrays; the order defaults to
+    the one implied by the number of coefficients.
+    """
+    order = coeff_order(coeffs, order)
+    coeffs = np.asarray(coeffs, dtype=np.float64)[..., :(order + 1) ** 2]
+    pot = potential_basis(hmb_lat, mag_lat, mag_LT, order) @ coeffs
+    if np.ndim(mag_lat) == 0 and np.ndim(mag_LT) == 0:
+        return float(pot[0])
     return pot
 
 
-def sdarn_get_efield(coeffs, hmb_lat, mag_lat, mag_LT):
+def sdarn_get_efield(coeffs, hmb_lat, mag_lat, mag_LT, order=None):
     """
     Determine the meridional and zonal electric field components at a particular
     magnetic latitude and local time. In this version evaluates the potential at
@@ -86,9 +197,9 @@ def sdarn_get_efield(coeffs, hmb_lat, mag_lat, mag_LT):
     differentiate the spherical harmonic expansion.
     """
 
-    pot0 = sdarn_get_potential(coeffs, hmb_lat, mag_lat, mag_LT)
-    pot1 = sdarn_get_potential(coeffs, hmb_lat, mag_lat + DELTA_LAT, mag_LT)
-    pot2 = sdarn_get_potential(coeffs, hmb_lat, mag_lat, mag_LT + DELTA_LT)
+    pot0 = sdarn_get_potential(coeffs, hmb_lat, mag_lat, mag_LT, order)
+    pot1 = sdarn_get_potential(coeffs, hmb_lat, np.add(mag_lat, DELTA_LAT), mag_LT, order)
+    pot2 = sdarn_get_potential(coeffs, hmb_lat, mag_lat, np.add(mag_LT, DELTA_LT), order)
 
     e_meridional = (pot1 - pot0) / (2 * np.pi * RE * (DELTA_LAT / 360))
     e_zonal = (pot2 - pot0) / (2 * np.pi * RE * np.sin(np.deg2rad(90 - mag_lat)) * (DELTA_LT / 24))
@@ -96,12 +207,12 @@ def sdarn_get_efield(coeffs, hmb_lat, mag_lat, mag_LT):
     return e_meridional, e_zonal
 
 
-def sdarn_get_vel(coeffs, hmb_lat, mag_lat, mag_LT):
+def sdarn_get_vel(coeffs, hmb_lat, mag_lat, mag_LT, order=None):
     """
     Determine the meridional and zonal plasma drift velocity components at a particular
     magnetic latitude and local time
     """
-    emeri, ezone = sdarn_get_efield(coeffs, hmb_lat, mag_lat, mag_LT)
+    emeri, ezone = sdarn_get_efield(coeffs, hmb_lat, mag_lat, mag_LT, order)
 
     b = BEQ * np.sqrt(1 + 3 * np.cos(np.deg2rad(90 - mag_lat)) ** 2) * (RE / (RE + ALT)) ** 3
 
@@ -111,17 +222,22 @@ def sdarn_get_vel(coeffs, hmb_lat, mag_lat, mag_LT):
     return v_meridional, v_zonal
 
 
-def sdarn_rotate_coeffs(coeffs, ut):
+def sdarn_rotate_coeffs(coeffs, ut, order=None):
     """
-    Rotate map-pot coefficients from magnetic longitude to MLT grid
+    Rotate map-pot coefficients from magnetic longitude to MLT grid. Several coefficient vectors can be rotated at
+    once by stacking them in the rows of ``coeffs`` with one ``ut`` per row.
     """
-    d_phi = 2 * np.pi * (ut - 4.73) / 24
-    new_coeffs = copy.copy(coeffs)
-    for m in range(1, ORDER + 1):
-        for l in range(m, ORDER + 1):
-            k = l * l + 2 * m - 1
-            new_coeffs[k] = coeffs[k] * np.cos(m * d_phi) - coeffs[k + 1] * np.sin(m * d_phi)
-            new_coeffs[k + 1] = coeffs[k + 1] * np.cos(m * d_phi) + coeffs[k] * np.sin(m * d_phi)
+    order = coeff_order(coeffs, order)
+    coeffs = np.asarray(coeffs, dtype=np.float64)
+    new_coeffs = coeffs.copy()
+    _, m, k = coeff_index(order)
+    sine = m > 0
+    m, k = m[sine], k[sine]
+    d_phi = 2 * np.pi * (np.asarray(ut, dtype=np.float64) - 4.73) / 24
+    mphi = np.multiply.outer(d_phi, m)
+    cos, sin = np.cos(mphi), np.sin(mphi)
+    new_coeffs[..., k] = coeffs[..., k] * cos - coeffs[..., k + 1] * sin
+    new_coeffs[..., k + 1] = coeffs[..., k + 1] * cos + coeffs[..., k] * sin
 
     return new_coeffs
 
@@ -133,13 +249,13 @@ def sdarn_maglon2MLT(mag_lon, ut):
     return (mag_lon/15 + (ut-4.73) + 48) % 24
 
 
-def sdarn_get_fitted(coeffs, hmb_lat, mag_lat, mag_LT):
+def sdarn_get_fitted(coeffs, hmb_lat, mag_lat, mag_LT, order=None):
     """
     Calculate fitted vectors with MLT and already rotated coeffs
     """
 
     # get meridional and zonal plasma drift velocity components
-    vmeri, vzone = sdarn_get_vel(coeffs, hmb_lat, mag_lat, mag_LT)
+    vmeri, vzone = sdarn_get_vel(coeffs, hmb_lat, mag_lat, mag_LT, order)
 
     # Fitted azimuth and magnitude
     fitv_azi = np.degrees(np.arctan2(vzone, vmeri))
@@ -148,18 +264,31 @@ def sdarn_get_fitted(coeffs, hmb_lat, mag_lat, mag_LT):
     return fitv_azi, fitv_mag
 
 
-def fitted_vecs(coeffs, mlat, mlon, dtime, minlat=50):
+def fitted_vecs(coeffs, mlat, mlon, dtime, minlat=50, order=None):
+    import aacgmv2
     ut = (dtime - dtime.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
-    rotated_coeffs = sdarn_rotate_coeffs(coeffs, ut)
+    rotated_coeffs = sdarn_rotate_coeffs(coeffs, ut, order)
     mlts = aacgmv2.convert_mlt(mlon, dtime)
+    return fitted_vecs_mlt(rotated_coeffs, mlat, mlts, minlat, order)
 
-    azimuths = []
-    magnitudes = []
 
-    for i in range(len(mlon)):
-        azi, mag = sdarn_get_fitted(rotated_coeffs, minlat, mlat[i], mlts[i])
-        azimuths.append(azi)
-        magnitudes.append(mag)
+def fitted_vecs_mlt(rotated_coeffs, mlat, mlts, minlat=50, order=None, dtype=None):
+    """
+    Calculate fitted vectors from coefficients already rotated to MLT, at positions already converted to MLT.
+    The basis is always built in float64, dtype (see utils.get_precision) applies to the product and results.
+    :return: arrays of azimuths and magnitudes
+    """
+    order = coeff_order(rotated_coeffs, order)
+    dtype = get_precision(dtype)
+    vmeri_basis, vzone_basis = velocity_basis(minlat, mlat, mlts, order)
+    vmeri_basis = vmeri_basis.astype(dtype, copy=False)
+    vzone_basis = vzone_basis.astype(dtype, copy=False)
+    coeffs = np.asarray(rotated_coeffs, dtype=dtype)[:(order + 1) ** 2]
+    vmeri = vmeri_basis @ coeffs
+    vzone = vzone_basis @ coeffs
+
+    azimuths = np.degrees(np.arctan2(vzone, vmeri))
+    magnitudes = np.sqrt(vzone ** 2 + vmeri ** 2)
 
     return azimuths, magnitudes
 
@@ -188,6 +317,7 @@ def sdarn_get_fitted_AACGM(coeffs, hmb_lat, mag_lat, mag_lon, ut, dtime):
     """
     Calculate fitted vectors azimuth and magnitude using AACGMv2 MLT values
     """
+    import aacgmv2
 
     # get MLT
     mag_LT = aacgmv2.convert_mlt(mag_lon, dtime)[0]
@@ -205,14 +335,245 @@ def sdarn_get_fitted_AACGM(coeffs, hmb_lat, mag_lat, mag_lon, ut, dtime):
     return fitv_azi, fitv_mag
 
 
-def sdarn_get_potential_grid(coeffs, hmb_lat=50):
-    pot_grid = np.zeros((80, 80))
-    for i in range(0, 80):
-        for j in range(0, 80):
-            x = i-39.5
-            y = j-39.5
-            mag_lat = 90 - np.sqrt(x**2 + y**2)
-            mag_LT = 24 * np.arctan2(x, -y) / (2 * np.pi)
-            pot_grid[i, j] = sdarn_get_potential(coeffs, hmb_lat, mag_lat, mag_LT)
-    return pot_grid
+# Grid bases computed elsewhere, e.g. views of shared memory, keyed by (grid name, grid key)
+_INSTALLED_BASES = {}
 
+
+def install_grid_basis(name, key, basis):
+    """
+    Use a precomputed basis matrix for a grid instead of computing it, see grid_basis
+    :param name: 'potential_grid' or 'polar_grid'
+    :param key: the arguments of the grid, (hmb_lat, order, size) or (hmb_lat, order, n_r, n_lt)
+    :param basis: read-only ndarray
+    """
+    _INSTALLED_BASES[(name, (float(key[0]),) + tuple(int(k) for k in key[1:]))] = basis
+
+
+# At order 12 an 80 x 80 float64 basis is about 9 MB and the boundary latitude varies between records, so only the
+# bases of the few most recent grids are kept
+GRID_BASIS_CACHE = 8
+
+
+def _build_potential_grid_basis(hmb_lat, order, size):
+    installed = _INSTALLED_BASES.get(('potential_grid', (hmb_lat, order, size)))
+    if installed is not None:
+        return installed
+    offsets = np.arange(size) - (size - 1) / 2.
+    x, y = np.meshgrid(offsets, offsets)
+    mag_lat, mag_LT = convert.xy_to_mlat_mlt(x.ravel(), y.ravel())
+    return potential_basis(hmb_lat, mag_lat, mag_LT, order)
+
+
+@functools.lru_cache(maxsize=GRID_BASIS_CACHE)
+def _potential_grid_basis(hmb_lat, order, size, dtype=np.dtype(np.float64)):
+    # Other precisions are rounded from a float64 basis that is not cached itself
+    basis = _build_potential_grid_basis(hmb_lat, order, size)
+    if dtype != np.float64:
+        basis = basis.astype(dtype)
+    basis.flags.writeable = False
+    return basis
+
+
+def sdarn_get_potential_grid(coeffs, hmb_lat=50, order=None, size=80, dtype=None):
+    """
+    Evaluate the potential on a size x size grid with unit spacing centred on the pole. Rows increase in y and
+    columns in x of the plot plane of convert.mlat_mlt_to_xy. The basis matrix of the grid is cached per boundary
+    latitude, order and precision (see utils.get_precision), so each call is a single matrix product.
+    """
+    order = coeff_order(coeffs, order)
+    dtype = get_precision(dtype)
+    coeffs = np.asarray(coeffs, dtype=dtype)[..., :(order + 1) ** 2]
+    pot_grid = _potential_grid_basis(float(hmb_lat), order, size, dtype) @ coeffs
+    return pot_grid.reshape((size, size))
+
+
+def _build_polar_grid_basis(hmb_lat, order, n_r, n_lt):
+    installed = _INSTALLED_BASES.get(('polar_grid', (hmb_lat, order, n_r, n_lt)))
+    if installed is not None:
+        return installed
+    colat = np.linspace(0, 90 - abs(hmb_lat), n_r)
+    mag_LT = np.arange(n_lt) * 24. / n_lt
+    mag_lat, mag_LT = np.meshgrid(90 - colat, mag_LT, indexing='ij')
+    return potential_basis(hmb_lat, mag_lat.ravel(), mag_LT.ravel(), order)
+
+
+@functools.lru_cache(maxsize=GRID_BASIS_CACHE)
+def _polar_grid_basis(hmb_lat, order, n_r, n_lt, dtype=np.dtype(np.float64)):
+    basis = _build_polar_grid_basis(hmb_lat, order, n_r, n_lt)
+    if dtype != np.float64:
+        basis = basis.astype(dtype)
+    basis.flags.writeable = False
+    return basis
+
+
+def grid_basis(name, *key):
+    """
+    Return the cached basis matrix of a grid
+    :param name: 'potential_grid' for sdarn_get_potential_grid or 'polar_grid' for polar_potential_grid
+    :param key: (hmb_lat, order, size) or (hmb_lat, order, n_r, n_lt)
+    """
+    build = {'potential_grid': _potential_grid_basis, 'polar_grid': _polar_grid_basis}[name]
+    return build(float(key[0]), *[int(k) for k in key[1:]])
+
+
+def polar_potential_grid(coeffs, hmb_lat=50, n_r=16, n_lt=64, order=None, dtype=None):
+    """
+    Evaluate the potential on a polar grid of n_r rings evenly spaced in colatitude from the pole to the boundary
+    latitude, by n_lt magnetic local times from 0 MLT. The basis matrix is cached per grid and precision.
+    :return: ndarray of shape (n_r, n_lt)
+    """
+    order = coeff_order(coeffs, order)
+    dtype = get_precision(dtype)
+    coeffs = np.asarray(coeffs, dtype=dtype)[..., :(order + 1) ** 2]
+    pot = _polar_grid_basis(float(hmb_lat), order, n_r, n_lt, dtype) @ coeffs
+    return pot.reshape((n_r, n_lt))
+
+
+def adaptive_potential_grid(coeffs, hmb_lat=50, order=None, levels=(), spacing=0.25, coarse=4.0, max_variation=None,
+                            extent=40.):
+    """
+    Evaluate the potential on a fine grid laid out like sdarn_get_potential_grid's, rows increasing in y and columns
+    in x of the plot plane, but only where it is needed.
+    The grid starts with cells of the coarse spacing. Each cell is split in four (a quadtree) while a contour level
+    lies between its corner values or they differ by more than max_variation, down to the fine spacing. The nodes
+    inside cells that are not split are interpolated bilinearly from the cell corners. Nodes beyond the boundary
+    latitude, where the potential is zero, and cells that are entirely beyond it are never evaluated.
+    :param coeffs: rotated map-pot coefficients
+    :param hmb_lat: Heppner-Maynard boundary latitude
+    :param order: fit order, defaults to the one implied by the number of coefficients
+    :param levels: potential contour levels to resolve
+    :param spacing: fine grid spacing in degrees, a power of two fraction of coarse
+    :param coarse: initial cell size in degrees, which must divide 2 * extent
+    :param max_variation: optional largest potential difference across a cell that is not split
+    :param extent: half width of the grid in degrees
+    :return: ndarray of shape (n, n) with n = 2 * extent / spacing + 1, and a dict with the number of evaluations,
+        the number a uniform grid of the same spacing takes ('uniform', as sdarn_get_potential_grid evaluates every
+        node) and how many of those are within the boundary ('uniform_inside'), and the evaluations saved versus
+        the uniform grid
+    """
+    order = coeff_order(coeffs, order)
+    coeffs = np.asarray(coeffs, dtype=np.float64)[:(order + 1) ** 2]
+    step = int(round(coarse / spacing))
+    n_cells = int(round(2. * extent / coarse))
+    if step < 1 or step & (step - 1) or not np.isclose(step * spacing, coarse) or \
+            not np.isclose(n_cells * coarse, 2. * extent):
+        raise ValueError("coarse must be a power of two multiple of spacing and divide 2 * extent")
+    size = n_cells * step + 1
+    radius = 90 - abs(hmb_lat)
+    levels = np.sort(np.asarray(levels, dtype=np.float64))
+    grid = np.zeros((size, size))
+    evaluated = np.zeros((size, size), dtype=bool)
+    evaluations = [0]
+
+    def evaluate(rows, cols):
+        rows, cols = np.divmod(np.unique(rows * size + cols), size)
+        new = ~evaluated[rows, cols]
+        rows, cols = rows[new], cols[new]
+        evaluated[rows, cols] = True
+        x = cols * spacing - extent
+        y = rows * spacing - extent
+        inside = x ** 2 + y ** 2 <= radius ** 2
+        if np.any(inside):
+            mag_lat, mag_LT = convert.xy_to_mlat_mlt(x[inside], y[inside])
+            grid[rows[inside], cols[inside]] = potential_basis(hmb_lat, mag_lat, mag_LT, order) @ coeffs
+            evaluations[0] += int(np.count_nonzero(inside))
+
+    def fill(i0, j0, c, corners):
+        offsets = np.arange(c + 1)
+        u = (offsets / float(c))[np.newaxis, :, np.newaxis]
+        w = (offsets / float(c))[np.newaxis, np.newaxis, :]
+        v00, v01, v10, v11 = [v[:, np.newaxis, np.newaxis] for v in corners]
+        values = (v00 * (1 - u) + v10 * u) * (1 - w) + (v01 * (1 - u) + v11 * u) * w
+        rows = np.broadcast_to(i0[:, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis], values.shape)
+        cols = np.broadcast_to(j0[:, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :], values.shape)
+        # Nodes beyond the boundary stay zero
+        free = ~evaluated[rows, cols] & ((rows * spacing - extent) ** 2 + (cols * spacing - extent) ** 2 <= radius ** 2)
+        grid[rows[free], cols[free]] = values[free]
+
+    i0, j0 = [a.ravel() for a in np.meshgrid(np.arange(n_cells) * step, np.arange(n_cells) * step, indexing='ij')]
+    corners = np.arange(0, size, step)
+    evaluate(*[a.ravel() for a in np.meshgrid(corners, corners, indexing='ij')])
+    c = step
+    while c > 1 and len(i0):
+        corners = grid[i0, j0], grid[i0, j0 + c], grid[i0 + c, j0], grid[i0 + c, j0 + c]
+        low = np.minimum.reduce(corners)
+        high = np.maximum.reduce(corners)
+        split = np.searchsorted(levels, high, 'right') > np.searchsorted(levels, low, 'left')
+        if max_variation is not None:
+            split |= high - low > max_variation
+        # Distance from the pole to the nearest point of each cell
+        x0, y0 = i0 * spacing - extent, j0 * spacing - extent
+        near_x = np.clip(0, x0, x0 + c * spacing)
+        near_y = np.clip(0, y0, y0 + c * spacing)
+        split &= near_x ** 2 + near_y ** 2 <= radius ** 2
+
+        keep = ~split
+        fill(i0[keep], j0[keep], c, [v[keep] for v in corners])
+        half = c // 2
+        i0, j0 = i0[split], j0[split]
+        evaluate(np.concatenate([i0 + half, i0 + half, i0, i0 + c, i0 + half]),
+                 np.concatenate([j0, j0 + c, j0 + half, j0 + half, j0 + half]))
+        i0, j0 = np.concatenate([i0, i0 + half, i0, i0 + half]), np.concatenate([j0, j0, j0 + half, j0 + half])
+        c = half
+
+    x = np.arange(size) * spacing - extent
+    uniform_inside = int(np.count_nonzero(x[:, np.newaxis] ** 2 + x[np.newaxis, :] ** 2 <= radius ** 2))
+    stats = {'evaluations': evaluations[0], 'uniform': size * size, 'uniform_inside': uniform_inside,
+             'saved': size * size - evaluations[0], 'spacing': spacing}
+    return grid, stats
+
+
+@functools.lru_cache(maxsize=16)
+def equal_area_grid(latmin=50, spacing=1.0):
+    """
+    Cell centres of an equal-area grid: latitude bands ``spacing`` degrees wide from the pole down to ``latmin``,
+    each split into as many MLT cells as keep the cells roughly ``spacing`` degrees wide along the band
+    :return: read-only arrays of magnetic latitude and MLT
+    """
+    edges = np.arange(90., latmin - 1e-9, -spacing)
+    centres = edges[:-1] - spacing / 2.
+    n_lt = np.maximum(np.round(360. * np.cos(np.deg2rad(centres)) / spacing).astype(int), 1)
+    mlat = np.repeat(centres, n_lt)
+    mlt = np.concatenate([(np.arange(n) + 0.5) * 24. / n for n in n_lt])
+    for arr in (mlat, mlt):
+        arr.flags.writeable = False
+    return mlat, mlt
+
+
+@functools.lru_cache(maxsize=16)
+def _grid_velocity_basis(hmb_lat, latmin, spacing, order, dtype=np.dtype(np.float64)):
+    if dtype != np.float64:
+        basis = _grid_velocity_basis(hmb_lat, latmin, spacing, order).astype(dtype)
+        basis.flags.writeable = False
+        return basis
+    mlat, mlt = equal_area_grid(latmin, spacing)
+    vmeri_basis, vzone_basis = velocity_basis(hmb_lat, mlat, mlt, order)
+    basis = np.vstack([vmeri_basis, vzone_basis])
+    basis.flags.writeable = False
+    return basis
+
+
+def grid_fitted_vecs(rotated_coeffs, hmb_lat=50, latmin=None, spacing=1.0, order=None, dtype=None):
+    """
+    Calculate fitted vectors on an equal_area_grid. The velocity basis of each grid is cached, so every call is a
+    single matrix product.
+    :param rotated_coeffs: coefficients already rotated to MLT
+    :param hmb_lat: Heppner-Maynard boundary latitude
+    :param latmin: lowest latitude of the grid, defaults to the boundary latitude
+    :param spacing: grid spacing in degrees
+    :param order: fit order
+    :param dtype: precision of the basis and results, see utils.get_precision
+    :return: arrays of magnetic latitude, MLT, azimuth and magnitude
+    """
+    order = coeff_order(rotated_coeffs, order)
+    dtype = get_precision(dtype)
+    latmin = hmb_lat if latmin is None else latmin
+    mlat, mlt = equal_area_grid(float(latmin), float(spacing))
+    basis = _grid_velocity_basis(float(hmb_lat), float(latmin), float(spacing), order, dtype)
+    coeffs = np.asarray(rotated_coeffs, dtype=dtype)[:(order + 1) ** 2]
+    vmeri, vzone = np.split(basis @ coeffs, 2)
+
+    azimuths = np.degrees(np.arctan2(vzone, vmeri))
+    magnitudes = np.sqrt(vzone ** 2 + vmeri ** 2)
+
+    return mlat, mlt, azimuths, magnitudes
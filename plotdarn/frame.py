@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""Per-timestamp state shared by all plotting components of a frame"""
+import numpy as np
+from plotdarn import convert
+from .fitted_vectors import sdarn_rotate_coeffs, coeff_order, fit_order
+from .utils import record_time
+
+
+class FrameContext(object):
+    """
+    Time-dependent quantities of a single frame, computed once and shared by every plotting function.
+
+    AACGM MLT is linear in magnetic longitude, so a single conversion of longitude 0 gives the offset for any other
+    longitude at this time. ``ut`` is the UT in hours, the unit sdarn_rotate_coeffs takes.
+    :param dtime: datetime
+    :param coeffs: map-pot coefficients in magnetic longitude, optional
+    :param hmb_lat: Heppner-Maynard boundary latitude
+    :param boundary_mlat: HMB boundary latitudes, optional
+    :param boundary_mlon: HMB boundary magnetic longitudes, optional
+    :param order: fit order, defaults to the one implied by the number of coefficients
+    """
+
+    def __init__(self, dtime, coeffs=None, hmb_lat=50, boundary_mlat=None, boundary_mlon=None, order=None):
+        self.dtime = convert._check_time(dtime)
+        self.ut = (self.dtime - self.dtime.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds() / 3600.
+        self.mlt_offset = float(np.asarray(convert.mlon_to_mlt(0.0, self.dtime)).ravel()[0])
+        self.hmb_lat = hmb_lat
+        self.coeffs = coeffs
+        self.order = coeff_order(coeffs, order) if coeffs is not None else order
+        self.rotated_coeffs = sdarn_rotate_coeffs(coeffs, self.ut, self.order) if coeffs is not None else None
+        self.boundary = None
+        self._path = None
+        if boundary_mlat is not None:
+            self.boundary = convert.mlat_mlt_to_xy(np.asarray(boundary_mlat), self.mlt(boundary_mlon))
+
+    @classmethod
+    def from_record(cls, record, cache=None):
+        """
+        Build the context of a map record, reusing an identical one from ``cache`` if given
+        :param record: dictionary as read by pydarn
+        :param cache: optional cache.FrameCache
+        :return: FrameContext
+        """
+        dtime = record_time(record)
+
+        def build():
+            return cls(dtime, coeffs=np.asarray(record['N+2']), hmb_lat=record['latmin'],
+                       boundary_mlat=record['boundary.mlat'], boundary_mlon=record['boundary.mlon'],
+                       order=fit_order(record))
+
+        if cache is None:
+            return build()
+        parts = (dtime, record['N+2'], record['latmin'], record['boundary.mlat'], record['boundary.mlon'],
+                 fit_order(record))
+        return cache.get_or_compute('frame', parts, build)
+
+    @classmethod
+    def from_rotated(cls, dtime, rotated_coeffs, hmb_lat=50, boundary_mlat=None, boundary_mlt=None, order=None):
+        """
+        Build a context from coefficients already rotated to MLT and a boundary given in MLT, e.g. an interpolated
+        frame between records. Its ``coeffs`` is None.
+        :return: FrameContext
+        """
+        frame = cls(dtime, hmb_lat=hmb_lat, order=order)
+        frame.rotated_coeffs = np.asarray(rotated_coeffs, dtype=np.float64)
+        frame.order = coeff_order(frame.rotated_coeffs, order)
+        if boundary_mlat is not None:
+            frame.boundary = convert.mlat_mlt_to_xy(np.asarray(boundary_mlat), np.asarray(boundary_mlt))
+        return frame
+
+    def cache_parts(self):
+        """
+        Inputs the context is derived from, used to key cached products computed with it
+        """
+        coeffs = self.coeffs if self.coeffs is not None else self.rotated_coeffs
+        return self.dtime, coeffs, self.hmb_lat, self.boundary, self.order
+
+    def mlt(self, mlon):
+        """
+        Convert magnetic longitudes to MLT at the frame time, equivalent to convert.mlon_to_mlt
+        """
+        return (np.asarray(mlon, dtype=np.float64) / 15. + self.mlt_offset) % 24
+
+    def mlon(self, mlt):
+        """
+        Convert MLT to magnetic longitudes in [-180, 180) at the frame time
+        """
+        return ((np.asarray(mlt, dtype=np.float64) - self.mlt_offset) * 15. + 180.) % 360 - 180.
+
+    @property
+    def boundary_path(self):
+        """
+        The boundary polygon prepared for point-in-polygon tests
+        """
+        if self._path is None:
+            import matplotlib.path as mpltPath
+            self._path = mpltPath.Path(np.array(self.boundary).T)
+        return self._path
+
+    def inside(self, x, y, radius=0.0):
+        """
+        Boolean array of the points inside the boundary, see utils.points_inside_boundary
+        """
+        return self.boundary_path.contains_points(np.array([x, y]).T, radius=radius)
+
+
+def frame_context(dtime):
+    """
+    Return ``dtime`` if it is already a FrameContext, otherwise build one for that time
+    :param dtime: datetime, parse-able string or FrameContext
+    :return: FrameContext
+    """
+    if isinstance(dtime, FrameContext):
+        return dtime
+    return FrameContext(dtime)
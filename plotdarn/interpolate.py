@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""Frames between map records, interpolated from the records' coefficients
+
+The coefficients of each record are rotated to MLT with sdarn_rotate_coeffs, which is the frame the potential is
+drawn in, and blended there together with the boundary latitude and the HMB boundary resampled onto fixed MLTs.
+Blending coefficients of records with different boundary latitudes is an approximation, as the expansion is scaled
+to the boundary, but it is smooth and exact at the records themselves.
+"""
+import numpy as np
+from .frame import FrameContext
+
+INTERPOLATION_METHODS = ['linear', 'spline']
+
+
+def _datetime64(times):
+    return np.asarray(times, dtype='datetime64[ms]')
+
+
+class CoefficientInterpolator(object):
+    """
+    Interpolates the frames of a sequence of map records at arbitrary times within their span
+    :param records: record dictionaries in time order
+    :param method: 'linear' or 'spline' (a cubic spline through the records)
+    :param n_boundary: number of MLTs the HMB boundary is resampled onto
+    """
+
+    def __init__(self, records, method='linear', n_boundary=96):
+        if method not in INTERPOLATION_METHODS:
+            raise ValueError("Unknown method {}, expected one of {}".format(method, INTERPOLATION_METHODS))
+        if len(records) < 2:
+            raise ValueError("At least two records are needed to interpolate")
+        frames = [FrameContext.from_record(r) for r in records]
+        self.method = method
+        self.times = _datetime64([f.dtime for f in frames])
+        self.order = max(f.order for f in frames)
+        self.boundary_mlt = np.arange(n_boundary) * 24. / n_boundary
+
+        width = (self.order + 1) ** 2
+        self.rotated_coeffs = np.zeros((len(frames), width))
+        self.hmb_lat = np.array([f.hmb_lat for f in frames], dtype=np.float64)
+        self.boundary_mlat = np.zeros((len(frames), n_boundary))
+        for i, (frame, record) in enumerate(zip(frames, records)):
+            rotated = frame.rotated_coeffs[:(frame.order + 1) ** 2]
+            self.rotated_coeffs[i, :len(rotated)] = rotated
+            mlt = frame.mlt(record['boundary.mlon'])
+            self.boundary_mlat[i] = np.interp(self.boundary_mlt, mlt, np.asarray(record['boundary.mlat']), period=24)
+
+        self._values = np.hstack([self.rotated_coeffs, self.hmb_lat[:, np.newaxis], self.boundary_mlat])
+        self._seconds = self._offsets(self.times)
+        if method == 'spline':
+            from scipy.interpolate import CubicSpline
+            self._spline = CubicSpline(self._seconds, self._values, axis=0)
+
+    def _offsets(self, times):
+        return (_datetime64(times) - self.times[0]) / np.timedelta64(1, 's')
+
+    def __call__(self, times):
+        """
+        Interpolate at all the given times at once. Times outside the records are clamped to the first or last one.
+        :param times: datetimes or datetime64
+        :return: dict with arrays time, rotated_coeffs (n_times, n_coeffs), hmb_lat, boundary_mlat
+            (n_times, n_boundary), and boundary_mlt and order shared by all times
+        """
+        times = _datetime64(np.atleast_1d(times))
+        seconds = np.clip(self._offsets(times), 0, self._seconds[-1])
+        if self.method == 'spline':
+            values = self._spline(seconds)
+        else:
+            upper = np.clip(np.searchsorted(self._seconds, seconds), 1, len(self._seconds) - 1)
+            lower = upper - 1
+            weight = (seconds - self._seconds[lower]) / (self._seconds[upper] - self._seconds[lower])
+            weight = weight[:, np.newaxis]
+            values = (1 - weight) * self._values[lower] + weight * self._values[upper]
+        width = self.rotated_coeffs.shape[1]
+        return {
+            'time': times,
+            'rotated_coeffs': values[:, :width],
+            'hmb_lat': values[:, width],
+            'boundary_mlat': values[:, width + 1:],
+            'boundary_mlt': self.boundary_mlt,
+            'order': self.order,
+        }
+
+    def frames(self, times):
+        """
+        Interpolated frame contexts, which plotting.potential_grid, potential_image and vector_columns accept
+        :param times: datetimes or datetime64
+        :return: list of frame.FrameContext
+        """
+        values = self(times)
+        return [FrameContext.from_rotated(t.astype('datetime64[us]').item(), coeffs, hmb_lat, boundary_mlat,
+                                          self.boundary_mlt, self.order)
+                for t, coeffs, hmb_lat, boundary_mlat in zip(values['time'], values['rotated_coeffs'],
+                                                             values['hmb_lat'], values['boundary_mlat'])]
+
+    def cadence(self, seconds):
+        """
+        Times spanning the records at a fixed cadence
+        :param seconds: interval between frames
+        :return: datetime64 array
+        """
+        step = np.timedelta64(int(round(seconds * 1000)), 'ms')
+        return np.arange(self.times[0], self.times[-1] + np.timedelta64(1, 'ms'), step)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""Merged 2-D velocities from overlapping line-of-sight vectors
+
+Line-of-sight vectors are grouped into square cells of the plot plane. In each cell the 2-D velocity (north, east)
+minimising sum((north cos k + east sin k - v) ** 2) over its vectors, with v the line-of-sight speed and k its
+azimuth, is found from the 2x2 normal equations. The sums of every cell are accumulated at once with bincount and
+the systems are solved in closed form, so there is no loop over cells or pairs of vectors.
+"""
+import numpy as np
+from plotdarn import convert
+from .spatial import _cell_keys
+
+
+def merge_los(mlat, mlt, speed, azimuth, size=2.0, min_count=2, min_angle=20.):
+    """
+    Resolve line-of-sight vectors into 2-D velocities, one per cell holding enough vectors looking in different
+    directions
+    :param mlat: ndarray of magnetic latitudes
+    :param mlt: ndarray of MLT
+    :param speed: ndarray of line-of-sight speeds
+    :param azimuth: ndarray of line-of-sight azimuths in degrees east of magnetic north
+    :param size: cell size in plot coordinates, which is roughly degrees of latitude
+    :param min_count: fewest vectors a cell needs
+    :param min_angle: smallest spread in degrees between the look directions of a cell, cells where all vectors look
+        along nearly the same line cannot be resolved. Two directions min_angle apart are just accepted.
+    :return: dict of arrays mlat, mlt, ang (degrees east of north) and mag of the merged vectors, with count, the
+        number of vectors in each cell, and residual, their RMS line-of-sight misfit
+    """
+    mlat = np.asarray(mlat, dtype=np.float64)
+    mlt = np.asarray(mlt, dtype=np.float64)
+    speed = np.asarray(speed, dtype=np.float64)
+    azimuth = np.radians(np.asarray(azimuth, dtype=np.float64))
+    if len(mlat) == 0:
+        empty = np.zeros(0)
+        return dict(mlat=empty, mlt=empty, ang=empty, mag=empty, count=np.zeros(0, dtype=np.int64), residual=empty)
+
+    x, y = convert.mlat_mlt_to_xy(mlat, mlt, np.float64)
+    _, cell = np.unique(_cell_keys(x, y, size), return_inverse=True)
+    cell = cell.ravel()
+    n_cells = cell.max() + 1
+
+    def total(weights):
+        return np.bincount(cell, weights=weights, minlength=n_cells)
+
+    cos, sin = np.cos(azimuth), np.sin(azimuth)
+    count = np.bincount(cell, minlength=n_cells)
+    a, b, c = total(cos * cos), total(cos * sin), total(sin * sin)
+    p, q = total(speed * cos), total(speed * sin)
+    det = a * c - b * b
+
+    # The smallest eigenvalue of the mean of k k^T is sin^2 of half the spread of two look directions
+    smallest = ((a + c) - np.sqrt((a - c) ** 2 + 4 * b * b)) / (2 * count)
+    keep = (count >= min_count) & (smallest >= np.sin(np.radians(min_angle) / 2) ** 2 * (1 - 1e-9))
+    det = np.where(keep, det, 1.)
+    north = (c * p - b * q) / det
+    east = (a * q - b * p) / det
+
+    misfit = total((north[cell] * cos + east[cell] * sin - speed) ** 2)
+    cell_x = total(x) / count
+    cell_y = total(y) / count
+    merged_mlat, merged_mlt = convert.xy_to_mlat_mlt(cell_x[keep], cell_y[keep])
+    return {
+        'mlat': merged_mlat, 'mlt': merged_mlt,
+        'ang': np.degrees(np.arctan2(east[keep], north[keep])), 'mag': np.hypot(north[keep], east[keep]),
+        'count': count[keep], 'residual': np.sqrt(misfit[keep] / count[keep]),
+    }
+
+
+def merge_record(record, frame=None, size=2.0, min_count=2, min_angle=20.):
+    """
+    Merge the line-of-sight vectors of a map record, see merge_los
+    :param record: dictionary as read by pydarn
+    :param frame: the record's frame.FrameContext, built if not given
+    :return: dict as returned by merge_los, with mlon added
+    """
+    from .frame import FrameContext
+    if frame is None:
+        frame = FrameContext.from_record(record)
+    merged = merge_los(record['vector.mlat'], frame.mlt(record['vector.mlon']), record['vector.vel.median'],
+                       record['vector.kvect'], size=size, min_count=min_count, min_angle=min_angle)
+    merged['mlon'] = frame.mlon(merged['mlt'])
+    return merged
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+"""Staged producer/consumer pipeline for continuous processing of map records
+
+Each stage runs its function on a pool of worker threads, or hands the work to a process pool when the stage is
+NumPy-heavy. Stages are connected by bounded queues, so a slow stage blocks the ones before it instead of letting
+work pile up in memory. Every stage emits its results in input order.
+"""
+import time
+import queue
+import warnings
+import threading
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+_STOP = object()
+_POLL = 0.1
+
+
+class _Failure(object):
+    """
+    An exception raised while processing an item, passed down the pipeline in place of the item
+    """
+
+    def __init__(self, stage, exc):
+        self.stage = stage
+        self.exc = exc
+
+
+class Stage(object):
+    """
+    A single step of a Pipeline
+    :param name: label used in statistics
+    :param func: callable applied to each item, must be picklable when processes is True
+    :param workers: number of items processed concurrently
+    :param processes: run func in a process pool instead of the worker threads
+    :param expand: func returns an iterable whose elements are passed on as separate items
+    :param initializer: callable run once in each worker process, with initargs
+    """
+
+    def __init__(self, name, func, workers=1, processes=False, expand=False, initializer=None, initargs=()):
+        if workers < 1:
+            raise ValueError("A stage needs at least one worker")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.processes = processes
+        self.expand = expand
+        self.initializer = initializer
+        self.initargs = initargs
+
+
+class _StageRunner(object):
+
+    def __init__(self, stage, in_queue, out_queue, maxsize, closed, profiler=None, profile_lock=None):
+        self.stage = stage
+        self.profiler = profiler
+        self.profile_lock = profile_lock
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.closed = closed
+        # Bounds the number of items taken but not yet emitted, i.e. the reorder buffer
+        self.slots = threading.Semaphore(maxsize + stage.workers)
+        self.done = {}
+        self.condition = threading.Condition()
+        self.running = stage.workers
+        self.processed = 0
+        self.busy = 0.0
+        self.executor = None
+        self.threads = []
+
+    def start(self):
+        if self.stage.processes:
+            self.executor = ProcessPoolExecutor(max_workers=self.stage.workers, initializer=self.stage.initializer,
+                                                initargs=self.stage.initargs)
+        for i in range(self.stage.workers):
+            self.threads.append(threading.Thread(target=self._work, name='{}-{}'.format(self.stage.name, i)))
+        self.threads.append(threading.Thread(target=self._emit, name='{}-emit'.format(self.stage.name)))
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def _call(self, item):
+        if self.executor is not None:
+            return self.executor.submit(self.stage.func, item).result()
+        if self.profiler is not None:
+            with self.profile_lock, self.profiler.stage(self.stage.name):
+                return self.stage.func(item)
+        return self.stage.func(item)
+
+    def _work(self):
+        while True:
+            if not _acquire(self.slots, self.closed):
+                return
+            entry = _get(self.in_queue, self.closed)
+            if entry is None:
+                return
+            if entry is _STOP:
+                self.slots.release()
+                with self.condition:
+                    self.running -= 1
+                    last = self.running == 0
+                    self.condition.notify_all()
+                if not last:
+                    # Leave the sentinel for the sibling workers
+                    _put(self.in_queue, _STOP, self.closed)
+                return
+            seq, item = entry
+            busy = 0.0
+            if not isinstance(item, _Failure):
+                start = time.perf_counter()
+                try:
+                    item = self._call(item)
+                except Exception as exc:
+                    item = _Failure(self.stage.name, exc)
+                busy = time.perf_counter() - start
+            # The workers share busy, so it is only updated under the condition's lock
+            with self.condition:
+                self.busy += busy
+                self.done[seq] = item
+                self.processed += 1
+                self.condition.notify_all()
+
+    def _emit(self):
+        seq = 0
+        out_seq = 0
+        while True:
+            with self.condition:
+                while seq not in self.done and self.running > 0:
+                    if self.closed.is_set():
+                        return
+                    self.condition.wait(_POLL)
+                if seq not in self.done:
+                    break
+                item = self.done.pop(seq)
+            seq += 1
+            self.slots.release()
+            if self.stage.expand and not isinstance(item, _Failure):
+                try:
+                    items = list(item)
+                except Exception as exc:
+                    items = [_Failure(self.stage.name, exc)]
+            else:
+                items = [item]
+            for item in items:
+                if not _put(self.out_queue, (out_seq, item), self.closed):
+                    return
+                out_seq += 1
+        _put(self.out_queue, _STOP, self.closed)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+def _acquire(semaphore, closed):
+    while not semaphore.acquire(timeout=_POLL):
+        if closed.is_set():
+            return False
+    return True
+
+
+def _get(q, closed):
+    while True:
+        try:
+            return q.get(timeout=_POLL)
+        except queue.Empty:
+            if closed.is_set():
+                return None
+
+
+def _put(q, item, closed):
+    while True:
+        try:
+            q.put(item, timeout=_POLL)
+            return True
+        except queue.Full:
+            if closed.is_set():
+                return False
+
+
+class Pipeline(object):
+    """
+    Chain of stages connected by bounded queues
+    :param stages: list of Stage
+    :param maxsize: capacity of each queue between stages
+    :param profiler: optional profiling.MemoryProfiler measuring the stages run in threads. tracemalloc counters are
+        process-wide, so the measured stages process one item at a time across the whole pipeline. Stages run in
+        process pools are not measured.
+    """
+
+    def __init__(self, stages, maxsize=8, profiler=None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.maxsize = maxsize
+        self.profiler = profiler
+        self._profile_lock = threading.Lock()
+        if profiler is not None:
+            serialized = [stage.name for stage in stages if not stage.processes and stage.workers > 1]
+            if serialized:
+                warnings.warn("Profiled stages {} run one item at a time, their extra workers are idle".format(
+                    serialized))
+        self._runners = []
+        self._queues = []
+        self._started = None
+        self.shared = None
+
+    def run(self, items):
+        """
+        Feed ``items`` through the stages and yield the results in input order. An exception raised by a stage is
+        re-raised here when the consumer reaches the item that caused it.
+        :param items: iterable
+        :return: generator
+        """
+        closed = threading.Event()
+        self._queues = [queue.Queue(self.maxsize) for _ in range(len(self.stages) + 1)]
+        self._runners = [_StageRunner(stage, self._queues[i], self._queues[i + 1], self.maxsize, closed,
+                                      self.profiler, self._profile_lock)
+                         for i, stage in enumerate(self.stages)]
+        self._started = time.perf_counter()
+
+        def feed():
+            for seq, item in enumerate(items):
+                if not _put(self._queues[0], (seq, item), closed):
+                    return
+            _put(self._queues[0], _STOP, closed)
+
+        feeder = threading.Thread(target=feed, name='pipeline-feed')
+        feeder.daemon = True
+        for runner in self._runners:
+            runner.start()
+        feeder.start()
+
+        try:
+            while True:
+                entry = _get(self._queues[-1], closed)
+                if entry is _STOP or entry is None:
+                    break
+                item = entry[1]
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            closed.set()
+            for runner in self._runners:
+                runner.shutdown()
+
+    def stats(self):
+        """
+        Return the current statistics of each stage: the depth of its input queue, the number of items processed,
+        the time its workers spent busy and its throughput in items per second since the run started. With a
+        profiler, the peak and retained memory of the stages it measured are included.
+        :return: list of dict
+        """
+        elapsed = time.perf_counter() - self._started if self._started is not None else 0.0
+        memory = {}
+        if self.profiler is not None:
+            memory = {record['stage']: record for record in self.profiler.report()}
+        stats = []
+        for runner in self._runners:
+            stage = {
+                'stage': runner.stage.name,
+                'queue_depth': runner.in_queue.qsize(),
+                'processed': runner.processed,
+                'busy': runner.busy,
+                'throughput': runner.processed / elapsed if elapsed > 0 else 0.0,
+            }
+            if runner.stage.name in memory:
+                stage['peak'] = memory[runner.stage.name]['peak']
+                stage['retained'] = memory[runner.stage.name]['retained']
+            stats.append(stage)
+        return stats
+
+
+# Coastline geometries of a convert worker process, set once by init_convert_worker
+_worker_geoms = []
+
+
+def init_convert_worker(coastline_geoms):
+    """
+    Process pool initializer holding the coastline geometries for convert_stage, so they are pickled once per
+    worker instead of with every record
+    :param coastline_geoms: list of coastline geometries
+    """
+    global _worker_geoms
+    _worker_geoms = coastline_geoms
+
+
+def read_stage(filename):
+    from .plotdarn import read_records
+    return read_records(filename)
+
+
+def convert_stage(record, coastline_geoms=None):
+    """
+    Convert the coastlines, boundary and vectors of a record to plot coordinates
+    :param coastline_geoms: coastline geometries, those set by init_convert_worker if None
+    :return: dict with the record, its frame.FrameContext and its layers
+    """
+    from .plotdarn import frame_layers
+    from .frame import FrameContext
+    frame = FrameContext.from_record(record)
+    layers = frame_layers(record, _worker_geoms if coastline_geoms is None else coastline_geoms, frame)
+    return {'record': record, 'frame': frame, 'layers': layers}
+
+
+def convert_shared_stage(record):
+    """
+    convert_stage using the coastlines attached from shared memory by shared.init_worker
+    """
+    from .plotdarn import frame_layers
+    from .frame import FrameContext
+    from .shared import attached_layers
+    from . import plotting
+    frame = FrameContext.from_record(record)
+    layers = frame_layers(record, [], frame)
+    layers['coastlines'] = plotting.coastlines_flat(frame, *attached_layers()['coastlines'])
+    return {'record': record, 'frame': frame, 'layers': layers}
+
+
+def compute_stage(frame, contour_spacing=None):
+    """
+    Add the potential contours to a converted frame
+    :param contour_spacing: optional grid spacing in degrees to contour on an adaptive grid of, see
+        plotting.adaptive_potential_grid, instead of the fixed 1 degree grid. Its evaluation counts are added to the
+        frame as 'contour_grid'.
+    """
+    from . import plotting
+    if contour_spacing is None:
+        pot_grid = plotting.potential_grid(frame['frame'])
+        frame['layers']['contours'] = plotting.contours(pot_grid)
+    else:
+        pot_grid, frame['contour_grid'] = plotting.adaptive_potential_grid(frame['frame'], spacing=contour_spacing)
+        frame['layers']['contours'] = plotting.contours(pot_grid, spacing=contour_spacing)
+    return frame
+
+
+def render_stage(frame, output=None):
+    """
+    Render a computed frame to standalone HTML, written to ``output`` formatted with the record time if given
+    :return: html string or output filename
+    """
+    from bokeh.embed import file_html
+    from bokeh.resources import CDN
+    from .plotdarn import render_layers
+    dtime = frame['frame'].dtime
+    html = file_html(render_layers(frame['layers'], title='SuperDarn {:%Y-%m-%d %H:%M}'.format(dtime)), CDN)
+    if output is None:
+        return html
+    filename = dtime.strftime(output)
+    with open(filename, 'w') as fh:
+        fh.write(html)
+    return filename
+
+
+def superdarn_pipeline(coastline_geoms, output=None, readers=2, converters=1, computers=2, renderers=1,
+                       maxsize=8, share_static=False, basis_records=(), contour_spacing=None):
+    """
+    Build the standard pipeline from map files to rendered HTML: read records with I/O threads, convert coordinates
+    and compute potentials in process pools, render with threads
+    :param coastline_geoms: coastline geometries
+    :param output: optional strftime filename pattern to write each frame to
+    :param share_static: hold the coastlines and grid bases once in shared memory (see plotdarn.shared) instead of
+        pickling the geometries into each convert worker. The segment is kept as ``pipeline.shared`` and released
+        with it. Needs Python 3.8 or later.
+    :param basis_records: with share_static, records whose contouring grid bases are shared, e.g. those of the first
+        file, see shared.record_grid_bases. Frames with other boundary latitudes or orders build their own.
+    :param contour_spacing: optional adaptive contouring grid spacing in degrees, see compute_stage
+    :return: Pipeline, run it with ``pipeline.run(filenames)``
+    """
+    if share_static:
+        from .shared import share_static_layers, record_grid_bases, init_worker
+        shared = share_static_layers(coastline_geoms, record_grid_bases(basis_records))
+        worker = dict(initializer=init_worker, initargs=(shared.handle,))
+        convert = Stage('convert', convert_shared_stage, workers=converters, processes=True, **worker)
+    else:
+        shared = None
+        worker = {}
+        convert = Stage('convert', convert_stage, workers=converters, processes=True,
+                        initializer=init_convert_worker, initargs=(list(coastline_geoms),))
+    pipeline = Pipeline([
+        Stage('read', read_stage, workers=readers, expand=True),
+        convert,
+        Stage('compute', functools.partial(compute_stage, contour_spacing=contour_spacing), workers=computers,
+              processes=True, **worker),
+        Stage('render', functools.partial(render_stage, output=output), workers=renderers),
+    ], maxsize=maxsize)
+    pipeline.shared = shared
+    return pipeline
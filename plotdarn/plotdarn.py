@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 
-"""Main module."""
-from datetime import datetime
+"""Main module.
+
+pydarn, geopandas and Bokeh are only imported once the function that needs them is called, so that the CLI and
+process-pool workers do not pay for dependencies they never use.
+"""
+import os
 from plotdarn import plotting
-from bokeh.models import Range1d, ColorBar
-from bokeh.plotting import figure
-import pydarn
-import geopandas as gdp
+from .store import MapStore
+from .frame import FrameContext
+from .utils import record_time
+from .profiling import profiled
 
 
 def read_file(filename):
@@ -15,9 +19,28 @@ def read_file(filename):
     :param filename:
     :return: dictionary
     """
+    return read_records(filename)[0]
+
+
+def read_records(filename, start=None, end=None):
+    """
+    Read the records from a SuperDarn binary file or a columnar store directory (see plotdarn.store), optionally
+    limited to records starting in [start, end). Records read from a store hold views into its memory-mapped columns.
+    :param filename: map file or store directory
+    :param start: datetime
+    :param end: datetime
+    :return: list of dictionaries
+    """
+    if os.path.isdir(filename):
+        return MapStore(filename).records(start, end)
+
+    import pydarn
     reader = pydarn.SDarnRead(filename)
     records = reader.read_map()
-    return records[0]
+    if start is None and end is None:
+        return records
+    return [r for r in records
+            if (start is None or record_time(r) >= start) and (end is None or record_time(r) < end)]
 
 
 def read_coast(filename):
@@ -26,45 +49,168 @@ def read_coast(filename):
     :param filename:
     :return:
     """
+    import geopandas as gdp
     shp = gdp.read_file(filename)
     return shp['geometry']
 
 
-def plot_superdarn(data, coastline_geoms, title='SuperDarn'):
+def plot_superdarn(data, coastline_geoms, title='SuperDarn', cache=None, show_potential=False, image_budget=0.05,
+                   decimate=None, profiler=None, plottype='LOS'):
     """
     Plot superDarn data using Bokeh
     :param data:
+    :param cache: optional cache.FrameCache, reuses computed products when re-rendering the same record
+    :param show_potential: draw the potential as an image under the vectors
+    :param image_budget: seconds per frame the potential image may take, sets its resolution
+    :param decimate: optional cell size in plot coordinates to thin dense vectors to, see spatial.cell_size
+    :param profiler: optional profiling.MemoryProfiler recording the frame, layer and render stages
+    :param plottype: 'LOS' or 'MERGE', see frame_layers
+    :return: bokeh overlay
+    """
+    with profiled(profiler, 'frame'):
+        frame = FrameContext.from_record(data, cache=cache)
+    layers = frame_layers(data, coastline_geoms, frame, cache=cache, show_potential=show_potential,
+                          image_budget=image_budget, decimate=decimate, profiler=profiler, plottype=plottype)
+    with profiled(profiler, 'render'):
+        return render_layers(layers, title=title)
+
+
+def plot_superdarn_progressive(data, coastline_geoms, title='SuperDarn', cache=None, show_potential=False, doc=None):
+    """
+    Plot superDarn data with a quick preview that is refined in the background, see progressive.ProgressiveRenderer
+    :param data: record dictionary
+    :param cache: optional cache.FrameCache
+    :param show_potential: draw the potential as an image under the vectors
+    :param doc: Bokeh document the figure is shown in, refinements are applied through its next tick callback
+    :return: progressive.ProgressiveRenderer holding the figure as ``figure``. Render further records with it to
+        reuse the figure and cancel outstanding refinement.
+    """
+    from .progressive import ProgressiveRenderer
+    renderer = ProgressiveRenderer(coastline_geoms, title=title, cache=cache, doc=doc, show_potential=show_potential)
+    renderer.render(data)
+    return renderer
+
+
+def frame_layers(data, coastline_geoms, frame=None, cache=None, show_potential=False, image_budget=0.05,
+                 decimate=None, profiler=None, plottype='LOS', executor=None):
+    """
+    Compute the time-dependent plot layers of a record as plain arrays, which unlike Bokeh models can be passed
+    between processes
+    :param data: record dictionary
+    :param coastline_geoms: coastline geometries
+    :param frame: frame.FrameContext of the record, built from it if not given
+    :param cache: optional cache.FrameCache
+    :param show_potential: add the potential image layer
+    :param image_budget: seconds per frame the potential image may take
+    :param decimate: optional decimation cell size passed on to plotting.vector_columns
+    :param profiler: optional profiling.MemoryProfiler. Coastlines are converted in chunks of geometries when its
+        on_exceed is 'chunk' and it has a 'coastlines' budget. Budgets of the stages frame_layers runs in are checked
+        after each layer.
+    :param plottype: 'LOS' to draw the line-of-sight vectors or 'MERGE' to draw the 2-D velocities merged from them
+    :param executor: optional executor the coastline vertices are converted in, see plotting.coastlines_flat
+    :return: dict with coastlines, boundary and vectors layers, and potential_image if requested
+    """
+    if frame is None:
+        frame = FrameContext.from_record(data, cache=cache)
+    if profiler is None:
+        coastlines = plotting.coastlines(frame, coastline_geoms, cache=cache, executor=executor)
+    else:
+        coastlines = profiler.run('coastlines',
+                                  lambda geoms: plotting.coastlines(frame, geoms, cache=cache, executor=executor),
+                                  items=list(coastline_geoms), combine=_join_lines)
+        profiler.check()
+    with profiled(profiler, 'vectors'):
+        vectors = plotting.vector_columns(
+            frame,
+            data['vector.mlat'],
+            data['vector.mlon'],
+            None,
+            latmin=data['latmin'],
+            plottype=plottype,
+            mag=data['vector.vel.median'],
+            ang=data['vector.kvect'],
+            cache=cache,
+            decimate=decimate,
+        )
+    layers = {'coastlines': coastlines, 'boundary': frame.boundary, 'vectors': vectors}
+    if profiler is not None:
+        profiler.check()
+    if show_potential:
+        with profiled(profiler, 'potential_image'):
+            layers['potential_image'] = plotting.potential_image(frame, budget=image_budget, cache=cache)
+    return layers
+
+
+def _join_lines(parts):
+    return [x for xs, _ in parts for x in xs], [y for _, ys in parts for y in ys]
+
+
+def layer_sources(layers):
+    """
+    Return the ColumnDataSource data of each layer, keyed by source name: coastlines, contours, boundary,
+    vectors_inside, vectors_outside and potential_image
+    :param layers: dict as returned by frame_layers
+    :return: dict of column dictionaries
+    """
+    data = {}
+    for name in ('coastlines', 'contours'):
+        if name in layers:
+            data[name] = dict(xs=list(layers[name][0]), ys=list(layers[name][1]))
+    if 'boundary' in layers:
+        data['boundary'] = dict(x=layers['boundary'][0], y=layers['boundary'][1])
+    if 'vectors' in layers:
+        data['vectors_inside'], data['vectors_outside'] = layers['vectors']
+    if 'potential_image' in layers:
+        data['potential_image'] = layers['potential_image']
+    return data
+
+
+def render_layers(layers, title='SuperDarn', sources=None):
+    """
+    Assemble the Bokeh figure from layers computed by frame_layers. The potential image and contours are drawn when
+    the layers include 'potential_image' and 'contours' entries.
+    :param layers: dict
+    :param title: str
+    :param sources: optional dict, filled with the figure's ColumnDataSources keyed as layer_sources and the potential
+        image's colour mapper as 'potential_mapper', so that the figure can be updated in place
     :return: bokeh overlay
     """
-    time = datetime(year=2012, month=6, day=15, hour=22, minute=2)
+    from bokeh.models import Range1d, ColorBar, ColumnDataSource
+    from bokeh.plotting import figure
+
+    if sources is None:
+        sources = {}
+    for name, data in layer_sources(layers).items():
+        sources[name] = ColumnDataSource(data)
 
     # Create bokeh figure with no grid lines
     p = figure(title=title)
     p.grid.grid_line_color = None
 
+    # Add the potential image underneath everything else
+    if 'potential_image' in sources:
+        sources['potential_mapper'] = plotting.potential_mapper(layers['potential_image']['image'][0])
+        p.image(image='image', x='x', y='y', dw='dw', dh='dh', source=sources['potential_image'],
+                color_mapper=sources['potential_mapper'])
+
     # Add coastlines
-    coastlines = plotting.coastlines(time, coastline_geoms)
-    p.multi_line(xs=coastlines[0], ys=coastlines[1], line_color='grey')
+    p.multi_line(xs='xs', ys='ys', line_color='grey', source=sources['coastlines'])
 
     # Add our own MLT gridlines
     grid = plotting.gridlines()
     p.multi_line(grid[0], grid[1], line_color='grey', line_dash='dotted')
 
+    # Add the potential contours
+    if 'contours' in sources:
+        p.multi_line(xs='xs', ys='ys', line_color='black', source=sources['contours'])
+
     # Add the boundary lines
-    boundary = plotting.boundary(time, data['boundary.mlat'], data['boundary.mlon'])
-    p.line(x=boundary[0], y=boundary[1], line_color='lime')
+    p.line(x='x', y='y', line_color='lime', source=sources['boundary'])
 
     # Add the vector points
-    in_points, out_points, mapper = plotting.vector(
-        time,
-        data['vector.mlat'],
-        data['vector.mlon'],
-        boundary,
-        latmin=data['latmin'],
-        plottype='LOS',
-        mag=data['vector.vel.median'],
-        ang=data['vector.kvect'],
-    )
+    in_points = sources['vectors_inside']
+    out_points = sources['vectors_outside']
+    mapper = plotting.velocity_mapper()
     p.ray(x='x', y='y', length='le', angle='an', angle_units='deg', color=mapper, source=in_points)
     p.circle(x='x', y='y', color=mapper, source=in_points, size=2)
     p.ray(x='x', y='y', length='le', angle='an', angle_units='deg', color='dimgrey', source=out_points)
@@ -1,27 +1,51 @@
 # -*- coding: utf-8 -*-
 
 """Plotting components"""
-from shapely.ops import linemerge, unary_union, polygonize
-from shapely.geometry import shape
+import functools
 import numpy as np
-from plotdarn import convert
-from bokeh.models import ColumnDataSource
-from bokeh import palettes
-from bokeh.transform import linear_cmap
-from .utils import scale_velocity, points_inside_boundary
-from .fitted_vectors import sdarn_get_potential_grid, fitted_vecs
-from skimage import measure
+from plotdarn import convert, spatial
+from .utils import scale_velocity, points_inside_boundary, get_precision, as_precision
+from .fitted_vectors import (ORDER, coeff_order, fitted_vecs_mlt, grid_fitted_vecs, sdarn_get_potential_grid,
+                             sdarn_rotate_coeffs, polar_potential_grid,
+                             adaptive_potential_grid as _adaptive_potential_grid)
+from .merge import merge_los
+from .cache import cached
+from .frame import FrameContext, frame_context
 
 
-def coastlines(dtime, geometries):
+COASTLINE_CHUNK = 200000
+
+
+def coastlines(dtime, geometries, cache=None, executor=None, chunk_size=COASTLINE_CHUNK):
     """
     Return the coastline geometries in a format suitable for plotting
-    :param dtime:
+    :param dtime: datetime or frame.FrameContext
     :param geometries:
+    :param cache: optional cache.FrameCache
+    :param executor: optional concurrent.futures executor to convert the chunks of vertices in, see coastlines_flat
+    :param chunk_size: number of vertices converted per call
     :return:
     """
-    xs = []
-    ys = []
+    frame = frame_context(dtime)
+    return cached(cache, 'coastlines', (frame.dtime, geometries),
+                  lambda: _coastlines(frame, geometries, executor, chunk_size))
+
+
+def _coastlines(frame, geometries, executor=None, chunk_size=COASTLINE_CHUNK):
+    return _coastlines_flat(frame, *flatten_coastlines(geometries), executor=executor, chunk_size=chunk_size)
+
+
+def flatten_coastlines(geometries):
+    """
+    Extract the northern hemisphere coastline exteriors as flat geodetic coordinate arrays, the time-independent part
+    of the coastlines layer
+    :param geometries: coastline geometries, e.g. from plotdarn.read_coast
+    :return: glat, glon and offsets, where line i is glat[offsets[i]:offsets[i + 1]]
+    """
+    from shapely.ops import linemerge, unary_union, polygonize
+    from shapely.geometry import shape
+    glats = []
+    glons = []
 
     for geom in geometries:
         if geom.area == 8900.069899944174 or geom.area == 4158.330801265312:
@@ -39,58 +63,156 @@ def coastlines(dtime, geometries):
 
         if glat.max() < 0:
             continue
+        glats.append(glat)
+        glons.append(glon)
+    offsets = np.cumsum([0] + [len(glat) for glat in glats])
+    if not glats:
+        return np.zeros(0), np.zeros(0), offsets
+    return np.concatenate(glats), np.concatenate(glons), offsets
 
-        converted = convert.arr_geo_to_mag(glat, glon, dtime)
-        mlat = converted[0]
-        mlon = converted[1]
-        if np.any(np.isnan(mlat)):
-            mask = np.ma.masked_invalid(converted)
-            mlat = mask[0][~mask.mask[0]]
-            mlon = mask[1][~mask.mask[1]]
 
-        mlts = convert.mlon_to_mlt(mlon, dtime)
-        x, y = convert.mlat_mlt_to_xy(mlat, mlts)
-        xs.append(x)
-        ys.append(y)
-    return xs, ys
+def coastlines_flat(dtime, glat, glon, offsets, cache=None, executor=None, chunk_size=COASTLINE_CHUNK):
+    """
+    Return the coastlines layer from flat coordinate arrays as produced by flatten_coastlines. All vertices are
+    converted together in chunks of chunk_size, rather than line by line, and vertices that fail to convert are
+    dropped.
+    :param dtime: datetime or frame.FrameContext
+    :param cache: optional cache.FrameCache
+    :param executor: optional concurrent.futures executor the chunks are converted in, e.g. a ProcessPoolExecutor.
+        aacgmv2 holds the GIL, so threads do not convert in parallel.
+    :param chunk_size: number of vertices converted per call
+    """
+    frame = frame_context(dtime)
+    return cached(cache, 'coastlines_flat', (frame.dtime, glat, glon, offsets),
+                  lambda: _coastlines_flat(frame, glat, glon, offsets, executor, chunk_size))
+
+
+def _coastlines_flat(frame, glat, glon, offsets, executor=None, chunk_size=COASTLINE_CHUNK):
+    if len(glat) == 0:
+        return [np.zeros(0) for _ in offsets[1:]], [np.zeros(0) for _ in offsets[1:]]
+    n_chunks = max(1, -(-len(glat) // chunk_size))
+    lats = np.array_split(np.asarray(glat, dtype=np.float64), n_chunks)
+    lons = np.array_split(np.asarray(glon, dtype=np.float64), n_chunks)
+    times = [frame.dtime] * n_chunks
+    if executor is None or n_chunks == 1:
+        converted = map(convert.arr_geo_to_mag, lats, lons, times)
+    else:
+        converted = executor.map(convert.arr_geo_to_mag, lats, lons, times)
+    converted = [np.asarray(c, dtype=np.float64).reshape(2, -1) for c in converted]
+    mlat = np.concatenate([c[0] for c in converted])
+    mlon = np.concatenate([c[1] for c in converted])
+
+    valid = np.isfinite(mlat) & np.isfinite(mlon)
+    x, y = convert.mlat_mlt_to_xy(mlat[valid], frame.mlt(mlon[valid]))
+    # Offsets of each line among the valid vertices
+    kept = np.concatenate([[0], np.cumsum(valid)])[np.asarray(offsets)]
+    return np.split(x, kept[1:-1]), np.split(y, kept[1:-1])
 
 
 def coastlines_from_mlat_mlon(dtime, mlats, mlons):
+    frame = frame_context(dtime)
     xs = []
     ys = []
 
     for i, mlat in enumerate(mlats):
         mlon = mlons[i]
-        mlts = convert.mlon_to_mlt(mlon, dtime)
+        mlts = frame.mlt(mlon)
         x, y = convert.mlat_mlt_to_xy(mlat, mlts)
         xs.append(x)
         ys.append(y)
     return xs, ys
 
 
-def vector(dtime, mlat, mlon, boundary, latmin=50, coeffs=None, ang=None, mag=None, plottype='LOS'):
+def vector(dtime, mlat, mlon, boundary, latmin=None, coeffs=None, ang=None, mag=None, plottype='LOS', cache=None,
+           grid_spacing=2.0, decimate=None, decimate_method='mean', dtype=None, workspace=None):
+    from bokeh.models import ColumnDataSource
+    inside_columns, outside_columns = vector_columns(dtime, mlat, mlon, boundary, latmin=latmin, coeffs=coeffs,
+                                                     ang=ang, mag=mag, plottype=plottype, cache=cache,
+                                                     grid_spacing=grid_spacing, decimate=decimate,
+                                                     decimate_method=decimate_method, dtype=dtype,
+                                                     workspace=workspace)
+    return ColumnDataSource(inside_columns), ColumnDataSource(outside_columns), velocity_mapper()
+
+
+def velocity_mapper():
+    from bokeh import palettes
+    from bokeh.transform import linear_cmap
+    return linear_cmap(field_name='m', palette=palettes.Viridis256, low=0, high=1000)
+
+
+def vector_columns(dtime, mlat, mlon, boundary, latmin=None, coeffs=None, ang=None, mag=None, plottype='LOS',
+                   cache=None, grid_spacing=2.0, decimate=None, decimate_method='mean', dtype=None, workspace=None):
+    """
+    Return the data columns of the vectors inside and outside the boundary as two dictionaries of arrays, in the
+    layout used by the ColumnDataSources from vector
+    :param dtime: datetime or frame.FrameContext. A context's coefficients and boundary are used when coeffs or
+        boundary are None.
+    :param latmin: boundary latitude of the fitted vectors, the context's hmb_lat if None
+    :param plottype: 'LOS' for the given ang and mag, 'FIT' for fitted vectors at the given positions, 'GRID' for
+        fitted vectors on an equal-area grid of grid_spacing degrees, in which case mlat and mlon are ignored, or
+        'MERGE' for 2-D velocities resolved from the given line-of-sight ang and mag in cells of grid_spacing plot
+        units, see merge.merge_los
+    :param decimate: optional cell size in plot coordinates, keeping one vector per cell on each side of the boundary
+        (see spatial.decimate and spatial.cell_size)
+    :param decimate_method: 'mean', 'max' or 'first'
+    :param dtype: precision of the fitted velocities and of the returned columns, see utils.get_precision. Positions
+        are classified against the boundary in float64 either way.
+    :param workspace: convert.ProjectionWorkspace holding the projection buffers, this thread's own by default
+    """
+    frame = frame_context(dtime)
+    dtype = get_precision(dtype)
+    latmin = frame.hmb_lat if latmin is None else latmin
+    if plottype in ('FIT', 'GRID'):
+        if coeffs is None or coeffs is frame.coeffs:
+            coeffs, rotated, order = frame.coeffs, frame.rotated_coeffs, frame.order
+        else:
+            order = None
+            rotated = sdarn_rotate_coeffs(coeffs, frame.ut)
+    if plottype == 'GRID':
+        mlat, mlts, ang, mag = cached(cache, 'fitted_grid',
+                                      (coeffs, frame.dtime, latmin, order, grid_spacing, dtype.name),
+                                      lambda: grid_fitted_vecs(rotated, latmin, spacing=grid_spacing, order=order,
+                                                               dtype=dtype))
+        mlon = frame.mlon(mlts)
+    elif plottype == 'MERGE':
+        merged = cached(cache, 'merged', (mlat, mlon, ang, mag, frame.dtime, grid_spacing),
+                        lambda: merge_los(mlat, frame.mlt(mlon), mag, ang, size=grid_spacing))
+        mlat, mlts, ang, mag = merged['mlat'], merged['mlt'], merged['ang'], merged['mag']
+        mlon = frame.mlon(mlts)
+    else:
+        mlts = frame.mlt(mlon)
     if plottype == 'FIT':
-        ang, mag = fitted_vecs(coeffs, mlat, mlon, dtime, latmin)
+        ang, mag = cached(cache, 'fitted', (coeffs, mlat, mlon, frame.dtime, latmin, order, dtype.name),
+                          lambda: fitted_vecs_mlt(rotated, mlat, mlts, latmin, order, dtype))
         ang = np.array(ang)
         mag = np.array(mag)
-    mlts = convert.mlon_to_mlt(mlon, dtime)
-    x, y = convert.mlat_mlt_to_xy(mlat, mlts)
-    inside = points_inside_boundary(x, y, boundary[0], boundary[1])
-    mapper = linear_cmap(field_name='m', palette=palettes.Viridis256, low=0, high=1000)
-    scaled_mag = scale_velocity(mag)
-    converted_angles = convert.xy_angle_to_origin(x, y, ang)
-    inside_source = ColumnDataSource(dict(x=x[inside], y=y[inside], m=mag[inside], le=scaled_mag[inside],
-                                          an=converted_angles[inside], mlon=mlon[inside], mlat=mlat[inside],
-                                          mlt=mlts[inside], ang=ang[inside]))
-    outside = np.logical_not(inside)
-    outside_source = ColumnDataSource(dict(x=x[outside], y=y[outside], m=mag[outside], le=scaled_mag[outside],
-                                           an=converted_angles[outside], mlon=mlon[outside], mlat=mlat[outside],
-                                           mlt=mlts[outside], ang=ang[outside]))
-    return inside_source, outside_source, mapper
+    mlat, mlon, mlts = np.asarray(mlat), np.asarray(mlon), np.asarray(mlts)
+    ang, mag = np.asarray(ang), np.asarray(mag)
+    projected = convert.project_vectors(mlat, mlts, ang, mag,
+                                        workspace=convert.thread_workspace() if workspace is None else workspace)
+    x, y = projected['x'], projected['y']
+    if boundary is None:
+        inside = cached(cache, 'inside', (x, y, frame.boundary[0], frame.boundary[1]), lambda: frame.inside(x, y))
+    else:
+        inside = cached(cache, 'inside', (x, y, boundary[0], boundary[1]),
+                        lambda: points_inside_boundary(x, y, boundary[0], boundary[1]))
+    columns = dict(x=x, y=y, m=mag, le=projected['le'], an=projected['an'], mlon=mlon, mlat=mlat, mlt=mlts, ang=ang)
+    # Indices are found once per side, and taking them copies the rows out of the workspace buffers
+    inside_rows = np.flatnonzero(inside)
+    outside_rows = np.flatnonzero(np.logical_not(inside))
+    inside_columns = {name: values.take(inside_rows) for name, values in columns.items()}
+    outside_columns = {name: values.take(outside_rows) for name, values in columns.items()}
+    if decimate is not None:
+        inside_columns = spatial.decimate(inside_columns, decimate, decimate_method)
+        outside_columns = spatial.decimate(outside_columns, decimate, decimate_method)
+    if dtype != np.float64:
+        inside_columns = {name: as_precision(values, dtype) for name, values in inside_columns.items()}
+        outside_columns = {name: as_precision(values, dtype) for name, values in outside_columns.items()}
+    return inside_columns, outside_columns
 
 
 def boundary(dtime, mlat, mlon):
-    mlts = convert.mlon_to_mlt(mlon, dtime)
+    mlts = frame_context(dtime).mlt(mlon)
     x, y = convert.mlat_mlt_to_xy(mlat, mlts)
     return x, y
 
@@ -128,17 +250,199 @@ def gridlines(minlat=50):
     return converted_lines_x, converted_lines_y
 
 
-def contours(pot_grid):
+# Potentials of the fitted coefficients are in volts, the contouring grids and CONTOUR_LEVELS are in kV
+POTENTIAL_SCALE = 1e-3
+
+
+def _contour_coeffs(coeffs):
+    # The potential is linear in the coefficients, so scaling them converts the whole grid
+    return np.asarray(coeffs) * POTENTIAL_SCALE
+
+
+def potential_grid(coeffs, hmb_lat=50, order=None, cache=None, dtype=None):
+    """
+    Return the electrostatic potential in kV evaluated on the contouring grid
+    :param coeffs: rotated map-pot coefficients, or a frame.FrameContext to use its coefficients, boundary latitude
+        and fit order
+    :param hmb_lat: Heppner-Maynard boundary latitude
+    :param order: fit order, defaults to the one implied by the number of coefficients
+    :param cache: optional cache.FrameCache
+    :param dtype: precision of the basis and grid, see utils.get_precision
+    :return: ndarray
+    """
+    if isinstance(coeffs, FrameContext):
+        coeffs, hmb_lat, order = coeffs.rotated_coeffs, coeffs.hmb_lat, coeffs.order
+    dtype = get_precision(dtype)
+    return cached(cache, 'potential_grid', (coeffs, hmb_lat, order, dtype.name),
+                  lambda: sdarn_get_potential_grid(_contour_coeffs(coeffs), hmb_lat, order, dtype=dtype))
+
+
+def adaptive_potential_grid(coeffs, hmb_lat=50, order=None, spacing=0.25, coarse=2.0, max_variation=3.0,
+                            cache=None):
+    """
+    Return the potential in kV on a fine contouring grid refined only around the contour levels, see
+    fitted_vectors.adaptive_potential_grid. Pass the grid to contours with the same spacing.
+    :param coeffs: rotated map-pot coefficients, or a frame.FrameContext to use its coefficients, boundary latitude
+        and fit order
+    :param spacing: fine grid spacing in degrees
+    :param coarse: initial cell size in degrees
+    :param max_variation: largest potential difference in kV across a cell that is not refined, half the contour
+        level spacing by default so that cells between levels are interpolated to within a few kV. None refines only
+        around the contour levels.
+    :param cache: optional cache.FrameCache
+    :return: ndarray and a dict of evaluation counts
+    """
+    if isinstance(coeffs, FrameContext):
+        coeffs, hmb_lat, order = coeffs.rotated_coeffs, coeffs.hmb_lat, coeffs.order
+    return cached(cache, 'adaptive_potential_grid', (coeffs, hmb_lat, order, spacing, coarse, max_variation),
+                  lambda: _adaptive_potential_grid(_contour_coeffs(coeffs), hmb_lat, order, CONTOUR_LEVELS, spacing,
+                                                   coarse, max_variation, IMAGE_EXTENT))
+
+
+CONTOUR_LEVELS = [-57., -51., -45., -39., -33., -27., -21., -15., -9., -3., 3., 9., 15., 21., 27., 33., 39., 45., 51.,
+                  57.]
+
+
+def contours(pot_grid, cache=None, spacing=1.0):
+    """
+    Return the potential contour lines of a grid centred on the pole
+    :param pot_grid: ndarray from potential_grid or adaptive_potential_grid, rows increasing in y and columns in x
+    :param cache: optional cache.FrameCache
+    :param spacing: grid spacing in degrees
+    """
+    return cached(cache, 'contours', (pot_grid, spacing), lambda: _contours(pot_grid, spacing))
+
+
+def _contours(pot_grid, spacing=1.0):
+    from skimage import measure
     xs = []
     ys = []
+    centre = (pot_grid.shape[0] - 1) * spacing / 2.
 
-    levels = [-57.0000,-51.0000,-45.0000,-39.0000,-33.0000,-27.0000,-21.0000,-15.0000,-9.00000,-3.0000, 3.00000, 9.00000,15.0000,21.0000,27.0000,33.000,39.0000,45.0000,51.0000,57.0000]
-    for lev in levels:
+    for lev in CONTOUR_LEVELS:
         lines = measure.find_contours(pot_grid, lev)
         for contour in lines:
-            x = contour[:, 1] - 39.5
-            y = contour[:, 0] - 39.5
-            xs.append(x)
-            ys.append(-y)
+            xs.append(contour[:, 1] * spacing - centre)
+            ys.append(contour[:, 0] * spacing - centre)
 
     return xs, ys
+
+
+IMAGE_EXTENT = 40
+IMAGE_RESOLUTIONS = [64, 128, 256, 512, 1024]
+
+
+@functools.lru_cache(maxsize=16)
+def _image_weights(resolution, hmb_lat, n_r, n_lt):
+    """
+    Bilinear interpolation indices into the flattened polar grid and weights for each display pixel, and the mask
+    of pixels beyond the boundary latitude
+    """
+    centres = (np.arange(resolution) + 0.5) * 2. * IMAGE_EXTENT / resolution - IMAGE_EXTENT
+    x, y = np.meshgrid(centres, centres)
+    mlat, mlt = convert.xy_to_mlat_mlt(x.ravel(), y.ravel())
+    outside = mlat < hmb_lat
+    fr = np.clip((90 - mlat) / (90. - hmb_lat) * (n_r - 1), 0, n_r - 1)
+    ft = (mlt % 24) / 24. * n_lt
+    r0 = np.minimum(np.floor(fr).astype(np.intp), n_r - 2)
+    t0 = np.floor(ft).astype(np.intp) % n_lt
+    t1 = (t0 + 1) % n_lt
+    wr = fr - r0
+    wt = ft - np.floor(ft)
+    indices = np.stack([r0 * n_lt + t0, r0 * n_lt + t1, (r0 + 1) * n_lt + t0, (r0 + 1) * n_lt + t1])
+    weights = np.stack([(1 - wr) * (1 - wt), (1 - wr) * wt, wr * (1 - wt), wr * wt])
+    return indices, weights, outside
+
+
+def upsample_polar(polar, resolution, hmb_lat):
+    """
+    Bilinearly interpolate a polar grid from fitted_vectors.polar_potential_grid onto a square display grid
+    :param polar: ndarray of shape (n_r, n_lt)
+    :param resolution: number of pixels along each side of the display grid
+    :param hmb_lat: boundary latitude of the polar grid, pixels beyond it are NaN
+    :return: float32 ndarray of shape (resolution, resolution), rows increasing in y
+    """
+    n_r, n_lt = polar.shape
+    indices, weights, outside = _image_weights(resolution, float(hmb_lat), n_r, n_lt)
+    image = (polar.ravel()[indices] * weights).sum(axis=0).astype(np.float32)
+    image[outside] = np.nan
+    return image.reshape((resolution, resolution))
+
+
+def _polar_shape(resolution):
+    # The polar grid only needs to resolve the expansion, not every display pixel
+    return max(8, resolution // 8), max(32, resolution // 2)
+
+
+def potential_image(coeffs, hmb_lat=50, order=None, resolution=None, budget=0.05, cache=None):
+    """
+    Return the potential as an image layer, evaluated on a coarse polar grid and upsampled to display resolution
+    :param coeffs: rotated map-pot coefficients, or a frame.FrameContext to use its coefficients, boundary latitude
+        and fit order
+    :param hmb_lat: Heppner-Maynard boundary latitude
+    :param order: fit order
+    :param resolution: pixels along each side, chosen from budget if None
+    :param budget: target seconds per frame used to choose the resolution
+    :param cache: optional cache.FrameCache
+    :return: dict of columns for the p.image glyph
+    """
+    if isinstance(coeffs, FrameContext):
+        coeffs, hmb_lat, order = coeffs.rotated_coeffs, coeffs.hmb_lat, coeffs.order
+    if resolution is None:
+        resolution = image_resolution(budget, coeff_order(coeffs, order))
+    n_r, n_lt = _polar_shape(resolution)
+
+    def build():
+        polar = polar_potential_grid(coeffs, hmb_lat, n_r, n_lt, order)
+        return upsample_polar(polar, resolution, hmb_lat)
+
+    image = cached(cache, 'potential_image', (coeffs, hmb_lat, order, resolution), build)
+    return dict(image=[image], x=[-IMAGE_EXTENT], y=[-IMAGE_EXTENT], dw=[2 * IMAGE_EXTENT], dh=[2 * IMAGE_EXTENT])
+
+
+# Cost model of potential_image when a frame misses the cached grid basis and interpolation weights, as it usually
+# does because the boundary latitude changes from record to record. Measured on an x86-64 desktop with NumPy and
+# OpenBLAS: building the interpolation weights and upsampling take about 1.5e-7 s per display pixel, and building the
+# polar grid basis about 3e-8 s per grid node and expansion term. Scale the budget for slower machines.
+IMAGE_PIXEL_SECONDS = 1.5e-7
+IMAGE_TERM_SECONDS = 3e-8
+
+
+def image_cost(resolution, order=ORDER):
+    """
+    Estimated seconds potential_image takes for one frame at a resolution, see IMAGE_PIXEL_SECONDS
+    :param resolution: pixels along each side
+    :param order: fit order
+    :return: float
+    """
+    n_r, n_lt = _polar_shape(resolution)
+    return resolution ** 2 * IMAGE_PIXEL_SECONDS + n_r * n_lt * (order + 1) ** 2 * IMAGE_TERM_SECONDS
+
+
+def image_resolution(budget=0.05, order=ORDER):
+    """
+    Choose the largest standard image resolution whose estimated cost per frame (see image_cost) fits in ``budget``
+    seconds. The choice only depends on the arguments, pass a resolution to potential_image to override it.
+    :param budget: seconds
+    :param order: fit order of the frames
+    :return: int
+    """
+    fits = [r for r in IMAGE_RESOLUTIONS if image_cost(r, order) <= budget]
+    return fits[-1] if fits else IMAGE_RESOLUTIONS[0]
+
+
+def potential_limit(image):
+    """
+    Largest absolute potential of an image, the colour range of potential_mapper is +/- this
+    """
+    return float(np.nanmax(np.abs(image))) if np.any(np.isfinite(image)) else 1.0
+
+
+def potential_mapper(image):
+    """
+    Diverging colour mapper symmetric about zero potential for a potential image
+    """
+    from bokeh import palettes
+    from bokeh.models import LinearColorMapper
+    limit = potential_limit(image)
+    return LinearColorMapper(palette=palettes.RdBu11, low=-limit, high=limit, nan_color=(0, 0, 0, 0))
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""Asyncio reader that prefetches map files from slow shared storage
+
+The raw bytes of upcoming files are read concurrently in an executor while earlier files are decoded and consumed.
+Records are always handed over in file order.
+"""
+import os
+import asyncio
+import collections
+
+
+def _read_bytes(filename):
+    with open(filename, 'rb') as fh:
+        return fh.read()
+
+
+def _decode(raw):
+    import pydarn
+    return pydarn.SDarnRead(raw, True).read_map()
+
+
+class _Budget(object):
+    """
+    Bytes read but not yet consumed. A file is only fetched once its size fits in the budget, or when nothing else
+    is held so that a single file larger than the budget can still be read.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.held = 0
+        self.condition = asyncio.Condition()
+
+    async def reserve(self, size):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.held == 0 or self.held + size <= self.limit)
+            self.held += size
+
+    async def release(self, size):
+        async with self.condition:
+            self.held -= size
+            self.condition.notify_all()
+
+
+async def prefetch_records(filenames, concurrency=4, memory_budget=256 * 2 ** 20, read_bytes=_read_bytes,
+                           decode=_decode, size=os.path.getsize, executor=None):
+    """
+    Asynchronously yield the records of ``filenames`` in order, fetching upcoming files concurrently
+    :param filenames: list of map file paths
+    :param concurrency: maximum number of files being read at once
+    :param memory_budget: maximum number of raw bytes read ahead of the consumer
+    :param read_bytes: callable returning the contents of a file, run in the executor
+    :param decode: callable turning raw bytes into a list of records, run in the executor
+    :param size: callable returning a file's size in bytes, run in the executor
+    :param executor: concurrent.futures executor, defaults to the event loop's
+    :return: async generator of record dictionaries
+    """
+    loop = asyncio.get_event_loop()
+    slots = asyncio.Semaphore(concurrency)
+    budget = _Budget(memory_budget)
+    pending = collections.deque()
+    ready = asyncio.Condition()
+    done = [False]
+
+    async def fetch(filename):
+        try:
+            return await loop.run_in_executor(executor, read_bytes, filename)
+        finally:
+            slots.release()
+
+    async def schedule():
+        try:
+            for filename in filenames:
+                await slots.acquire()
+                try:
+                    nbytes = await loop.run_in_executor(executor, size, filename)
+                    await budget.reserve(nbytes)
+                except BaseException:
+                    slots.release()
+                    raise
+                async with ready:
+                    pending.append((asyncio.ensure_future(fetch(filename)), nbytes))
+                    ready.notify_all()
+        finally:
+            async with ready:
+                done[0] = True
+                ready.notify_all()
+
+    scheduler = asyncio.ensure_future(schedule())
+    try:
+        while True:
+            async with ready:
+                await ready.wait_for(lambda: pending or done[0])
+                if not pending:
+                    break
+                task, nbytes = pending.popleft()
+            try:
+                raw = await task
+                records = await loop.run_in_executor(executor, decode, raw)
+                del raw
+            finally:
+                await budget.release(nbytes)
+            for record in records:
+                yield record
+        # Re-raise anything that stopped the scheduler early
+        await scheduler
+    finally:
+        scheduler.cancel()
+        for task, _ in pending:
+            task.cancel()
+
+
+def iter_records(filenames, **kwargs):
+    """
+    Synchronous wrapper around prefetch_records, running its own event loop
+    :param filenames: list of map file paths
+    :param kwargs: passed on to prefetch_records
+    :return: generator of record dictionaries
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        records = prefetch_records(filenames, **kwargs)
+        while True:
+            try:
+                yield loop.run_until_complete(records.__anext__())
+            except StopAsyncIteration:
+                break
+        loop.run_until_complete(records.aclose())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
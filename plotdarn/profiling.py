@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+"""Opt-in memory and time profiling of processing stages
+
+Stages are measured with tracemalloc: the peak is the highest traced memory above the level at the start of the
+stage and the retained memory is what is still allocated when it ends. tracemalloc only sees allocations made by
+Python and NumPy in this process, and its counters are process-wide. A profiler therefore only measures the stages
+of one thread at a time, and starting a stage while another thread is inside one is an error. Allocations made by
+other threads during a stage are counted in it.
+
+tracemalloc can reset its peak from Python 3.9. Before that, tracing started by the profiler is restarted at each
+outermost stage, and a nested stage reports the peak of its outermost stage so far, an upper bound of its own.
+"""
+import time
+import threading
+import contextlib
+import tracemalloc
+
+ON_EXCEED = ['raise', 'warn', 'chunk']
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """
+    A stage's peak memory went over its budget. It is raised when the stage ends, or earlier from
+    MemoryProfiler.check called by the stage's work.
+    """
+
+    def __init__(self, stage, peak, budget):
+        super(MemoryBudgetExceeded, self).__init__(
+            "Stage {} peaked at {} bytes, over its budget of {} bytes".format(stage, peak, budget))
+        self.stage = stage
+        self.peak = peak
+        self.budget = budget
+
+
+class _Frame(object):
+
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.peak = start
+
+
+class MemoryProfiler(object):
+    """
+    Records the peak and retained memory and the time of named stages
+    :param budgets: dict of stage name to peak memory budget in bytes
+    :param on_exceed: 'raise' to fail with MemoryBudgetExceeded when a stage ends over budget, 'warn' to only count
+        it, or 'chunk' to also split the work of stages run with ``run(..., items=...)`` into chunks that fit. Budgets
+        are checked when a stage ends and whenever its work calls check, they do not stop a single allocation.
+    :param snapshots: also record the top allocation sites retained by each stage, which is much slower
+    :param top: number of allocation sites kept with snapshots
+    """
+
+    def __init__(self, budgets=None, on_exceed='raise', snapshots=False, top=5):
+        if on_exceed not in ON_EXCEED:
+            raise ValueError("Unknown on_exceed {}, expected one of {}".format(on_exceed, ON_EXCEED))
+        self.budgets = dict(budgets or {})
+        self.on_exceed = on_exceed
+        self.snapshots = snapshots
+        self.top = top
+        self.records = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # The thread whose stages are being measured
+        self._thread = None
+        self._started_tracing = False
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def start(self):
+        """
+        Start tracing if it is not already, stages start it automatically
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        """
+        Stop tracing if this profiler started it
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _claim(self, name):
+        with self._lock:
+            thread = threading.current_thread()
+            if self._thread is not None and self._thread is not thread:
+                raise RuntimeError("Cannot measure stage {} in thread {} while thread {} is inside a stage, "
+                                   "tracemalloc counters are process-wide".format(name, thread.name, self._thread.name))
+            self._thread = thread
+
+    def _release(self):
+        with self._lock:
+            self._thread = None
+
+    def _record(self, name, elapsed, peak, retained, sites):
+        with self._lock:
+            record = self.records.setdefault(name, {
+                'stage': name, 'calls': 0, 'time': 0.0, 'peak': 0, 'retained': 0, 'exceeded': 0,
+                'budget': self.budgets.get(name), 'sites': []})
+            record['calls'] += 1
+            record['time'] += elapsed
+            record['peak'] = max(record['peak'], peak)
+            record['last_peak'] = peak
+            record['retained'] += retained
+            if sites:
+                record['sites'] = sites
+            over = record['budget'] is not None and peak > record['budget']
+            if over:
+                record['exceeded'] += 1
+        return over
+
+    def check(self):
+        """
+        Check the traced peak so far against the budgets of the stages this thread is inside, so that long stages
+        can fail between steps rather than once they are done. Outside stages, or without budgets, it does nothing.
+        :return: name of the innermost stage over budget, or None
+        :raises MemoryBudgetExceeded: if a stage is over budget and on_exceed is 'raise'
+        """
+        stack = self._stack()
+        if not stack:
+            return None
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in reversed(stack):
+            budget = self.budgets.get(frame.name)
+            used = max(frame.peak, peak) - frame.start
+            if budget is not None and used > budget:
+                if self.on_exceed == 'raise':
+                    raise MemoryBudgetExceeded(frame.name, used, budget)
+                return frame.name
+        return None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager measuring a stage. Stages may be nested, an outer stage's peak includes its inner stages.
+        Only one thread at a time may be inside the stages of a profiler.
+        """
+        self.start()
+        stack = self._stack()
+        if not stack:
+            self._claim(name)
+            if not hasattr(tracemalloc, 'reset_peak') and self._started_tracing:
+                # Restarting is the only way to reset the peak before Python 3.9
+                tracemalloc.stop()
+                tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak)
+        frame = _Frame(name, current)
+        stack.append(frame)
+        before = tracemalloc.take_snapshot() if self.snapshots else None
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            current, peak = tracemalloc.get_traced_memory()
+            frame.peak = max(frame.peak, peak)
+            stack.pop()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, frame.peak)
+            else:
+                self._release()
+            sites = []
+            if before is not None:
+                stats = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+                sites = [(str(stat.traceback), stat.size_diff) for stat in stats[:self.top]]
+            over = self._record(name, elapsed, frame.peak - frame.start, current - frame.start, sites)
+        if over and self.on_exceed == 'raise':
+            raise MemoryBudgetExceeded(name, frame.peak - frame.start, self.budgets[name])
+
+    def run(self, name, func, items=None, combine=None, chunk_size=None):
+        """
+        Run ``func()``, or ``func(items)``, as a stage. With on_exceed 'chunk' and a budget for the stage, items are
+        processed in chunks: the first chunk measures the peak per item and the chunk size is scaled to fit the
+        budget, and the chunk results are joined with ``combine(list_of_results)``.
+        :param items: optional sequence passed to func
+        :param combine: callable joining chunk results, needed when chunking
+        :param chunk_size: size of the first chunk, 1/8 of the items by default
+        :return: the result of func
+        """
+        if items is None:
+            with self.stage(name):
+                return func()
+        budget = self.budgets.get(name)
+        if self.on_exceed != 'chunk' or budget is None or combine is None:
+            with self.stage(name):
+                return func(items)
+
+        items = list(items)
+        size = chunk_size or max(1, len(items) // 8)
+        results = []
+        start = 0
+        while start < len(items):
+            chunk = items[start:start + size]
+            with self.stage(name):
+                results.append(func(chunk))
+            peak = self.records[name]['last_peak']
+            start += len(chunk)
+            if peak > 0:
+                size = max(1, int(len(chunk) * budget / float(peak) * 0.8))
+        return combine(results)
+
+    def report(self):
+        """
+        Return the statistics of every stage: calls, total time, highest and last peak, total retained memory, budget,
+        the number of calls over budget and, with snapshots, the top allocation sites of the last call
+        :return: list of dict
+        """
+        with self._lock:
+            return [dict(record) for record in self.records.values()]
+
+    def format_report(self):
+        """
+        Return the report as a text table
+        """
+        lines = ['{:<20} {:>6} {:>10} {:>12} {:>12} {:>12} {:>8}'.format(
+            'stage', 'calls', 'time (s)', 'peak (MiB)', 'kept (MiB)', 'budget', 'over')]
+        for record in self.report():
+            budget = '-' if record['budget'] is None else '{:.1f}'.format(record['budget'] / 2. ** 20)
+            lines.append('{:<20} {:>6} {:>10.3f} {:>12.2f} {:>12.2f} {:>12} {:>8}'.format(
+                record['stage'], record['calls'], record['time'], record['peak'] / 2. ** 20,
+                record['retained'] / 2. ** 20, budget, record['exceeded']))
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profiled(profiler, name):
+    """
+    ``profiler.stage(name)`` if a profiler is given, otherwise a no-op
+    """
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name):
+            yield
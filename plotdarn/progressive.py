@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""Progressive rendering: a quick low-fidelity preview, refined layer by layer in the background
+
+The preview uses simplified coastlines, a potential image from the lowest orders of the expansion at low resolution
+and decimated vectors. A background thread then computes each full layer and writes it into the same
+ColumnDataSources. Every render starts a new generation; refinement of an older generation stops at the next layer
+and its results are dropped, so moving to another time cancels the work for the previous one. A layer that is being
+computed when its generation is cancelled is not interrupted, it runs to completion and is then discarded.
+"""
+import threading
+import functools
+from . import plotting
+from .frame import FrameContext
+from .spatial import cell_size
+
+
+class ProgressiveRenderer(object):
+    """
+    Keeps one figure and updates its sources for each record rendered
+    :param coastline_geoms: coastline geometries
+    :param title: figure title
+    :param cache: optional cache.FrameCache
+    :param doc: Bokeh document the figure is shown in, updates are then scheduled with add_next_tick_callback. Without
+        one the sources are updated directly, e.g. before saving the figure.
+    :param show_potential: draw the potential image and contours
+    :param preview_order: fit order the preview potential is truncated to
+    :param preview_resolution: pixels along each side of the preview potential image
+    :param simplify: tolerance in degrees used to simplify the preview coastlines
+    :param preview_pixels: decimation cell size of the preview vectors in screen pixels
+
+    ``error`` holds the exception that stopped the refinement of the current record, if any.
+    """
+
+    def __init__(self, coastline_geoms, title='SuperDarn', cache=None, doc=None, show_potential=True,
+                 preview_order=2, preview_resolution=64, simplify=1.0, preview_pixels=12):
+        self.coastline_geoms = list(coastline_geoms)
+        self.title = title
+        self.cache = cache
+        self.doc = doc
+        self.show_potential = show_potential
+        self.preview_order = preview_order
+        self.preview_resolution = preview_resolution
+        self.simplify = simplify
+        self.preview_pixels = preview_pixels
+        self.figure = None
+        self.sources = {}
+        self.generation = 0
+        self._coarse_geoms = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def coarse_geoms(self):
+        if self._coarse_geoms is None:
+            self._coarse_geoms = [geom.simplify(self.simplify, preserve_topology=False) for geom in
+                                  self.coastline_geoms]
+            self._coarse_geoms = [geom for geom in self._coarse_geoms
+                                  if not geom.is_empty and geom.geom_type == 'Polygon']
+        return self._coarse_geoms
+
+    def _vectors(self, record, frame, decimate=None):
+        return plotting.vector_columns(frame, record['vector.mlat'], record['vector.mlon'], None,
+                                       latmin=record['latmin'], mag=record['vector.vel.median'],
+                                       ang=record['vector.kvect'], cache=self.cache, decimate=decimate)
+
+    def preview_layers(self, record, frame):
+        """
+        The low-fidelity layers of a record
+        :return: dict as returned by plotdarn.frame_layers, with empty contours
+        """
+        layers = {
+            'coastlines': plotting.coastlines(frame, self.coarse_geoms, cache=self.cache),
+            'boundary': frame.boundary,
+            'vectors': self._vectors(record, frame, cell_size(2 * plotting.IMAGE_EXTENT, pixels=self.preview_pixels)),
+        }
+        if self.show_potential:
+            order = min(self.preview_order, frame.order)
+            coeffs = frame.rotated_coeffs[:(order + 1) ** 2]
+            layers['potential_image'] = plotting.potential_image(coeffs, frame.hmb_lat, order,
+                                                                 resolution=self.preview_resolution)
+            layers['contours'] = ([], [])
+        return layers
+
+    def refinements(self, record, frame):
+        """
+        The steps refining the preview, in order
+        :return: list of (layer name, callable returning the layer)
+        """
+        steps = [
+            ('vectors', lambda: self._vectors(record, frame)),
+            ('coastlines', lambda: plotting.coastlines(frame, self.coastline_geoms, cache=self.cache)),
+        ]
+        if self.show_potential:
+            steps += [
+                ('potential_image', lambda: plotting.potential_image(frame, cache=self.cache)),
+                ('contours', lambda: plotting.contours(plotting.potential_grid(frame, cache=self.cache),
+                                                       cache=self.cache)),
+            ]
+        return steps
+
+    def render(self, record):
+        """
+        Show the preview of a record at once and start refining it in the background, cancelling the refinement of
+        the previously rendered record
+        :param record: record dictionary
+        :return: the figure
+        """
+        from .plotdarn import render_layers
+        with self._lock:
+            self.generation += 1
+            generation = self.generation
+            self.error = None
+        frame = FrameContext.from_record(record, cache=self.cache)
+        preview = self.preview_layers(record, frame)
+        if self.figure is None:
+            self.figure = render_layers(preview, title=self.title, sources=self.sources)
+        else:
+            self._apply(generation, preview)
+        self._thread = threading.Thread(target=self._refine, args=(generation, record, frame),
+                                        name='refine-{}'.format(generation))
+        self._thread.daemon = True
+        self._thread.start()
+        return self.figure
+
+    def cancel(self):
+        """
+        Stop refining the current record
+        """
+        with self._lock:
+            self.generation += 1
+
+    def wait(self, timeout=None):
+        """
+        Wait for the current refinement to finish
+        :return: True if it finished
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def _current(self, generation):
+        with self._lock:
+            return generation == self.generation
+
+    def _refine(self, generation, record, frame):
+        try:
+            for name, compute in self.refinements(record, frame):
+                if not self._current(generation):
+                    return
+                layer = compute()
+                if not self._current(generation):
+                    return
+                self._apply(generation, {name: layer})
+        except Exception as exc:
+            # Keep the preview on screen, the error is kept for the caller to inspect unless a newer record is shown
+            with self._lock:
+                if generation == self.generation:
+                    self.error = exc
+
+    def _apply(self, generation, layers):
+        from .plotdarn import layer_sources
+        data = layer_sources(layers)
+        if self.doc is not None:
+            self.doc.add_next_tick_callback(functools.partial(self._update, generation, data))
+        else:
+            self._update(generation, data)
+
+    def _update(self, generation, data):
+        if not self._current(generation):
+            return
+        for name, columns in data.items():
+            if name in self.sources:
+                self.sources[name].data = columns
+        if 'potential_image' in data and 'potential_mapper' in self.sources:
+            limit = plotting.potential_limit(data['potential_image']['image'][0])
+            self.sources['potential_mapper'].update(low=-limit, high=limit)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""Static plot layers held once in shared memory for process-pool workers
+
+The parent packs the time-independent inputs that workers compute frames from (flat coastline coordinates and grid
+basis matrices) into a single shared-memory segment. Workers attach to it by name and get read-only NumPy views, so
+nothing is pickled per task or copied per worker. Gridlines are drawn by the parent only and are not shared.
+
+The segment is unlinked when the owning SharedArrays is closed, garbage collected or the interpreter exits. If the
+owner is killed, the multiprocessing resource tracker unlinks it. Workers never unlink the segment. Workers should be
+started by multiprocessing (e.g. a process pool) so that they share the owner's resource tracker.
+
+Shared memory needs Python 3.8 or later.
+"""
+import weakref
+import numpy as np
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+_ALIGN = 64
+
+# The layers attached by this process, see init_worker
+_attached = None
+
+
+def _require_shared_memory():
+    if shared_memory is None:
+        raise RuntimeError("Shared memory needs Python 3.8 or later")
+
+
+def _release(shm, unlink):
+    try:
+        shm.close()
+    except BufferError:
+        # Views are still alive, the mapping goes away with the process
+        pass
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedArrays(object):
+    """
+    Named arrays packed into one shared-memory segment. Create with SharedArrays.create in the parent and pass
+    ``handle`` to the workers, which call SharedArrays.attach.
+    """
+
+    def __init__(self, shm, manifest, owner):
+        self.shm = shm
+        self.manifest = manifest
+        self.owner = owner
+        self._finalizer = weakref.finalize(self, _release, shm, owner)
+
+    @classmethod
+    def create(cls, arrays):
+        """
+        Copy arrays into a new segment
+        :param arrays: dict of name to ndarray
+        :return: SharedArrays owning the segment
+        """
+        _require_shared_memory()
+        manifest = {}
+        size = 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            manifest[name] = (array.dtype.str, array.shape, size)
+            size += -(-array.nbytes // _ALIGN) * _ALIGN
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        shared = cls(shm, manifest, owner=True)
+        for name, array in arrays.items():
+            view = shared._view(name)
+            view[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, handle):
+        """
+        Attach to a segment created in another process
+        :param handle: the ``handle`` of the creating SharedArrays
+        :return: SharedArrays with read-only views
+        """
+        _require_shared_memory()
+        name, manifest = handle
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the segment with the resource tracker. Processes started by
+            # multiprocessing share the creator's tracker, where it is already registered, so this is harmless.
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, manifest, owner=False)
+
+    @property
+    def handle(self):
+        """
+        Picklable reference to the segment
+        """
+        return self.shm.name, self.manifest
+
+    def _view(self, name):
+        dtype, shape, offset = self.manifest[name]
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.shm.buf, offset=offset)
+
+    def __getitem__(self, name):
+        view = self._view(name)
+        view.flags.writeable = False
+        return view
+
+    def __contains__(self, name):
+        return name in self.manifest
+
+    def keys(self):
+        return list(self.manifest)
+
+    def close(self):
+        """
+        Release the segment, unlinking it if this is the owner. Views obtained from it must no longer be used.
+        """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def record_grid_bases(records, size=80):
+    """
+    The contouring grid bases of the frames of some records, as used by plotting.potential_grid. Bases are looked up
+    by each record's exact boundary latitude and fit order, so share those of the records a run will process.
+    :param records: record dictionaries, e.g. those of the first file of a run
+    :param size: contouring grid size, see fitted_vectors.sdarn_get_potential_grid
+    :return: sorted list of (grid name, key) pairs for share_static_layers
+    """
+    from .fitted_vectors import coeff_order, fit_order
+    keys = {(float(r['latmin']), coeff_order(r['N+2'], fit_order(r)), size) for r in records}
+    return [('potential_grid', key) for key in sorted(keys)]
+
+
+def share_static_layers(coastline_geoms, bases=()):
+    """
+    Put the static layers of a run into shared memory
+    :param coastline_geoms: coastline geometries, e.g. from plotdarn.read_coast
+    :param bases: (grid name, key) pairs of grid bases to share, see fitted_vectors.grid_basis and record_grid_bases
+    :return: SharedArrays owning the segment, keep it alive while workers use it
+    """
+    from .plotting import flatten_coastlines
+    from .fitted_vectors import grid_basis
+    glat, glon, offsets = flatten_coastlines(coastline_geoms)
+    arrays = {'coastlines.glat': glat, 'coastlines.glon': glon, 'coastlines.offsets': offsets}
+    for name, key in bases:
+        arrays['basis:{}:{}'.format(name, ':'.join(str(k) for k in key))] = grid_basis(name, *key)
+    return SharedArrays.create(arrays)
+
+
+def static_layers(shared):
+    """
+    Read-only views of the static layers in a segment, installing its bases for the fitted_vectors grid functions
+    :param shared: SharedArrays
+    :return: dict with 'coastlines' as (glat, glon, offsets) for plotting.coastlines_flat
+    """
+    from .fitted_vectors import install_grid_basis
+    for name in shared.keys():
+        if name.startswith('basis:'):
+            _, grid, key = name.split(':', 2)
+            install_grid_basis(grid, key.split(':'), shared[name])
+    return {'coastlines': (shared['coastlines.glat'], shared['coastlines.glon'], shared['coastlines.offsets'])}
+
+
+def init_worker(handle):
+    """
+    Process pool initializer attaching the worker to the static layers, e.g.
+    ``ProcessPoolExecutor(initializer=init_worker, initargs=(shared.handle,))``
+    """
+    global _attached
+    shared = SharedArrays.attach(handle)
+    _attached = (shared, static_layers(shared))
+
+
+def attached_layers():
+    """
+    Return the static layers attached by init_worker in this process
+    :return: dict, see static_layers
+    """
+    if _attached is None:
+        raise RuntimeError("No static layers attached to this process, use init_worker as the pool initializer")
+    return _attached[1]
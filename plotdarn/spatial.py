@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""Spatial operations on vectors in plot coordinates"""
+from collections import OrderedDict
+import numpy as np
+from plotdarn import convert
+from .utils import scale_velocity
+
+DECIMATE_METHODS = ['mean', 'max', 'first']
+
+
+def cell_size(view_width, plot_width=600, pixels=6):
+    """
+    Size of a decimation cell in plot coordinates so that cells are ``pixels`` screen pixels wide
+    :param view_width: width of the visible x range in plot coordinates, 80 when fully zoomed out
+    :param plot_width: width of the plot in pixels
+    :param pixels: cell width in pixels
+    :return: float
+    """
+    return float(view_width) * pixels / plot_width
+
+
+def _cell_keys(x, y, size):
+    ix = np.floor(np.asarray(x) / size).astype(np.int64)
+    iy = np.floor(np.asarray(y) / size).astype(np.int64)
+    ix -= ix.min()
+    iy -= iy.min()
+    return ix * (iy.max() + 1) + iy
+
+
+def decimate(columns, size, method='mean'):
+    """
+    Keep one vector per square cell of the plot plane, which is equal-area in plot coordinates.
+
+    The vector kept is the first one of each cell for 'first' and the fastest for 'max'. For 'mean' the first
+    vector's position is kept and its velocity replaced by the vector mean of the cell.
+    :param columns: dict of arrays in the layout of plotting.vector_columns
+    :param size: cell size in plot coordinates, see cell_size
+    :param method: 'mean', 'max' or 'first'
+    :return: dict of arrays in the same layout with an added 'count' column
+    """
+    if method not in DECIMATE_METHODS:
+        raise ValueError("Unknown method {}, expected one of {}".format(method, DECIMATE_METHODS))
+    columns = {name: np.asarray(values) for name, values in columns.items()}
+    if len(columns['x']) == 0:
+        return dict(columns, count=np.zeros(0, dtype=np.int64))
+
+    key = _cell_keys(columns['x'], columns['y'], size)
+    if method == 'max':
+        order = np.lexsort((-columns['m'], key))
+    else:
+        order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    starts = np.flatnonzero(np.concatenate([[True], sorted_key[1:] != sorted_key[:-1]]))
+    keep = order[starts]
+
+    out = {name: values[keep] for name, values in columns.items()}
+    out['count'] = np.diff(np.append(starts, len(order)))
+    if method == 'mean':
+        ang = np.radians(columns['ang'][order])
+        mag = columns['m'][order]
+        north = np.add.reduceat(mag * np.cos(ang), starts) / out['count']
+        east = np.add.reduceat(mag * np.sin(ang), starts) / out['count']
+        out['m'] = np.hypot(north, east)
+        out['ang'] = np.degrees(np.arctan2(east, north))
+        out['le'] = scale_velocity(out['m'])
+        out['an'] = convert.xy_angle_to_origin(out['x'], out['y'], out['ang'])
+    return out
+
+
+class VectorIndex(object):
+    """
+    KD-tree index of vector positions in plot coordinates, one tree per frame so that frames can be added and
+    dropped as they stream in. Query results map each frame key to the indices of its matching vectors.
+    :param max_frames: keep at most this many of the most recently added frames, or all of them if None
+    """
+
+    def __init__(self, max_frames=None):
+        self.max_frames = max_frames
+        self._frames = OrderedDict()
+
+    def __len__(self):
+        return sum(len(points) for _, points in self._frames.values())
+
+    def keys(self):
+        return list(self._frames)
+
+    def add_frame(self, key, x, y):
+        """
+        Index the positions of one frame, replacing any frame with the same key
+        :param key: hashable frame key, e.g. the record time
+        :param x: ndarray of plot x coordinates
+        :param y: ndarray of plot y coordinates
+        """
+        from scipy.spatial import cKDTree
+        points = np.column_stack([np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)])
+        self._frames.pop(key, None)
+        self._frames[key] = (cKDTree(points), points)
+        if self.max_frames is not None:
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+
+    def add_record(self, record, frame=None):
+        """
+        Index the vectors of a map record, keyed by its time, in record order
+        :param record: dictionary as read by pydarn
+        :param frame: the record's frame.FrameContext, built if not given
+        :return: the key
+        """
+        from .frame import FrameContext
+        if frame is None:
+            frame = FrameContext.from_record(record)
+        x, y = convert.mlat_mlt_to_xy(np.asarray(record['vector.mlat']), frame.mlt(record['vector.mlon']))
+        self.add_frame(frame.dtime, x, y)
+        return frame.dtime
+
+    def remove_frame(self, key):
+        del self._frames[key]
+
+    def nearest(self, x, y, k=1, max_distance=np.inf, keys=None):
+        """
+        Find the k vectors nearest to a point over all frames, or only those in keys
+        :return: list of (key, index, distance) sorted by distance
+        """
+        found = []
+        for key in (self._frames if keys is None else keys):
+            tree, points = self._frames[key]
+            if not len(points):
+                continue
+            dist, idx = tree.query([x, y], k=min(k, len(points)), distance_upper_bound=max_distance)
+            for d, i in zip(np.atleast_1d(dist), np.atleast_1d(idx)):
+                if np.isfinite(d):
+                    found.append((d, key, int(i)))
+        found.sort(key=lambda item: item[0])
+        return [(key, i, d) for d, key, i in found[:k]]
+
+    def radius(self, x, y, r, keys=None):
+        """
+        Find the vectors within distance r of a point
+        :return: dict of frame key to sorted index arrays
+        """
+        return self._collect(keys, lambda tree, points: tree.query_ball_point([x, y], r))
+
+    def box(self, x0, y0, x1, y1, keys=None):
+        """
+        Find the vectors inside the axis-aligned box [x0, x1] x [y0, y1]
+        :return: dict of frame key to sorted index arrays
+        """
+        centre = [(x0 + x1) / 2., (y0 + y1) / 2.]
+        half = max(abs(x1 - x0), abs(y1 - y0)) / 2.
+
+        def query(tree, points):
+            idx = np.asarray(tree.query_ball_point(centre, half, p=np.inf), dtype=np.int64)
+            p = points[idx]
+            keep = (p[:, 0] >= min(x0, x1)) & (p[:, 0] <= max(x0, x1)) & \
+                   (p[:, 1] >= min(y0, y1)) & (p[:, 1] <= max(y0, y1))
+            return idx[keep]
+
+        return self._collect(keys, query)
+
+    def polygon(self, polygon_x, polygon_y, keys=None):
+        """
+        Find the vectors inside a polygon, testing only the candidates inside its bounding box
+        :return: dict of frame key to sorted index arrays
+        """
+        import matplotlib.path as mpltPath
+        path = mpltPath.Path(np.column_stack([polygon_x, polygon_y]))
+        candidates = self.box(np.min(polygon_x), np.min(polygon_y), np.max(polygon_x), np.max(polygon_y), keys)
+        return {key: idx[path.contains_points(self._frames[key][1][idx])] if len(idx) else idx
+                for key, idx in candidates.items()}
+
+    def _collect(self, keys, query):
+        result = {}
+        for key in (self._frames if keys is None else keys):
+            tree, points = self._frames[key]
+            idx = np.asarray(query(tree, points), dtype=np.int64) if len(points) else np.zeros(0, dtype=np.int64)
+            result[key] = np.sort(idx)
+        return result
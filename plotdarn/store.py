@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""Columnar on-disk store of map records
+
+A store is a directory of ``.npy`` files, one per column. Per-record columns (time, fit order, latmin and the
+NaN-padded coefficients) have one row per record. Ragged columns (the HMB boundary and the vectors) are stored as
+one flat array per column plus an offsets array of length ``n_records + 1``, so record ``i`` covers
+``offsets[i]:offsets[i + 1]``. Columns are opened memory-mapped, so slicing a time range copies nothing.
+"""
+import os
+import json
+import shutil
+import numpy as np
+from .utils import record_time
+
+MAX_ORDER = 12
+
+RECORD_COLUMNS = ['time', 'fit.order', 'latmin', 'N+2']
+BOUNDARY_COLUMNS = ['boundary.mlat', 'boundary.mlon']
+VECTOR_COLUMNS = ['vector.mlat', 'vector.mlon', 'vector.kvect', 'vector.vel.median']
+OFFSET_COLUMNS = {'boundary': BOUNDARY_COLUMNS, 'vector': VECTOR_COLUMNS}
+
+
+class StoreWriter(object):
+    """
+    Append map records to a new store. Columns are streamed to raw temporary files so a month of records never has
+    to be held in memory, and are turned into ``.npy`` files on close.
+    """
+
+    def __init__(self, directory, max_order=MAX_ORDER):
+        if os.path.exists(os.path.join(directory, 'meta.json')):
+            raise ValueError("Store already exists: {}".format(directory))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_order = max_order
+        self.n_records = 0
+        self._dtypes = {}
+        self._files = {}
+        self._offsets = {name: [0] for name in OFFSET_COLUMNS}
+
+    def _append(self, name, values, dtype):
+        values = np.ascontiguousarray(values, dtype=dtype)
+        if name not in self._files:
+            self._dtypes[name] = values.dtype
+            self._files[name] = open(self._raw_path(name), 'wb')
+        values.tofile(self._files[name])
+
+    def _raw_path(self, name):
+        return os.path.join(self.directory, name + '.raw')
+
+    def add_record(self, record):
+        """
+        Append a single map record dictionary as read by pydarn
+        :param record: dict
+        """
+        order = int(record.get('fit.order', 6))
+        if order > self.max_order:
+            raise ValueError("Fit order {} is larger than the store's maximum of {}".format(order, self.max_order))
+        coeffs = np.full((self.max_order + 1) ** 2, np.nan)
+        values = np.asarray(record['N+2'], dtype=np.float64)
+        coeffs[:len(values)] = values
+
+        self._append('time', [np.datetime64(record_time(record), 'ms')], 'datetime64[ms]')
+        self._append('fit.order', [order], np.int16)
+        self._append('latmin', [record['latmin']], np.float64)
+        self._append('N+2', coeffs, np.float64)
+        for group, columns in OFFSET_COLUMNS.items():
+            length = len(record[columns[0]])
+            for name in columns:
+                if len(record[name]) != length:
+                    raise ValueError("Column {} does not match the length of {}".format(name, columns[0]))
+                self._append(name, record[name], np.float64)
+            self._offsets[group].append(self._offsets[group][-1] + length)
+        self.n_records += 1
+
+    def add_records(self, records):
+        for record in records:
+            self.add_record(record)
+
+    def close(self):
+        """
+        Convert the raw column files into ``.npy`` files and write the store metadata
+        """
+        shapes = {}
+        for name, fh in self._files.items():
+            fh.close()
+            count = os.path.getsize(self._raw_path(name)) // self._dtypes[name].itemsize
+            shape = (self.n_records, (self.max_order + 1) ** 2) if name == 'N+2' else (count,)
+            shapes[name] = shape
+            with open(os.path.join(self.directory, name + '.npy'), 'wb') as out:
+                header = {'descr': np.lib.format.dtype_to_descr(self._dtypes[name]), 'fortran_order': False,
+                          'shape': shape}
+                np.lib.format.write_array_header_1_0(out, header)
+                with open(self._raw_path(name), 'rb') as raw:
+                    shutil.copyfileobj(raw, out)
+            os.remove(self._raw_path(name))
+        for group, offsets in self._offsets.items():
+            np.save(os.path.join(self.directory, group + '.offsets.npy'), np.array(offsets, dtype=np.int64))
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as fh:
+            json.dump({'n_records': self.n_records, 'max_order': self.max_order}, fh)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for name, fh in self._files.items():
+                fh.close()
+                os.remove(self._raw_path(name))
+
+
+def ingest(filenames, directory, max_order=MAX_ORDER):
+    """
+    Decode map files with pydarn and write all their records, in the order given, to a new store
+    :param filenames: list of map file paths
+    :param directory: store directory to create
+    :param max_order: largest fit order to allow room for in the coefficient column
+    :return: MapStore
+    """
+    import pydarn
+    with StoreWriter(directory, max_order=max_order) as writer:
+        for filename in filenames:
+            writer.add_records(pydarn.SDarnRead(filename).read_map())
+    return MapStore(directory)
+
+
+class MapStore(object):
+    """
+    Read-only, memory-mapped view of a store written by StoreWriter. Records are expected in time order.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as fh:
+            meta = json.load(fh)
+        self.directory = directory
+        self.max_order = meta['max_order']
+        if meta['n_records'] == 0:
+            # No column files are written for an empty store
+            self.columns = {name: np.zeros(0) for name in BOUNDARY_COLUMNS + VECTOR_COLUMNS}
+            self.columns.update({'time': np.array([], dtype='datetime64[ms]'), 'fit.order': np.zeros(0, np.int16),
+                                 'latmin': np.zeros(0), 'N+2': np.zeros((0, (self.max_order + 1) ** 2))})
+            self.offsets = {group: np.zeros(1, dtype=np.int64) for group in OFFSET_COLUMNS}
+            self.times = self.columns['time']
+            return
+        self.columns = {}
+        for name in RECORD_COLUMNS + BOUNDARY_COLUMNS + VECTOR_COLUMNS:
+            self.columns[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+        self.offsets = {group: np.load(os.path.join(directory, group + '.offsets.npy'))
+                        for group in OFFSET_COLUMNS}
+        self.times = self.columns['time']
+
+    def __len__(self):
+        return len(self.times)
+
+    def time_slice(self, start=None, end=None):
+        """
+        Return the slice of record indices with start times in [start, end)
+        :param start: datetime or None for the first record
+        :param end: datetime or None for the last record
+        :return: slice
+        """
+        i0 = 0 if start is None else int(np.searchsorted(self.times, np.datetime64(start, 'ms'), side='left'))
+        i1 = len(self) if end is None else int(np.searchsorted(self.times, np.datetime64(end, 'ms'), side='left'))
+        return slice(i0, i1)
+
+    def column(self, name, start=None, end=None):
+        """
+        Return a zero-copy view of a column over a time range. Ragged columns are returned flat, use ``offsets`` to
+        split them by record.
+        """
+        records = self.time_slice(start, end)
+        for group, columns in OFFSET_COLUMNS.items():
+            if name in columns:
+                offsets = self.offsets[group]
+                return self.columns[name][offsets[records.start]:offsets[records.stop]]
+        return self.columns[name][records]
+
+    def record(self, index):
+        """
+        Return record ``index`` as a dictionary with the same keys pydarn uses. Arrays are views into the store.
+        """
+        time = self.times[index].astype(object)
+        order = int(self.columns['fit.order'][index])
+        record = {
+            'start.year': time.year, 'start.month': time.month, 'start.day': time.day, 'start.hour': time.hour,
+            'start.minute': time.minute, 'start.second': time.second + time.microsecond / 1e6,
+            'fit.order': order,
+            'latmin': float(self.columns['latmin'][index]),
+            'N+2': self.columns['N+2'][index, :(order + 1) ** 2],
+        }
+        for group, columns in OFFSET_COLUMNS.items():
+            i0, i1 = self.offsets[group][index], self.offsets[group][index + 1]
+            for name in columns:
+                record[name] = self.columns[name][i0:i1]
+        return record
+
+    def records(self, start=None, end=None):
+        """
+        Return the records with start times in [start, end)
+        :return: list of dictionaries
+        """
+        return [self.record(i) for i in range(*self.time_slice(start, end).indices(len(self)))]
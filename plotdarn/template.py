@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""Frame documents spliced into a pre-serialized template
+
+Most of a frame's Bokeh document is the same for every frame: the gridlines, colour bar, ranges, tools and styling.
+A FrameTemplate builds the figure once, serializes it to Bokeh's JSON item format and cuts the JSON text at the
+values that change between frames: the data of each layer's ColumnDataSource, the potential colour range and the
+title. A frame is then the template text with only those values serialized and spliced in, which is the same
+document bokeh.embed.json_item would produce for the frame's figure, up to model ids.
+"""
+import re
+import json
+import html
+
+_SLOT = '@@plotdarn-slot:{}@@'
+_SLOT_PATTERN = re.compile(r'"@@plotdarn-slot:(\w+)@@"')
+# As bokeh.core.json_encoder.serialize_json
+_SEPARATORS = (',', ':')
+
+_PAGE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{resources}
+</head>
+<body>
+<div id="{target}"></div>
+<script type="text/javascript">
+Bokeh.embed.embed_item({item}, "{target}");
+</script>
+</body>
+</html>
+'''
+
+
+def _mark(node, slots):
+    """
+    Replace the attributes of the models in slots, a dict of model id to {attribute: slot name}, with slot markers
+    """
+    if isinstance(node, dict):
+        if node.get('id') in slots and 'attributes' in node:
+            for attribute, name in slots[node['id']].items():
+                node['attributes'][attribute] = _SLOT.format(name)
+        for value in node.values():
+            _mark(value, slots)
+    elif isinstance(node, list):
+        for value in node:
+            _mark(value, slots)
+
+
+class FrameTemplate(object):
+    """
+    Pre-serialized frame document
+    :param layers: layers of any frame, as returned by plotdarn.frame_layers. Every frame rendered with the template
+        must have the same set of layers.
+    :param title: default frame title
+    :param target: id of the HTML element the frame is embedded in
+    """
+
+    def __init__(self, layers, title='SuperDarn', target='plotdarn'):
+        from bokeh.embed import json_item
+        from .plotdarn import render_layers
+        self.title = title
+        self.target = target
+        sources = {}
+        figure = render_layers(layers, title=title, sources=sources)
+        self.layers = sorted(name for name in sources if name != 'potential_mapper')
+
+        slots = {source.id: {'data': name} for name, source in sources.items() if name in self.layers}
+        slots[figure.title.id] = {'text': 'title'}
+        if 'potential_mapper' in sources:
+            slots[sources['potential_mapper'].id] = {'low': 'potential_low', 'high': 'potential_high'}
+        item = json_item(figure, target=target)
+        _mark(item, slots)
+        # Alternating static text and slot names
+        self._parts = _SLOT_PATTERN.split(json.dumps(item, separators=_SEPARATORS))
+        self._page = None
+
+    def values(self, layers, title=None):
+        """
+        Serialize the values of a frame that are spliced into the template
+        :param layers: dict as returned by plotdarn.frame_layers
+        :param title: frame title, the template's if None
+        :return: dict of slot name to JSON text
+        """
+        from bokeh.core.serialization import Serializer
+        from .plotdarn import layer_sources
+        from . import plotting
+        data = layer_sources(layers)
+        if sorted(data) != self.layers:
+            raise ValueError("Frame layers {} do not match the template's {}".format(sorted(data), self.layers))
+        serializer = Serializer(deferred=False)
+        values = {name: json.dumps(serializer.encode(columns), separators=_SEPARATORS)
+                  for name, columns in data.items()}
+        values['title'] = json.dumps(self.title if title is None else title)
+        if 'potential_image' in data:
+            limit = plotting.potential_limit(data['potential_image']['image'][0])
+            values['potential_low'] = json.dumps(-limit)
+            values['potential_high'] = json.dumps(limit)
+        return values
+
+    def json(self, layers, title=None):
+        """
+        Return the frame document in the format of bokeh.embed.json_item, as JSON text
+        :param layers: dict as returned by plotdarn.frame_layers
+        :param title: frame title, the template's if None
+        :return: str
+        """
+        values = self.values(layers, title)
+        parts = list(self._parts)
+        parts[1::2] = [values[name] for name in parts[1::2]]
+        return ''.join(parts)
+
+    def html(self, layers, title=None):
+        """
+        Return the frame as a standalone HTML page loading BokehJS from the CDN
+        :param layers: dict as returned by plotdarn.frame_layers
+        :param title: frame title, the template's if None
+        :return: str
+        """
+        if self._page is None:
+            from bokeh.resources import CDN
+            page = _PAGE.replace('{resources}', CDN.render_js()).replace('{target}', self.target)
+            self._page = page.split('{item}')
+        title = self.title if title is None else title
+        head, tail = self._page
+        # The item is inside a script element, which must not be closed early
+        item = self.json(layers, title).replace('</', '<\\/')
+        return head.replace('{title}', html.escape(title)) + item + tail
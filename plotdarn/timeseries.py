@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""Per-record summary time series of the convection pattern
+
+Potential extrema and the cross-polar-cap potential are found for many records at once: the stacked coefficient
+vectors of a chunk of records are multiplied by one cached polar-grid basis, the extremum of each row is taken and
+optionally refined on a small local stencil. Records are consumed a chunk at a time, so only one chunk of records
+is held at once, and the grid potentials of a chunk are evaluated in blocks of at most GRID_BYTES. The peak memory
+is therefore the float64 coefficients of one chunk, chunk_size * (order + 1) ** 2 * 8 bytes, plus the working arrays
+of one block: GRID_BYTES of grid potentials and, at order 8, about as much again for the refinement stencils. The
+summaries of all chunks are kept until they are joined, a few dozen bytes per record.
+"""
+import numpy as np
+from .fitted_vectors import coeff_order, fit_order, grid_basis, potential_basis, sdarn_rotate_coeffs
+from .utils import record_time
+
+SUMMARY_COLUMNS = ['time', 'pot_max', 'pot_max_mlat', 'pot_max_mlt', 'pot_min', 'pot_min_mlat', 'pot_min_mlt',
+                   'cpcp', 'hmb_lat', 'n_vectors']
+
+# Largest block of grid potentials evaluated at once
+GRID_BYTES = 16 * 2 ** 20
+
+
+def _grid_shape(hmb_lat, spacing):
+    n_r = int(np.ceil((90. - hmb_lat) / spacing)) + 1
+    n_lt = int(np.ceil(360. / spacing))
+    return n_r, n_lt
+
+
+def _ut_hours(times):
+    # sdarn_rotate_coeffs takes UT in hours
+    times = np.asarray(times, dtype='datetime64[ms]')
+    return (times - times.astype('datetime64[D]')) / np.timedelta64(3600000, 'ms')
+
+
+def _refine(coeffs, hmb_lat, order, mlat, mlt, dlat, dlt, sign, iterations):
+    """
+    Search a 5 x 5 stencil around each record's extremum, halving the stencil each iteration
+    """
+    offsets = np.linspace(-1, 1, 5)
+    off_lat, off_lt = [o.ravel() for o in np.meshgrid(offsets, offsets, indexing='ij')]
+    pot = None
+    for _ in range(iterations):
+        lats = np.clip(mlat[:, np.newaxis] + off_lat * dlat, hmb_lat, 90.)
+        lts = (mlt[:, np.newaxis] + off_lt * dlt) % 24
+        basis = potential_basis(hmb_lat, lats.ravel(), lts.ravel(), order).reshape(lats.shape + (-1,))
+        pot = np.einsum('nsk,nk->ns', basis, coeffs)
+        best = np.argmax(sign * pot, axis=1)
+        rows = np.arange(len(best))
+        mlat, mlt, pot = lats[rows, best], lts[rows, best], pot[rows, best]
+        dlat, dlt = dlat / 2., dlt / 2.
+    return pot, mlat, mlt
+
+
+def summarise(times, coeffs, hmb_lats, orders, n_vectors, spacing=2.0, refine=True, iterations=4):
+    """
+    Compute the summary quantities of a block of records from their stacked coefficients
+    :param times: datetime64 array of record times
+    :param coeffs: ndarray of shape (n_records, n_coeffs), unrotated, padded beyond each record's order
+    :param hmb_lats: Heppner-Maynard boundary latitude of each record
+    :param orders: fit order of each record
+    :param n_vectors: number of vectors in each record
+    :param spacing: spacing of the coarse search grid in degrees
+    :param refine: refine each extremum on a local stencil
+    :param iterations: number of refinement steps
+    :return: dict of columns named as SUMMARY_COLUMNS
+    """
+    n = len(times)
+    hmb_lats = np.asarray(hmb_lats, dtype=np.float64)
+    orders = np.asarray(orders)
+    coeffs = np.asarray(coeffs, dtype=np.float64)
+    ut = _ut_hours(times)
+    out = {name: np.zeros(n) for name in SUMMARY_COLUMNS[1:-2]}
+
+    # Records sharing a boundary latitude and order share a basis
+    groups = np.stack([hmb_lats, orders]).T
+    for hmb_lat, order in np.unique(groups, axis=0):
+        order = int(order)
+        n_r, n_lt = _grid_shape(hmb_lat, spacing)
+        basis = grid_basis('polar_grid', hmb_lat, order, n_r, n_lt)
+        colat_step = (90. - hmb_lat) / (n_r - 1)
+        lt_step = 24. / n_lt
+        group_rows = np.nonzero((hmb_lats == hmb_lat) & (orders == order))[0]
+        block = max(1, GRID_BYTES // (8 * n_r * n_lt))
+        for start in range(0, len(group_rows), block):
+            rows = group_rows[start:start + block]
+            group = sdarn_rotate_coeffs(coeffs[rows, :(order + 1) ** 2], ut[rows], order)
+            pot = group @ basis.T
+            for name, sign in (('pot_max', 1), ('pot_min', -1)):
+                best = np.argmax(sign * pot, axis=1)
+                value = pot[np.arange(len(rows)), best]
+                mlat = 90. - (best // n_lt) * colat_step
+                mlt = (best % n_lt) * lt_step
+                if refine:
+                    value, mlat, mlt = _refine(group, hmb_lat, order, mlat, mlt, colat_step, lt_step, sign,
+                                               iterations)
+                out[name][rows] = value
+                out[name + '_mlat'][rows] = mlat
+                out[name + '_mlt'][rows] = mlt
+
+    summary = {'time': np.asarray(times, dtype='datetime64[ms]')}
+    summary.update({name: values.astype(np.float32) for name, values in out.items()})
+    summary['cpcp'] = (out['pot_max'] - out['pot_min']).astype(np.float32)
+    summary['hmb_lat'] = hmb_lats.astype(np.float32)
+    summary['n_vectors'] = np.asarray(n_vectors, dtype=np.int32)
+    return summary
+
+
+def _concatenate(chunks):
+    if not chunks:
+        return {name: np.array([]) for name in SUMMARY_COLUMNS}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in SUMMARY_COLUMNS}
+
+
+def records_timeseries(records, chunk_size=512, **kwargs):
+    """
+    Summary time series of an iterable of map records, consumed chunk_size records at a time. Besides the records of
+    a chunk, the peak memory is that given in the module documentation.
+    :param records: iterable of record dictionaries, e.g. a generator over many files
+    :param kwargs: passed on to summarise
+    :return: dict of columns named as SUMMARY_COLUMNS
+    """
+    chunks = []
+    block = []
+
+    def flush():
+        width = max(len(r['N+2']) for r in block)
+        coeffs = np.zeros((len(block), width))
+        for i, r in enumerate(block):
+            coeffs[i, :len(r['N+2'])] = r['N+2']
+        chunks.append(summarise([np.datetime64(record_time(r), 'ms') for r in block], coeffs,
+                                [r['latmin'] for r in block],
+                                [coeff_order(r['N+2'], fit_order(r)) for r in block],
+                                [len(r['vector.mlat']) for r in block], **kwargs))
+        del block[:]
+
+    for record in records:
+        block.append(record)
+        if len(block) == chunk_size:
+            flush()
+    if block:
+        flush()
+    return _concatenate(chunks)
+
+
+def store_timeseries(store, start=None, end=None, chunk_size=4096, **kwargs):
+    """
+    Summary time series of the records of a store.MapStore, read straight from its memory-mapped columns a chunk at
+    a time, see the module documentation for the peak memory
+    :param store: store.MapStore
+    :param start: datetime
+    :param end: datetime
+    :param kwargs: passed on to summarise
+    :return: dict of columns named as SUMMARY_COLUMNS
+    """
+    records = store.time_slice(start, end)
+    n_vectors = np.diff(store.offsets['vector'])
+    chunks = []
+    for i0 in range(records.start, records.stop, chunk_size):
+        i1 = min(i0 + chunk_size, records.stop)
+        coeffs = np.nan_to_num(store.columns['N+2'][i0:i1])
+        chunks.append(summarise(store.times[i0:i1], coeffs, store.columns['latmin'][i0:i1],
+                                store.columns['fit.order'][i0:i1], n_vectors[i0:i1], **kwargs))
+    return _concatenate(chunks)
+
+
+def write_timeseries(summary, filename):
+    """
+    Write a summary time series as a compressed .npz of its columns
+    """
+    np.savez_compressed(filename, **summary)
+
+
+def read_timeseries(filename):
+    """
+    Read a summary time series written by write_timeseries
+    :return: dict of columns
+    """
+    with np.load(filename) as data:
+        return {name: data[name] for name in SUMMARY_COLUMNS}
@@ -1,5 +1,65 @@
+import datetime as dt
+import threading
+import contextlib
 import numpy as np
-import matplotlib.path as mpltPath
+
+PRECISIONS = ['float64', 'float32']
+
+# Process-wide floating point type of basis matrices, potential grids, projected coordinates and plot columns
+_precision = [np.dtype(np.float64)]
+# Per-thread overrides set by the precision context manager
+_local = threading.local()
+
+
+def get_precision(dtype=None):
+    """
+    Return the floating point type to compute with: ``dtype`` if given, otherwise the setting of the precision
+    context manager in this thread, otherwise the process-wide setting
+    :param dtype: None, 'float64' or 'float32'
+    :return: numpy dtype
+    """
+    if dtype is None:
+        local = getattr(_local, 'dtype', None)
+        return _precision[0] if local is None else local
+    dtype = np.dtype(dtype)
+    if dtype.name not in PRECISIONS:
+        raise ValueError("Unsupported precision {}, expected one of {}".format(dtype, PRECISIONS))
+    return dtype
+
+
+def set_precision(dtype):
+    """
+    Set the process-wide floating point type, float64 by default. float32 halves the memory of display products and
+    the data sent to the browser. Set it before starting threads that render, or use the precision context manager
+    to change the type of one thread only.
+    :param dtype: 'float64' or 'float32'
+    """
+    _precision[0] = get_precision(dtype)
+
+
+@contextlib.contextmanager
+def precision(dtype):
+    """
+    Context manager setting the floating point type of the current thread for the duration of a block. Other
+    threads, including those started inside the block, keep their own setting.
+    """
+    dtype = get_precision(dtype)
+    previous = getattr(_local, 'dtype', None)
+    _local.dtype = dtype
+    try:
+        yield
+    finally:
+        _local.dtype = previous
+
+
+def as_precision(array, dtype=None):
+    """
+    Cast a floating point array to the precision, leaving other arrays alone
+    """
+    array = np.asarray(array)
+    if array.dtype.kind != 'f':
+        return array
+    return array.astype(get_precision(dtype), copy=False)
 
 
 def scale_velocity(vel, length=5):
@@ -24,8 +84,20 @@ def points_inside_boundary(points_x, points_y, boundary_x, boundary_y, radius=0.
     :param radius: optional: make the boundary larger or smaller
     :return:
     """
+    import matplotlib.path as mpltPath
     poly = np.array([boundary_x, boundary_y]).T
     points = np.array([points_x, points_y]).T
     path = mpltPath.Path(poly)
     inside = path.contains_points(points, radius=radius)
     return inside
+
+
+def record_time(record):
+    """
+    Return the start time of a map record
+    :param record: dictionary as read by pydarn
+    :return: datetime
+    """
+    second = float(record['start.second'])
+    return dt.datetime(int(record['start.year']), int(record['start.month']), int(record['start.day']),
+                       int(record['start.hour']), int(record['start.minute'])) + dt.timedelta(seconds=second)
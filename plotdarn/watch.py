@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+"""Incremental rendering of map files as they arrive
+
+A Watcher polls a directory for map files that are new or have grown since the last cycle. For every file it keeps
+a watermark in a small JSON state file: the byte offset of the end of the last complete record it has decoded, the
+number of records and the time of the last one. Only the bytes past the watermark are read, and only complete
+records are decoded. A DMAP record starts with its code and its total size as two 32-bit integers, so a record that
+is still being written is left for the next cycle. Every rendered frame and the state file are written to a
+temporary file and renamed into place, so readers never see a partial output.
+
+The watermark also holds the file's inode and a digest of the bytes just before its offset. A file that shrank, has
+a new inode or other bytes before the offset was replaced, and is read again from the start. Records that fail to
+decode or render are skipped and counted as errors, so one bad record does not stop the watcher.
+"""
+import os
+import time
+import json
+import glob
+import struct
+import hashlib
+import tempfile
+import datetime as dt
+from collections import deque
+from .utils import record_time
+
+_HEADER = struct.Struct('<ii')
+# Bytes before the watermark offset that identify a file
+IDENTITY_BYTES = 4096
+
+
+def complete_length(raw, max_records=None):
+    """
+    Length of the complete DMAP records at the start of raw bytes
+    :param raw: bytes
+    :param max_records: optional number of records to stop after
+    :return: number of bytes and number of records
+    """
+    offset = 0
+    count = 0
+    while offset + _HEADER.size <= len(raw) and (max_records is None or count < max_records):
+        _, size = _HEADER.unpack_from(raw, offset)
+        if size < _HEADER.size or offset + size > len(raw):
+            break
+        offset += size
+        count += 1
+    return offset, count
+
+
+def _records(raw, length):
+    """
+    Split the first length bytes of complete records into the bytes of each record
+    """
+    offset = 0
+    while offset < length:
+        size = _HEADER.unpack_from(raw, offset)[1]
+        yield raw[offset:offset + size]
+        offset += size
+
+
+def _digest(raw):
+    return hashlib.sha1(raw).hexdigest()
+
+
+def publish(filename, content):
+    """
+    Atomically replace filename with content, creating its directory if needed
+    :param filename: str
+    :param content: str or bytes
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filename), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(content, bytes) else 'w') as fh:
+            fh.write(content)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _read_tail(filename, offset, size):
+    with open(filename, 'rb') as fh:
+        fh.seek(offset)
+        return fh.read(size - offset)
+
+
+def _decode(raw):
+    import pydarn
+    return pydarn.SDarnRead(raw, True).read_map()
+
+
+def render_html(record, coastline_geoms=(), cache=None):
+    """
+    Render a record to standalone HTML, the Watcher's default renderer
+    :param record: record dictionary
+    :param coastline_geoms: coastline geometries
+    :param cache: optional cache.FrameCache
+    :return: str
+    """
+    from bokeh.embed import file_html
+    from bokeh.resources import CDN
+    from .plotdarn import frame_layers, render_layers
+    from .frame import FrameContext
+    frame = FrameContext.from_record(record, cache=cache)
+    layers = frame_layers(record, coastline_geoms, frame, cache=cache)
+    return file_html(render_layers(layers, title='SuperDarn {:%Y-%m-%d %H:%M}'.format(frame.dtime)), CDN)
+
+
+class WatchState(object):
+    """
+    Per-file record watermarks, persisted as JSON
+    :param path: state file, read if it exists
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as fh:
+                self.files = json.load(fh)['files']
+
+    def watermark(self, name):
+        """
+        Return the watermark of a file: offset and size in bytes, mtime, records, last_time (ISO format or None),
+        and the inode and digest identifying the file (None if not known yet)
+        """
+        watermark = {'offset': 0, 'size': 0, 'mtime': 0.0, 'records': 0, 'last_time': None, 'inode': None,
+                     'digest': None}
+        watermark.update(self.files.get(name, {}))
+        return watermark
+
+    def update(self, name, **values):
+        watermark = dict(self.watermark(name))
+        watermark.update(values)
+        self.files[name] = watermark
+
+    def save(self):
+        publish(self.path, json.dumps({'files': self.files}, indent=1, sort_keys=True))
+
+
+class Watcher(object):
+    """
+    Renders the new records of the map files in a directory, one polling cycle at a time
+    :param directory: directory the map files arrive in
+    :param output: strftime pattern of the frame file written for each record, e.g. 'frames/%Y%m%d-%H%M.html'
+    :param coastline_geoms: coastline geometries for the default renderer
+    :param render: callable turning a record into the str or bytes to publish, render_html by default
+    :param pattern: glob pattern of the map files in directory
+    :param state_file: path of the state file, '.plotdarn-watch.json' in directory by default
+    :param interval: seconds between the starts of polling cycles
+    :param max_records: most records rendered per cycle, the rest are left as backlog for the next cycles
+    :param read_bytes: callable(filename, offset, size) returning the bytes of a file from offset to size
+    :param decode: callable turning the bytes of complete records into a list of record dictionaries
+    """
+
+    def __init__(self, directory, output, coastline_geoms=(), render=None, pattern='*.map', state_file=None,
+                 interval=30.0, max_records=None, read_bytes=_read_tail, decode=_decode):
+        self.directory = directory
+        self.output = output
+        self.coastline_geoms = list(coastline_geoms)
+        self.render = render or (lambda record: render_html(record, self.coastline_geoms))
+        self.pattern = pattern
+        self.state = WatchState(state_file or os.path.join(directory, '.plotdarn-watch.json'))
+        self.interval = interval
+        self.max_records = max_records
+        self.read_bytes = read_bytes
+        self.decode = decode
+        self.metrics = {}
+        self.history = deque(maxlen=100)
+        # The most recent errors, as (file name, message)
+        self.errors = deque(maxlen=100)
+        self._cycle_errors = 0
+
+    def pending(self):
+        """
+        Return the files that changed since their watermark, in name order
+        :return: list of (path, name, size, mtime, inode)
+        """
+        changed = []
+        for path in sorted(glob.glob(os.path.join(self.directory, self.pattern))):
+            name = os.path.basename(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Removed since the glob
+                continue
+            watermark = self.state.watermark(name)
+            if stat.st_size != watermark['size'] or stat.st_mtime != watermark['mtime'] or \
+                    stat.st_ino != watermark['inode']:
+                changed.append((path, name, stat.st_size, stat.st_mtime, stat.st_ino))
+        return changed
+
+    def _read_new(self, path, watermark, size, inode):
+        """
+        Read the bytes of a file past its watermark, or all of it if it was replaced
+        :return: offset read from, bytes before it up to IDENTITY_BYTES, and the new bytes
+        """
+        offset = watermark['offset']
+        if size < offset or (watermark['inode'] is not None and inode != watermark['inode']):
+            offset = 0
+        start = offset - min(offset, IDENTITY_BYTES)
+        raw = self.read_bytes(path, start, size)
+        head = raw[:offset - start]
+        if offset and watermark['digest'] is not None and _digest(head) != watermark['digest']:
+            # Replaced by a file at least as large
+            offset = 0
+            head, raw = b'', self.read_bytes(path, 0, size)
+        return offset, head, raw[len(head):]
+
+    def _decode(self, name, raw, length):
+        """
+        Decode complete records, one at a time if the batch fails so that only bad records are lost
+        """
+        try:
+            return self.decode(raw[:length])
+        except Exception:
+            pass
+        records = []
+        for chunk in _records(raw, length):
+            try:
+                records.extend(self.decode(chunk))
+            except Exception as exc:
+                self.errors.append((name, 'decode: {!r}'.format(exc)))
+                self._cycle_errors += 1
+        return records
+
+    def _process(self, path, name, size, mtime, inode, limit):
+        """
+        Decode and render the new complete records of a file, at most limit of them. A replaced file is read again,
+        but the records up to the last one rendered are skipped.
+        :return: number of records rendered, number of records left for later
+        """
+        watermark = self.state.watermark(name)
+        offset, head, raw = self._read_new(path, watermark, size, inode)
+        length, count = complete_length(raw)
+        left = 0
+        size_seen, mtime_seen = size, mtime
+        if limit is not None and count > limit:
+            # Stop at a record boundary and stay marked as changed, so the rest is read next cycle
+            length, _ = complete_length(raw, limit)
+            left = count - limit
+            size_seen, mtime_seen = 0, 0.0
+        records = self._decode(name, raw, length) if length else []
+        last_time = watermark['last_time']
+
+        rendered = 0
+        for record in records:
+            try:
+                dtime = record_time(record)
+                if last_time is not None and dtime.isoformat() <= last_time:
+                    continue
+                content = self.render(record)
+            except Exception as exc:
+                self.errors.append((name, 'render: {!r}'.format(exc)))
+                self._cycle_errors += 1
+                continue
+            publish(dtime.strftime(self.output), content)
+            last_time = dtime.isoformat()
+            rendered += 1
+        digest = _digest((head + raw[:length])[-IDENTITY_BYTES:])
+        self.state.update(name, offset=offset + length, size=size_seen, mtime=mtime_seen, inode=inode, digest=digest,
+                          records=(watermark['records'] if offset else 0) + len(records), last_time=last_time)
+        self.state.save()
+        return rendered, left
+
+    def cycle(self):
+        """
+        Run one polling cycle
+        :return: dict of metrics: start (epoch seconds), latency (seconds the cycle took), files (changed files
+            seen), rendered (records rendered), backlog (records and files left for later cycles), errors (records
+            skipped because they failed to decode or render, and files that failed to be read or published, which
+            are retried next cycle) and lag (seconds from the newest rendered record to the end of the cycle)
+        """
+        start = time.time()
+        started = time.perf_counter()
+        self._cycle_errors = 0
+        changed = self.pending()
+        rendered = 0
+        backlog = 0
+        backlog_files = 0
+        for path, name, size, mtime, inode in changed:
+            limit = None if self.max_records is None else self.max_records - rendered
+            if limit is not None and limit <= 0:
+                backlog_files += 1
+                continue
+            try:
+                done, left = self._process(path, name, size, mtime, inode, limit)
+            except Exception as exc:
+                self.errors.append((name, repr(exc)))
+                self._cycle_errors += 1
+                continue
+            rendered += done
+            backlog += left
+            backlog_files += 1 if left else 0
+        newest = [w['last_time'] for w in self.state.files.values() if w['last_time']]
+        end = time.time()
+        lag = None
+        if newest:
+            lag = end - dt.datetime.fromisoformat(max(newest)).replace(tzinfo=dt.timezone.utc).timestamp()
+        self.metrics = {'start': start, 'latency': time.perf_counter() - started, 'files': len(changed),
+                        'rendered': rendered, 'backlog': backlog, 'backlog_files': backlog_files,
+                        'errors': self._cycle_errors, 'lag': lag}
+        self.history.append(self.metrics)
+        return self.metrics
+
+    def run(self, cycles=None, stop=None):
+        """
+        Poll until stopped, starting a cycle every interval seconds, or at once while there is a backlog
+        :param cycles: optional number of cycles to run
+        :param stop: optional threading.Event ending the loop
+        """
+        done = 0
+        while cycles is None or done < cycles:
+            metrics = self.cycle()
+            done += 1
+            if (stop is not None and stop.is_set()) or (cycles is not None and done >= cycles):
+                break
+            if metrics['backlog_files']:
+                continue
+            wait = max(0., self.interval - metrics['latency'])
+            if stop is not None:
+                if stop.wait(wait):
+                    break
+            else:
+                time.sleep(wait)
+
+    def stats(self):
+        """
+        Summarise the recent cycles
+        :return: dict with the number of cycles, records rendered, errors, mean and max latency, and the last backlog
+            and lag
+        """
+        if not self.history:
+            return {'cycles': 0, 'rendered': 0, 'errors': 0, 'mean_latency': None, 'max_latency': None, 'backlog': 0,
+                    'lag': None}
+        latencies = [m['latency'] for m in self.history]
+        return {'cycles': len(self.history), 'rendered': sum(m['rendered'] for m in self.history),
+                'errors': sum(m['errors'] for m in self.history),
+                'mean_latency': sum(latencies) / len(latencies), 'max_latency': max(latencies),
+                'backlog': self.history[-1]['backlog'], 'lag': self.history[-1]['lag']}
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+
+def make_record(seed=0, hour=22, minute=2, order=6, n_vectors=50, latmin=60.0):
+    """
+    Build a synthetic map record with the same keys pydarn returns
+    """
+    rng = np.random.RandomState(seed)
+    n_coeffs = (order + 1) ** 2
+    boundary_mlon = np.arange(0, 360, 10.0)
+    return {
+        'start.year': 2012, 'start.month': 6, 'start.day': 15, 'start.hour': hour, 'start.minute': minute,
+        'start.second': 0.0,
+        'fit.order': order,
+        'latmin': latmin,
+        'N+2': rng.normal(0, 5, n_coeffs),
+        'boundary.mlat': latmin + 2 * np.cos(np.radians(boundary_mlon)),
+        'boundary.mlon': boundary_mlon,
+        'vector.mlat': rng.uniform(latmin - 5, 85, n_vectors),
+        'vector.mlon': rng.uniform(-180, 180, n_vectors),
+        'vector.kvect': rng.uniform(-180, 180, n_vectors),
+        'vector.vel.median': rng.uniform(0, 1000, n_vectors),
+    }
+
+
+@pytest.fixture
+def record():
+    return make_record()
+
+
+@pytest.fixture
+def records():
+    return [make_record(seed=i, hour=22 + (2 * i) // 60, minute=(2 * i) % 60, n_vectors=20 + i) for i in range(10)]
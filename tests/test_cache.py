@@ -0,0 +1,73 @@
+from datetime import datetime
+import numpy as np
+from plotdarn.cache import FrameCache, content_key
+from plotdarn import plotting
+
+TIME = datetime(year=2012, month=6, day=15, hour=22, minute=2)
+
+
+def test_key_depends_on_content():
+    a = np.arange(5.0)
+    assert content_key('grid', a, 50) == content_key('grid', a.copy(), 50)
+    assert content_key('grid', a, 50) != content_key('grid', a, 55)
+    assert content_key('grid', a, 50) != content_key('mask', a, 50)
+    assert content_key('grid', a) != content_key('grid', a.astype(np.float32))
+
+
+def test_cache_hit_and_miss():
+    cache = FrameCache()
+    calls = []
+    for _ in range(3):
+        res = cache.get_or_compute('product', (np.ones(3),), lambda: calls.append(1) or 42)
+    assert res == 42
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+    assert stats['products']['product']['hits'] == 2
+
+
+def test_cache_lru_eviction():
+    cache = FrameCache(maxsize=2)
+    for i in range(3):
+        cache.get_or_compute('product', (i,), lambda: i)
+    assert len(cache) == 2
+    cache.get_or_compute('product', (0,), lambda: -1)
+    assert cache.stats()['misses'] == 4
+
+
+def test_cache_on_disk(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    FrameCache(directory=directory).get_or_compute('product', (1,), lambda: np.arange(3))
+    cache = FrameCache(directory=directory)
+    res = cache.get_or_compute('product', (1,), lambda: None)
+    np.testing.assert_array_equal(res, np.arange(3))
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_vector_products_cached(record):
+    cache = FrameCache()
+    boundary = plotting.boundary(TIME, record['boundary.mlat'], record['boundary.mlon'])
+    first = plotting.vector(TIME, record['vector.mlat'], record['vector.mlon'], boundary, coeffs=record['N+2'],
+                            plottype='FIT', cache=cache)
+    second = plotting.vector(TIME, record['vector.mlat'], record['vector.mlon'], boundary, coeffs=record['N+2'],
+                             plottype='FIT', cache=cache)
+    assert cache.stats()['products']['fitted'] == {'hits': 1, 'disk_hits': 0, 'misses': 1}
+    assert cache.stats()['products']['inside'] == {'hits': 1, 'disk_hits': 0, 'misses': 1}
+    np.testing.assert_array_equal(first[0].data['m'], second[0].data['m'])
+
+
+def test_cache_shared_between_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    cache = FrameCache(maxsize=8)
+
+    def work(i):
+        return [cache.get_or_compute('product', (j % 16,), lambda: j % 16) for j in range(i, i + 500)]
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(work, range(8)))
+    for i, values in enumerate(results):
+        assert values == [j % 16 for j in range(i, i + 500)]
+    stats = cache.stats()
+    assert stats['hits'] + stats['misses'] == 8 * 500
+    assert len(cache) == 8
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from plotdarn.climatology import Climatology
+from plotdarn.frame import FrameContext
+
+
+def test_cell_index_matches_grid():
+    clim = Climatology(latmin=50, spacing=2.0)
+    np.testing.assert_array_equal(clim.cell_index(clim.mlat, clim.mlt), np.arange(len(clim)))
+    assert clim.cell_index(45.0, 12.0) == -1
+
+
+def test_statistics_match_direct_computation(records):
+    clim = Climatology(latmin=50, spacing=5.0)
+    clim.add_records(records, fitted=False)
+    mlat = np.concatenate([r['vector.mlat'] for r in records])
+    mlt = np.concatenate([FrameContext.from_record(r).mlt(r['vector.mlon']) for r in records])
+    speed = np.concatenate([r['vector.vel.median'] for r in records])
+    cell = clim.cell_index(mlat, mlt)
+    stats = clim.statistics('los')
+    busiest = np.argmax(stats['count'])
+    values = speed[cell == busiest]
+    assert stats['count'][busiest] == len(values)
+    np.testing.assert_allclose(stats['mean'][busiest], values.mean())
+    np.testing.assert_allclose(stats['std'][busiest], values.std(ddof=1))
+    assert stats['count'].sum() == np.count_nonzero(cell >= 0)
+
+
+def test_merge_equals_single_pass(records):
+    whole = Climatology(spacing=5.0)
+    whole.add_records(records)
+    parts = [Climatology(spacing=5.0), Climatology(spacing=5.0)]
+    parts[0].add_records(records[:4])
+    parts[1].add_records(records[4:])
+    parts[0] += parts[1]
+    assert parts[0].n_records == whole.n_records
+    for kind in ('los', 'fit'):
+        for name, values in whole.statistics(kind).items():
+            np.testing.assert_allclose(parts[0].statistics(kind)[name], values, equal_nan=True)
+
+
+def test_merge_different_grid():
+    with pytest.raises(ValueError):
+        Climatology(spacing=2.0).merge(Climatology(spacing=5.0))
+
+
+def test_save_load(records, tmp_path):
+    clim = Climatology(spacing=5.0)
+    clim.add_records(records)
+    clim.save(str(tmp_path / 'clim.npz'))
+    loaded = Climatology.load(str(tmp_path / 'clim.npz'))
+    np.testing.assert_array_equal(loaded.statistics('fit')['mean'], clim.statistics('fit')['mean'])
+
+
+def test_layers(records):
+    clim = Climatology(spacing=5.0)
+    clim.add_records(records)
+    inside, outside = clim.layers('fit', min_count=2)['vectors']
+    assert np.all(inside['count'] >= 2)
+    assert len(outside['x']) == 0
+    assert set(['x', 'y', 'le', 'an', 'm']) <= set(inside)
@@ -262,3 +262,51 @@ def test_convert_angle_array():
     angle = np.array([180, 180, 0])
     res = convert.xy_angle_to_origin(x, y, angle)
     np.testing.assert_array_almost_equal(res, np.array([45, 315, 225]))
+
+
+def test_project_vectors_matches_separate_steps():
+    from plotdarn.utils import scale_velocity
+    rng = np.random.RandomState(0)
+    mlat, mlt = rng.uniform(40, 90, 500), rng.uniform(0, 24, 500)
+    ang, mag = rng.uniform(-180, 180, 500), rng.uniform(0, 1000, 500)
+    workspace = convert.ProjectionWorkspace()
+    res = workspace.project(mlat, mlt, ang, mag)
+    x, y = convert.mlat_mlt_to_xy(mlat, mlt)
+    np.testing.assert_array_equal(res['x'], x)
+    np.testing.assert_array_equal(res['y'], y)
+    np.testing.assert_array_equal(res['an'], convert.xy_angle_to_origin(x, y, ang))
+    np.testing.assert_array_equal(res['le'], scale_velocity(mag))
+
+
+def test_workspace_reuses_buffers():
+    workspace = convert.ProjectionWorkspace(10)
+    first = workspace.project(np.full(8, 70.), np.zeros(8), np.zeros(8), np.zeros(8))
+    second = workspace.project(np.full(4, 60.), np.zeros(4), np.zeros(4), np.zeros(4))
+    assert np.shares_memory(first['x'], second['x'])
+    assert len(second['x']) == 4 and workspace.size == 10
+    workspace.project(np.full(20, 60.), np.zeros(20), np.zeros(20), np.zeros(20))
+    assert workspace.size == 20
+
+
+def test_out_buffers():
+    x, y = np.empty(3), np.empty(3)
+    res = convert.mlat_mlt_to_xy(np.array([70., 80, 60]), np.array([0., 6, 18]), out=(x, y))
+    assert res[0] is x
+    np.testing.assert_allclose(x, [0, 10, -30], atol=1e-12)
+    mlat, mlt = convert.xy_to_mlat_mlt(x, y, out=(np.empty(3), np.empty(3)))
+    np.testing.assert_allclose(mlat, [70, 80, 60])
+    np.testing.assert_allclose(mlt, [0, 6, 18], atol=1e-12)
+    out = np.empty(3)
+    assert convert.xy_angle_to_origin(x, y, np.array([180., 180, 0]), out=out) is out
+
+
+def test_out_buffers_use_workspace_scratch():
+    x, y = np.empty(3), np.empty(3)
+    work = convert.thread_workspace().views(3)['work']
+    convert.mlat_mlt_to_xy(np.array([70., 80, 60]), np.array([0., 6, 18]), out=(x, y))
+    # The scratch holds the last step, the colatitudes
+    np.testing.assert_allclose(work, [20, 10, 30])
+    own = np.empty(3)
+    out = convert.xy_angle_to_origin(x, y, np.array([180., 180, 0]), out=np.empty(3), work=own)
+    np.testing.assert_array_equal(out, convert.xy_angle_to_origin(x, y, np.array([180., 180, 0])))
+    np.testing.assert_array_equal(own, [180., 180., 0.])
@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+import scipy.special
+from plotdarn import convert, fitted_vectors as fv
+
+
+def _scalar_potential(coeffs, hmb_lat, mag_lat, mag_LT, order):
+    """
+    Reference expansion term by term with scipy, as the module did before the index tables
+    """
+    phi = 2 * np.pi * mag_LT / 24
+    theta = np.pi * (90 - mag_lat) / (90 - abs(hmb_lat))
+    if theta > np.pi:
+        return 0
+    pot = 0.0
+    for l in range(order + 1):
+        for m in range(l + 1):
+            k = 0 if l == 0 else (l * l if m == 0 else l * l + 2 * m - 1)
+            ylm = fv.sdarn_ylm(l, m, theta, phi)
+            pot = pot + coeffs[k] * ylm[0] + coeffs[k + 1] * ylm[1]
+    return pot
+
+
+@pytest.mark.parametrize('order', [1, 6, 12])
+def test_legendre_matches_scipy(order):
+    x = np.linspace(-1, 1, 51)
+    l, m, _ = fv.coeff_index(order)
+    expected = np.array([scipy.special.lpmv(mm, ll, x) for ll, mm in zip(l, m)])
+    np.testing.assert_allclose(fv.legendre(order, x), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_coeff_index_order_6():
+    l, m, k = fv.coeff_index(6)
+    assert len(l) == 28
+    assert k.max() + 2 == 49
+    assert (l[3], m[3], k[3]) == (2, 0, 4)
+    assert (l[4], m[4], k[4]) == (2, 1, 5)
+
+
+@pytest.mark.parametrize('order', [4, 6, 10])
+def test_potential_matches_scalar(order):
+    rng = np.random.RandomState(order)
+    coeffs = rng.normal(0, 5, (order + 1) ** 2 + 1)[:(order + 1) ** 2]
+    lat = rng.uniform(45, 89, 30)
+    lt = rng.uniform(0, 24, 30)
+    expected = [_scalar_potential(np.append(coeffs, 0), 55, a, b, order) for a, b in zip(lat, lt)]
+    np.testing.assert_allclose(fv.sdarn_get_potential(coeffs, 55, lat, lt), expected, atol=1e-9)
+
+
+def test_potential_scalar_input():
+    coeffs = np.arange(49.0)
+    assert isinstance(fv.sdarn_get_potential(coeffs, 55, 70, 3), float)
+    assert fv.sdarn_get_potential(coeffs, 55, 40, 3) == 0
+
+
+def test_low_order_uses_leading_terms():
+    coeffs = np.random.RandomState(0).normal(0, 5, 49)
+    np.testing.assert_allclose(fv.sdarn_get_potential(coeffs, 55, [70, 80], [3, 15], order=2),
+                               fv.sdarn_get_potential(coeffs[:9], 55, [70, 80], [3, 15]))
+
+
+def test_rotate_stacked():
+    rng = np.random.RandomState(1)
+    coeffs = rng.normal(0, 5, (3, 81))
+    ut = np.array([0.0, 3600.0, 79320.0])
+    res = fv.sdarn_rotate_coeffs(coeffs, ut)
+    for i in range(3):
+        np.testing.assert_allclose(res[i], fv.sdarn_rotate_coeffs(coeffs[i], ut[i]))
+    # Rotation only mixes the cosine and sine terms of the same degree and order
+    l, m, k = fv.coeff_index(8)
+    np.testing.assert_array_equal(res[:, k[m == 0]], coeffs[:, k[m == 0]])
+
+
+def test_fitted_matches_pointwise():
+    rng = np.random.RandomState(2)
+    coeffs = rng.normal(0, 5, 49)
+    lat = rng.uniform(60, 89, 20)
+    lt = rng.uniform(0, 24, 20)
+    azi, mag = fv.fitted_vecs_mlt(coeffs, lat, lt, 55)
+    for i in range(20):
+        a, b = fv.sdarn_get_fitted(coeffs, 55, lat[i], lt[i])
+        assert azi[i] == pytest.approx(a)
+        assert mag[i] == pytest.approx(b)
+
+
+def test_potential_grid_shape_and_order():
+    coeffs = np.random.RandomState(3).normal(0, 5, 121)
+    grid = fv.sdarn_get_potential_grid(coeffs, 55)
+    assert grid.shape == (80, 80)
+    assert grid[0, 0] == 0
+    np.testing.assert_allclose(fv.sdarn_get_potential_grid(coeffs, 55, order=2),
+                               fv.sdarn_get_potential_grid(coeffs[:9], 55))
+
+
+def test_grid_basis_cache_bounded():
+    coeffs = np.random.RandomState(3).normal(0, 5, 49)
+    fv._potential_grid_basis.cache_clear()
+    float32 = fv.sdarn_get_potential_grid(coeffs, 55, dtype=np.float32)
+    # The float64 basis a float32 one is rounded from is not cached
+    assert fv._potential_grid_basis.cache_info().currsize == 1
+    np.testing.assert_allclose(float32, fv.sdarn_get_potential_grid(coeffs, 55), rtol=1e-5, atol=1e-3)
+    for hmb_lat in np.linspace(55, 65, 2 * fv.GRID_BASIS_CACHE):
+        fv.sdarn_get_potential_grid(coeffs, hmb_lat)
+    assert fv._potential_grid_basis.cache_info().currsize == fv.GRID_BASIS_CACHE
+
+
+def test_equal_area_grid():
+    mlat, mlt = fv.equal_area_grid(60, 2.0)
+    assert mlat.min() == 61 and mlat.max() == 89
+    assert np.all((mlt >= 0) & (mlt < 24))
+    # Cells keep roughly the same width along each band
+    bands, counts = np.unique(mlat, return_counts=True)
+    np.testing.assert_allclose(counts, 180 * np.cos(np.deg2rad(bands)), atol=0.5)
+
+
+def test_grid_fitted_matches_pointwise():
+    coeffs = np.random.RandomState(4).normal(0, 5, 49)
+    mlat, mlt, azi, mag = fv.grid_fitted_vecs(coeffs, 60, spacing=5.0)
+    expected_azi, expected_mag = fv.fitted_vecs_mlt(coeffs, mlat, mlt, 60)
+    np.testing.assert_allclose(azi, expected_azi)
+    np.testing.assert_allclose(mag, expected_mag)
+
+
+def test_adaptive_potential_grid():
+    coeffs = np.random.RandomState(3).normal(0, 5, 49) * 1e-3
+    levels = [-9., -3., 3., 9.]
+    grid, stats = fv.adaptive_potential_grid(coeffs, 60, levels=levels, spacing=0.5, coarse=4.0)
+    assert grid.shape == (161, 161)
+    assert 0 < stats['evaluations'] < stats['uniform_inside'] < stats['uniform']
+    assert stats['saved'] == stats['uniform'] - stats['evaluations']
+    x = np.arange(161) * 0.5 - 40
+    # Rows increase in y and columns in x of the plot plane
+    gx, gy = np.meshgrid(x, x)
+    r = np.sqrt(gx ** 2 + gy ** 2)
+    mlat, mlt = convert.xy_to_mlat_mlt(gx.ravel(), gy.ravel())
+    exact = (fv.potential_basis(60, mlat, mlt, 6) @ coeffs).reshape(grid.shape)
+    # Cells a level crosses are refined down to evaluated nodes, and nothing beyond the boundary is evaluated
+    near = np.abs(exact - 3) < 0.01
+    assert near.any()
+    np.testing.assert_allclose(grid[near], exact[near])
+    assert np.all(grid[r > 30] == 0)
+
+
+def test_adaptive_potential_grid_spacing():
+    with pytest.raises(ValueError):
+        fv.adaptive_potential_grid(np.zeros(9), 60, spacing=0.3, coarse=4.0)
@@ -0,0 +1,81 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from plotdarn import convert, plotting
+from plotdarn.cache import FrameCache
+from plotdarn.fitted_vectors import sdarn_get_potential, sdarn_maglon2MLT
+from plotdarn.frame import FrameContext
+from plotdarn.utils import points_inside_boundary, record_time
+
+TIME = datetime(year=2012, month=6, day=15, hour=22, minute=2)
+
+
+def test_frame_mlt_matches_aacgm():
+    frame = FrameContext(TIME)
+    mlon = np.linspace(-180, 180, 50)
+    np.testing.assert_array_almost_equal(frame.mlt(mlon), convert.mlon_to_mlt(mlon, TIME))
+
+
+def test_frame_mlon_round_trip():
+    frame = FrameContext(TIME)
+    mlon = np.linspace(-179, 179, 50)
+    np.testing.assert_array_almost_equal(frame.mlon(frame.mlt(mlon)), mlon)
+
+
+def test_frame_from_record(record):
+    frame = FrameContext.from_record(record)
+    assert frame.dtime == record_time(record)
+    assert frame.hmb_lat == record['latmin']
+    np.testing.assert_array_almost_equal(frame.boundary[0], plotting.boundary(
+        TIME, record['boundary.mlat'], record['boundary.mlon'])[0])
+
+
+def test_frame_inside_matches_boundary_test(record):
+    frame = FrameContext.from_record(record)
+    x, y = np.meshgrid(np.linspace(-40, 40, 20), np.linspace(-40, 40, 20))
+    expected = points_inside_boundary(x.ravel(), y.ravel(), frame.boundary[0], frame.boundary[1])
+    np.testing.assert_array_equal(frame.inside(x.ravel(), y.ravel()), expected)
+
+
+def test_frame_cached(record):
+    cache = FrameCache()
+    assert FrameContext.from_record(record, cache=cache) is FrameContext.from_record(record, cache=cache)
+
+
+def test_vector_columns_with_frame(record):
+    frame = FrameContext.from_record(record)
+    boundary = plotting.boundary(TIME, record['boundary.mlat'], record['boundary.mlon'])
+    expected = plotting.vector_columns(TIME, record['vector.mlat'], record['vector.mlon'], boundary,
+                                       latmin=record['latmin'], coeffs=record['N+2'], plottype='FIT')
+    res = plotting.vector_columns(frame, record['vector.mlat'], record['vector.mlon'], None, plottype='FIT')
+    for got, want in zip(res, expected):
+        for column in want:
+            np.testing.assert_array_almost_equal(got[column], want[column])
+
+
+def test_potential_grid_with_frame(record):
+    frame = FrameContext.from_record(record)
+    np.testing.assert_array_equal(plotting.potential_grid(frame),
+                                  plotting.potential_grid(frame.rotated_coeffs, frame.hmb_lat))
+
+
+def test_rotated_coeffs_match_unrotated(record):
+    frame = FrameContext.from_record(record)
+    assert frame.ut == pytest.approx(22 + 2 / 60.)
+    mlat = np.linspace(62, 85, 20)
+    mlon = np.linspace(-180, 170, 20)
+    # Unrotated coefficients are a function of magnetic longitude
+    unrotated = sdarn_get_potential(frame.coeffs, frame.hmb_lat, mlat, mlon / 15., frame.order)
+    rotated = sdarn_get_potential(frame.rotated_coeffs, frame.hmb_lat, mlat, sdarn_maglon2MLT(mlon, frame.ut),
+                                  frame.order)
+    np.testing.assert_allclose(rotated, unrotated, atol=1e-9)
+
+
+def test_vector_columns_use_frame_boundary_latitude(record):
+    frame = FrameContext.from_record(record)
+    args = (frame, record['vector.mlat'], record['vector.mlon'], None)
+    res = plotting.vector_columns(*args, plottype='FIT')
+    expected = plotting.vector_columns(*args, latmin=record['latmin'], plottype='FIT')
+    other = plotting.vector_columns(*args, latmin=50, plottype='FIT')
+    np.testing.assert_array_equal(res[0]['m'], expected[0]['m'])
+    assert not np.allclose(res[0]['m'], other[0]['m'])
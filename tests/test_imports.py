@@ -0,0 +1,34 @@
+"""Import-time budget tests, run in a fresh interpreter so already imported modules don't hide the cost."""
+import subprocess
+import sys
+import pytest
+
+# Measured at ~0.06s for both on a laptop (numpy dominates), budget leaves headroom for slow CI machines
+IMPORT_BUDGET = 0.5
+HEAVY_MODULES = ['pydarn', 'geopandas', 'bokeh', 'shapely', 'skimage', 'scipy', 'aacgmv2', 'matplotlib']
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(','.join(sorted(sys.modules)))
+"""
+
+
+def _import_in_subprocess(module):
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT.format(module=module)], universal_newlines=True)
+    elapsed, modules = out.strip().split('\n')
+    return float(elapsed), set(modules.split(','))
+
+
+@pytest.mark.parametrize('module', ['plotdarn', 'plotdarn.convert', 'plotdarn.plotdarn', 'plotdarn.cli'])
+def test_no_heavy_imports(module):
+    _, modules = _import_in_subprocess(module)
+    assert not modules.intersection(HEAVY_MODULES)
+
+
+@pytest.mark.parametrize('module', ['plotdarn', 'plotdarn.convert'])
+def test_import_time_budget(module):
+    elapsed, _ = _import_in_subprocess(module)
+    assert elapsed < IMPORT_BUDGET
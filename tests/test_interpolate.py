@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from plotdarn import plotting
+from plotdarn.frame import FrameContext
+from plotdarn.interpolate import CoefficientInterpolator
+
+
+@pytest.mark.parametrize('method', ['linear', 'spline'])
+def test_exact_at_records(records, method):
+    interp = CoefficientInterpolator(records, method=method)
+    values = interp(interp.times)
+    for i, record in enumerate(records):
+        frame = FrameContext.from_record(record)
+        np.testing.assert_allclose(values['rotated_coeffs'][i], frame.rotated_coeffs, atol=1e-9)
+        assert values['hmb_lat'][i] == pytest.approx(record['latmin'])
+
+
+def test_linear_midpoint(records):
+    interp = CoefficientInterpolator(records)
+    mid = interp.times[3] + (interp.times[4] - interp.times[3]) / 2
+    values = interp([mid])
+    np.testing.assert_allclose(values['rotated_coeffs'][0],
+                               (interp.rotated_coeffs[3] + interp.rotated_coeffs[4]) / 2)
+    np.testing.assert_allclose(values['boundary_mlat'][0],
+                               (interp.boundary_mlat[3] + interp.boundary_mlat[4]) / 2)
+
+
+def test_records_off_cadence(records):
+    # Records 2 min 1 s apart with the same pattern in magnetic longitude rotate only slightly in MLT between them
+    off = [records[0], dict(records[0], **{'start.minute': 2, 'start.second': 1.0})]
+    interp = CoefficientInterpolator(off)
+    mid = interp.times[0] + (interp.times[1] - interp.times[0]) / 2
+    expected = FrameContext(mid.astype('datetime64[us]').item(), coeffs=records[0]['N+2'], order=6)
+    np.testing.assert_allclose(interp([mid])['rotated_coeffs'][0], expected.rotated_coeffs, rtol=1e-3, atol=1e-3)
+
+
+def test_cadence_and_frames(records):
+    interp = CoefficientInterpolator(records, method='spline')
+    times = interp.cadence(30)
+    assert len(times) == 18 * 2 + 1
+    frames = interp.frames(times[:3])
+    assert frames[0].dtime == interp.times[0].astype('datetime64[us]').item()
+    grid = plotting.potential_grid(frames[1])
+    assert grid.shape == (80, 80)
+    assert len(frames[2].boundary[0]) == len(interp.boundary_mlt)
+
+
+def test_needs_two_records(records):
+    with pytest.raises(ValueError):
+        CoefficientInterpolator(records[:1])
+    with pytest.raises(ValueError):
+        CoefficientInterpolator(records, method='nearest')
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from plotdarn import convert, plotting
+from plotdarn.frame import FrameContext
+from plotdarn.merge import merge_los, merge_record
+
+
+def test_resolves_uniform_flow():
+    rng = np.random.RandomState(1)
+    n = 400
+    mlat = rng.uniform(65, 80, n)
+    mlt = rng.uniform(0, 24, n)
+    azimuth = rng.uniform(-180, 180, n)
+    north, east = 300., -200.
+    speed = north * np.cos(np.radians(azimuth)) + east * np.sin(np.radians(azimuth))
+    merged = merge_los(mlat, mlt, speed, azimuth, size=4.0)
+    assert len(merged['mag']) > 10
+    np.testing.assert_allclose(merged['mag'], np.hypot(north, east), rtol=1e-9)
+    np.testing.assert_allclose(merged['ang'], np.degrees(np.arctan2(east, north)), rtol=1e-9)
+    np.testing.assert_allclose(merged['residual'], 0, atol=1e-6)
+    assert merged['count'].sum() <= n
+
+
+def test_two_looks_in_one_cell():
+    merged = merge_los([71, 71.1], [12, 12], [100, 50], [0, 90], size=2.0)
+    assert merged['count'].tolist() == [2]
+    assert merged['mag'][0] == pytest.approx(np.hypot(100, 50))
+    x, y = convert.mlat_mlt_to_xy(np.array([71, 71.1]), np.array([12, 12]))
+    mx, my = convert.mlat_mlt_to_xy(merged['mlat'], merged['mlt'])
+    assert (mx[0], my[0]) == (pytest.approx(x.mean()), pytest.approx(y.mean()))
+
+
+def test_drops_unresolvable_cells():
+    # Parallel looks, a single vector and a cell with enough spread
+    merged = merge_los([71, 71.1, 60, 81, 81.1], [12, 12, 0, 6, 6], [100, -100, 10, 100, 20], [10, -170, 0, 0, 45],
+                       size=2.0, min_angle=20)
+    assert merged['count'].tolist() == [2]
+    assert merged['mlat'][0] == pytest.approx(81.05, abs=0.01)
+    assert len(merge_los([], [], [], [])['mag']) == 0
+
+
+def test_merge_plottype(record):
+    frame = FrameContext.from_record(record)
+    merged = merge_record(record, frame, size=4.0)
+    inside, outside = plotting.vector_columns(frame, record['vector.mlat'], record['vector.mlon'], None,
+                                              mag=record['vector.vel.median'], ang=record['vector.kvect'],
+                                              plottype='MERGE', grid_spacing=4.0)
+    assert len(inside['m']) + len(outside['m']) == len(merged['mag'])
+    assert set(inside) == set(plotting.vector_columns(frame, record['vector.mlat'], record['vector.mlon'], None,
+                                                      mag=record['vector.vel.median'],
+                                                      ang=record['vector.kvect'])[0])
+    np.testing.assert_allclose(np.sort(np.concatenate([inside['m'], outside['m']])), np.sort(merged['mag']))
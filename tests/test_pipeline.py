@@ -0,0 +1,137 @@
+import os
+import random
+import time
+import numpy as np
+import pytest
+from plotdarn.pipeline import Pipeline, Stage
+from plotdarn.shared import shared_memory
+
+
+def _jitter(x):
+    time.sleep(random.uniform(0, 0.005))
+    return x * 2
+
+
+def test_pipeline_keeps_order():
+    pipeline = Pipeline([Stage('double', _jitter, workers=4), Stage('add', lambda x: x + 1, workers=3)])
+    assert list(pipeline.run(range(50))) == [x * 2 + 1 for x in range(50)]
+
+
+def test_pipeline_expand():
+    pipeline = Pipeline([Stage('split', lambda x: [x] * x, workers=2, expand=True), Stage('same', lambda x: x)])
+    assert list(pipeline.run([1, 2, 3])) == [1, 2, 2, 3, 3, 3]
+
+
+def test_pipeline_processes():
+    pipeline = Pipeline([Stage('abs', abs, workers=2, processes=True)])
+    assert list(pipeline.run([-1, 2, -3])) == [1, 2, 3]
+
+
+def test_pipeline_error():
+    def fail(x):
+        if x == 3:
+            raise RuntimeError('bad record')
+        return x
+
+    res = []
+    with pytest.raises(RuntimeError):
+        for item in Pipeline([Stage('fail', fail, workers=2)]).run(range(10)):
+            res.append(item)
+    assert res == [0, 1, 2]
+
+
+def test_pipeline_backpressure():
+    fed = []
+
+    def source():
+        for i in range(100):
+            fed.append(i)
+            yield i
+
+    pipeline = Pipeline([Stage('slow', lambda x: time.sleep(0.01) or x)], maxsize=2)
+    results = pipeline.run(source())
+    next(results)
+    time.sleep(0.1)
+    # Bounded by the two queues, the reorder buffer and the items in flight
+    assert len(fed) < 20
+    results.close()
+
+
+def test_pipeline_stats():
+    pipeline = Pipeline([Stage('a', lambda x: x), Stage('b', lambda x: x)])
+    list(pipeline.run(range(20)))
+    stats = pipeline.stats()
+    assert [s['stage'] for s in stats] == ['a', 'b']
+    assert all(s['processed'] == 20 for s in stats)
+    assert all(s['throughput'] > 0 for s in stats)
+    assert all(s['queue_depth'] == 0 for s in stats)
+
+
+@pytest.mark.parametrize('share_static', [False, pytest.param(True, marks=pytest.mark.skipif(
+    shared_memory is None, reason='Shared memory needs Python 3.8'))])
+def test_superdarn_pipeline(tmp_path, records, share_static):
+    from shapely.geometry import Polygon
+    from plotdarn.pipeline import superdarn_pipeline
+    from plotdarn.store import StoreWriter
+    with StoreWriter(str(tmp_path / 'store')) as writer:
+        writer.add_records(records[:2])
+    geoms = [Polygon([(-60, 60), (-45, 61), (-30, 62), (-20, 75)])]
+    output = str(tmp_path / '%H%M.html')
+    pipeline = superdarn_pipeline(geoms, output=output, readers=1, computers=1, share_static=share_static,
+                                  basis_records=records[:2])
+    res = list(pipeline.run([str(tmp_path / 'store')]))
+    assert [os.path.basename(f) for f in res] == ['2200.html', '2202.html']
+    for filename in res:
+        with open(filename) as fh:
+            assert 'SuperDarn 2012-06-15' in fh.read()
+    assert all(s['processed'] == (1 if s['stage'] == 'read' else 2) for s in pipeline.stats())
+
+
+def test_compute_stage_adaptive_contours(record):
+    from scipy.spatial import cKDTree
+    from plotdarn.pipeline import convert_stage, compute_stage
+    from plotdarn.plotting import CONTOUR_LEVELS
+    from plotdarn.fitted_vectors import sdarn_get_potential
+    from plotdarn.convert import xy_to_mlat_mlt
+    fixed = compute_stage(convert_stage(record, []))['layers']['contours']
+    frame = compute_stage(convert_stage(record, []), contour_spacing=0.5)
+    assert frame['contour_grid']['evaluations'] < frame['contour_grid']['uniform_inside']
+    adaptive = frame['layers']['contours']
+    # The record's potential is in volts, both grids must trace the same kV levels
+    fixed_points = np.column_stack([np.concatenate(fixed[0]), np.concatenate(fixed[1])])
+    adaptive_points = np.column_stack([np.concatenate(adaptive[0]), np.concatenate(adaptive[1])])
+    assert cKDTree(fixed_points).query(adaptive_points)[0].max() < 1.
+    assert cKDTree(adaptive_points).query(fixed_points)[0].max() < 1.
+    mlat, mlt = xy_to_mlat_mlt(adaptive_points[:, 0], adaptive_points[:, 1])
+    pot = sdarn_get_potential(frame['frame'].rotated_coeffs, frame['frame'].hmb_lat, mlat, mlt,
+                              frame['frame'].order) * 1e-3
+    assert np.abs(pot[:, np.newaxis] - np.array(CONTOUR_LEVELS)).min(axis=1).max() < 1.
+
+
+@pytest.mark.parametrize('contour_spacing', [None, 0.5])
+def test_compute_stage_contours_at_known_mlt(record, contour_spacing):
+    from plotdarn.pipeline import convert_stage, compute_stage
+    from plotdarn.plotting import CONTOUR_LEVELS
+    from plotdarn.fitted_vectors import sdarn_get_potential
+    from plotdarn.convert import xy_to_mlat_mlt
+    # A two cell pattern in magnetic longitude, +40 kV at 0 and -40 kV at 180 degrees at 75 degrees
+    coeffs = np.zeros(49)
+    coeffs[2] = 4e4 / sdarn_get_potential(np.eye(49)[2], record['latmin'], 75, 0)
+    record['N+2'] = coeffs
+    xs, ys = compute_stage(convert_stage(record, []), contour_spacing=contour_spacing)['layers']['contours']
+    mlat, mlt = xy_to_mlat_mlt(np.concatenate(xs), np.concatenate(ys))
+    # MLT = mlon / 15 + UT - 4.73 in hours
+    ut = 22 + 2 / 60.
+    pot = sdarn_get_potential(coeffs, record['latmin'], mlat, (mlt - ut + 4.73) % 24) * 1e-3
+    assert np.abs(pot[:, np.newaxis] - np.array(CONTOUR_LEVELS)).min(axis=1).max() < 1.5
+    # The innermost contours ring the cells
+    cells = {}
+    for x, y in zip(xs, ys):
+        size = np.ptp(x) + np.ptp(y)
+        cell_mlat, cell_mlt = xy_to_mlat_mlt(np.mean(x), np.mean(y))
+        key = 'dusk' if 12 < cell_mlt[0] < 24 else 'dawn'
+        if size < cells.get(key, (np.inf,))[0]:
+            cells[key] = (size, cell_mlat[0], cell_mlt[0])
+    assert cells['dusk'][2] == pytest.approx((ut - 4.73) % 24, abs=0.5)
+    assert cells['dawn'][2] == pytest.approx((12 + ut - 4.73) % 24, abs=0.5)
+    assert cells['dusk'][1] == pytest.approx(cells['dawn'][1], abs=1.)
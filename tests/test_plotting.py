@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+from plotdarn import plotting, convert
+from plotdarn.fitted_vectors import sdarn_get_potential, equal_area_grid
+from plotdarn.frame import FrameContext
+
+
+def _pixel_centres(resolution):
+    centres = (np.arange(resolution) + 0.5) * 80. / resolution - 40
+    x, y = np.meshgrid(centres, centres)
+    return convert.xy_to_mlat_mlt(x.ravel(), y.ravel())
+
+
+def test_upsample_constant():
+    image = plotting.upsample_polar(np.full((8, 32), 3.0), 64, 60)
+    mlat, _ = _pixel_centres(64)
+    inside = (mlat >= 60).reshape(64, 64)
+    np.testing.assert_allclose(image[inside], 3.0)
+    assert np.all(np.isnan(image[~inside]))
+
+
+def test_potential_image_matches_direct_evaluation():
+    coeffs = np.zeros(16)
+    coeffs[2] = 20.0
+    coeffs[5] = -10.0
+    res = plotting.potential_image(coeffs, 60, resolution=128)
+    image = res['image'][0]
+    assert image.dtype == np.float32
+    assert image.shape == (128, 128)
+    mlat, mlt = _pixel_centres(128)
+    direct = sdarn_get_potential(coeffs, 60, mlat, mlt).reshape(128, 128)
+    inside = np.isfinite(image)
+    assert np.abs(image[inside] - direct[inside]).max() < 0.02 * np.abs(direct).max()
+
+
+def test_image_resolution_budget():
+    assert plotting.image_resolution(0) == plotting.IMAGE_RESOLUTIONS[0]
+    assert plotting.image_resolution(1e-3) <= plotting.image_resolution(1.0)
+    assert plotting.image_resolution(1e6) == plotting.IMAGE_RESOLUTIONS[-1]
+    # Higher orders cost more per pixel
+    assert plotting.image_resolution(0.05, order=12) <= plotting.image_resolution(0.05, order=2)
+    assert plotting.image_cost(256, 12) > plotting.image_cost(256, 2) > plotting.image_cost(128, 2)
+    budget = plotting.image_cost(256)
+    assert plotting.image_resolution(budget) == 256
+    assert plotting.image_resolution(budget * 0.99) == 128
+
+
+def test_image_resolution_leaves_caches():
+    from plotdarn import fitted_vectors
+    before = fitted_vectors._polar_grid_basis.cache_info(), plotting._image_weights.cache_info()
+    plotting.image_resolution(0.05, order=9)
+    assert (fitted_vectors._polar_grid_basis.cache_info(), plotting._image_weights.cache_info()) == before
+
+
+def test_vector_columns_grid(record):
+    frame = FrameContext.from_record(record)
+    inside, outside = plotting.vector_columns(frame, None, None, None, latmin=record['latmin'], plottype='GRID',
+                                              grid_spacing=4.0)
+    assert set(inside) == {'x', 'y', 'm', 'le', 'an', 'mlon', 'mlat', 'mlt', 'ang'}
+    np.testing.assert_allclose(frame.mlt(inside['mlon']), inside['mlt'])
+    assert len(inside['x']) + len(outside['x']) == len(equal_area_grid(record['latmin'], 4.0)[0])
+
+
+def test_vector_columns_decimated(record):
+    frame = FrameContext.from_record(record)
+    args = (frame, record['vector.mlat'], record['vector.mlon'], None)
+    kwargs = dict(mag=record['vector.vel.median'], ang=record['vector.kvect'])
+    full = plotting.vector_columns(*args, **kwargs)
+    thinned = plotting.vector_columns(*args, decimate=8.0, **kwargs)
+    for got, want in zip(thinned, full):
+        assert got['count'].sum() == len(want['x'])
+        assert len(got['x']) <= len(want['x'])
+        assert set(want) <= set(got)
+
+
+def test_float32_potential_error_bound(records):
+    for record in records:
+        frame = FrameContext.from_record(record)
+        pot64 = plotting.potential_grid(frame)
+        pot32 = plotting.potential_grid(frame, dtype='float32')
+        assert pot32.dtype == np.float32
+        # Contouring potentials are in kV, bound the error to 1 V
+        assert np.abs(pot32 - pot64).max() < 1e-3
+
+
+def test_float32_velocity_and_position_error_bound(records):
+    for record in records:
+        frame = FrameContext.from_record(record)
+        for plottype in ('FIT', 'GRID'):
+            cols64 = plotting.vector_columns(frame, record['vector.mlat'], record['vector.mlon'], None,
+                                             plottype=plottype)
+            cols32 = plotting.vector_columns(frame, record['vector.mlat'], record['vector.mlon'], None,
+                                             plottype=plottype, dtype='float32')
+            for want, got in zip(cols64, cols32):
+                assert len(got['x']) == len(want['x'])
+                assert all(values.dtype == np.float32 for values in got.values())
+                # m/s
+                assert np.abs(got['m'] - want['m']).max(initial=0) < 0.1
+                # degrees of colatitude in the plot plane
+                assert np.abs(got['x'] - want['x']).max(initial=0) < 1e-4
+                assert np.abs(got['y'] - want['y']).max(initial=0) < 1e-4
+
+
+def test_global_precision(record):
+    from plotdarn.utils import precision, get_precision
+    frame = FrameContext.from_record(record)
+    with precision('float32'):
+        assert plotting.potential_grid(frame).dtype == np.float32
+        assert convert.mlat_mlt_to_xy(np.array([70.]), np.array([3.]))[0].dtype == np.float32
+    assert get_precision() == np.float64
+    assert plotting.potential_grid(frame).dtype == np.float64
+
+
+def test_adaptive_contours(record):
+    frame = FrameContext.from_record(record)
+    grid, stats = plotting.adaptive_potential_grid(frame, spacing=0.5)
+    assert stats['evaluations'] < stats['uniform_inside']
+    xs, ys = plotting.contours(grid, spacing=0.5)
+    coarse_xs, _ = plotting.contours(plotting.potential_grid(frame))
+    assert len(xs) > 0
+    # Same lines on the same plot extent, traced with more points
+    assert sum(len(x) for x in xs) > sum(len(x) for x in coarse_xs)
+    assert max(np.abs(x).max() for x in xs) <= 40
+
+
+def test_contour_grids_in_kilovolts(record):
+    frame = FrameContext.from_record(record)
+    grid, _ = plotting.adaptive_potential_grid(frame, spacing=0.5)
+    n = grid.shape[0]
+    x = (np.arange(n) - (n - 1) / 2.) * 0.5
+    x, y = np.meshgrid(x, x)
+    mlat, mlt = [a.reshape(x.shape) for a in convert.xy_to_mlat_mlt(x.ravel(), y.ravel())]
+    inside = mlat >= frame.hmb_lat
+    exact = sdarn_get_potential(frame.rotated_coeffs, frame.hmb_lat, mlat[inside], mlt[inside], frame.order) * 1e-3
+    assert np.abs(exact).max() > max(plotting.CONTOUR_LEVELS)
+    assert np.abs(grid[inside] - exact).max() < 3
+    # Nodes only fall between other contour levels than the exact potential where a level grazes them
+    levels = np.array(plotting.CONTOUR_LEVELS)
+    moved = np.searchsorted(levels, grid[inside]) != np.searchsorted(levels, exact)
+    assert np.all(np.abs(exact[moved, np.newaxis] - levels).min(axis=1) < 0.5)
+    uniform = plotting.potential_grid(frame)
+    assert np.abs(uniform).max() == pytest.approx(np.abs(exact).max(), rel=0.1)
+
+
+def test_contour_grids_match_image():
+    from scipy.ndimage import map_coordinates
+    # A two cell pattern, about +30 kV at 0 MLT and -30 kV at 12 MLT at 75 degrees
+    coeffs = np.zeros(9)
+    coeffs[2] = 3e4 / sdarn_get_potential(np.eye(9)[2], 60, 75, 0, 2)
+    uniform = plotting.potential_grid(coeffs, 60)
+    adaptive, _ = plotting.adaptive_potential_grid(coeffs, 60, spacing=0.5)
+    image = plotting.potential_image(coeffs, 60, resolution=256)['image'][0]
+    for mlt in np.arange(0, 24, 3.):
+        direct = sdarn_get_potential(coeffs, 60, 75, mlt) * 1e-3
+        x, y = convert.mlat_mlt_to_xy(75., mlt)
+        # Rows increase in y and columns in x on all three grids
+        for grid, spacing in ((uniform, 1.0), (adaptive, 0.5), (image * 1e-3, 80. / 256)):
+            row, col = y / spacing + (grid.shape[0] - 1) / 2., x / spacing + (grid.shape[0] - 1) / 2.
+            value = map_coordinates(grid, [[row], [col]], order=1)[0]
+            assert value == pytest.approx(direct, abs=1.5)
+
+
+def test_coastlines_flat_chunks_and_drops_invalid(record):
+    from concurrent.futures import ThreadPoolExecutor
+    frame = FrameContext.from_record(record)
+    # The first line has vertices near the equator that AACGM cannot convert
+    glat = np.array([2., 5., 45., 60., 70., 55., 65., 75., 80.])
+    glon = np.array([0., 10., 20., 30., 40., 100., 110., 120., 130.])
+    offsets = np.array([0, 5, 9])
+    xs, ys = plotting.coastlines_flat(frame, glat, glon, offsets, chunk_size=4)
+    assert [len(x) for x in xs] == [3, 4]
+    mlat, mlon = convert.arr_geo_to_mag(glat[5:], glon[5:], frame.dtime)
+    x, y = convert.mlat_mlt_to_xy(mlat, frame.mlt(mlon))
+    np.testing.assert_array_equal(xs[1], x)
+    np.testing.assert_array_equal(ys[1], y)
+    with ThreadPoolExecutor(2) as executor:
+        pooled = plotting.coastlines_flat(frame, glat, glon, offsets, executor=executor, chunk_size=2)
+    for a, b in zip(pooled[0] + pooled[1], xs + ys):
+        np.testing.assert_array_equal(a, b)
+    assert plotting.coastlines_flat(frame, np.zeros(0), np.zeros(0), np.array([0])) == ([], [])
@@ -0,0 +1,70 @@
+import time
+import threading
+import pytest
+from plotdarn.prefetch import iter_records
+
+LATENCY = 0.05
+
+
+@pytest.fixture
+def filenames(tmpdir):
+    names = []
+    for i in range(8):
+        path = tmpdir.join('{:02d}.map'.format(i))
+        path.write('{0}a,{0}b'.format(i))
+        names.append(str(path))
+    return names
+
+
+class SlowStorage(object):
+    """
+    Local directory reads with injected latency that track how many reads are in flight
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, filename):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(LATENCY)
+        with open(filename, 'rb') as fh:
+            raw = fh.read()
+        with self.lock:
+            self.active -= 1
+        return raw
+
+
+def _decode(raw):
+    return raw.decode().split(',')
+
+
+def test_prefetch_in_order(filenames):
+    res = list(iter_records(filenames, read_bytes=SlowStorage(), decode=_decode))
+    assert res == ['{}{}'.format(i, c) for i in range(8) for c in 'ab']
+
+
+def test_prefetch_concurrent(filenames):
+    storage = SlowStorage()
+    start = time.perf_counter()
+    list(iter_records(filenames, concurrency=4, read_bytes=storage, decode=_decode))
+    assert time.perf_counter() - start < LATENCY * len(filenames) * 0.75
+    assert 1 < storage.max_active <= 4
+
+
+def test_prefetch_memory_budget(filenames):
+    storage = SlowStorage()
+    # Each file is 7 bytes, so only two fit in the budget at once
+    list(iter_records(filenames, concurrency=8, memory_budget=14, read_bytes=storage, decode=_decode))
+    assert storage.max_active <= 2
+
+
+def test_prefetch_missing_file(filenames):
+    res = []
+    with pytest.raises(OSError):
+        for record in iter_records(filenames[:2] + ['missing.map'], read_bytes=SlowStorage(), decode=_decode):
+            res.append(record)
+    assert res == ['0a', '0b', '1a', '1b']
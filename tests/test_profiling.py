@@ -0,0 +1,167 @@
+import threading
+import tracemalloc
+import numpy as np
+import pytest
+from shapely.geometry import Polygon
+from plotdarn import profiling
+from plotdarn.pipeline import Pipeline, Stage
+from plotdarn.plotdarn import frame_layers
+
+MIB = 2 ** 20
+
+
+def _allocate(n_mib):
+    data = np.ones(n_mib * MIB // 8)
+    return float(data.sum())
+
+
+def test_stage_peak_and_retained():
+    profiler = profiling.MemoryProfiler()
+    kept = []
+    with profiler.stage('outer'):
+        _allocate(8)
+        with profiler.stage('inner'):
+            kept.append(np.ones(2 * MIB // 8))
+    profiler.stop()
+    report = {record['stage']: record for record in profiler.report()}
+    assert report['outer']['peak'] >= 8 * MIB
+    assert 2 * MIB <= report['inner']['peak'] < 4 * MIB
+    assert report['inner']['retained'] >= 2 * MIB
+    assert 'outer' in profiler.format_report()
+
+
+def test_budget_fails_fast():
+    profiler = profiling.MemoryProfiler(budgets={'big': 4 * MIB})
+    with pytest.raises(profiling.MemoryBudgetExceeded):
+        with profiler.stage('big'):
+            _allocate(8)
+    profiler.stop()
+    assert profiler.report()[0]['exceeded'] == 1
+
+
+def test_check_fails_inside_stage():
+    profiler = profiling.MemoryProfiler(budgets={'outer': 4 * MIB})
+    steps = []
+    with pytest.raises(profiling.MemoryBudgetExceeded) as raised:
+        with profiler.stage('outer'):
+            with profiler.stage('inner'):
+                _allocate(8)
+                profiler.check()
+                steps.append('after')
+    profiler.stop()
+    assert steps == []
+    assert raised.value.stage == 'outer'
+    assert {record['stage']: record['exceeded'] for record in profiler.report()} == {'outer': 1, 'inner': 0}
+
+
+def test_check_without_raising():
+    profiler = profiling.MemoryProfiler(budgets={'big': 4 * MIB}, on_exceed='warn')
+    assert profiler.check() is None
+    with profiler.stage('big'):
+        assert profiler.check() is None
+        _allocate(8)
+        assert profiler.check() == 'big'
+    profiler.stop()
+
+
+def test_frame_layers_checks_budget_between_layers(record, monkeypatch):
+    import plotdarn.plotdarn as plotdarn_module
+    profiler = profiling.MemoryProfiler(budgets={'frame': 4 * MIB})
+
+    def vector_columns(*args, **kwargs):
+        _allocate(8)
+        return [], []
+
+    def potential_image(*args, **kwargs):
+        raise AssertionError('the potential image is computed after the budget was exceeded')
+
+    monkeypatch.setattr(plotdarn_module.plotting, 'vector_columns', vector_columns)
+    monkeypatch.setattr(plotdarn_module.plotting, 'potential_image', potential_image)
+    with pytest.raises(profiling.MemoryBudgetExceeded):
+        with profiler.stage('frame'):
+            frame_layers(record, [], profiler=profiler, show_potential=True)
+    profiler.stop()
+
+
+def _per_item(chunk):
+    # 256 KiB of scratch memory per item
+    scratch = np.ones((len(chunk), MIB // 32))
+    return [float(i) for i in chunk] if scratch.size else []
+
+
+def test_budget_switches_to_chunks():
+    profiler = profiling.MemoryProfiler(budgets={'items': 6 * MIB}, on_exceed='chunk')
+    items = list(range(64))
+    result = profiler.run('items', _per_item, items=items, chunk_size=32, combine=lambda parts: sum(parts, []))
+    profiler.stop()
+    assert result == [float(i) for i in items]
+    record = profiler.report()[0]
+    assert record['exceeded'] == 1
+    assert record['calls'] > 2
+    assert record['last_peak'] <= 6 * MIB
+
+
+def test_frame_layers_profiled(record):
+    geoms = [Polygon([(-60, 60), (-30, 62), (-20, 75), (-50, 80)]), Polygon([(10, 55), (30, 58), (25, 70)])]
+    profiler = profiling.MemoryProfiler()
+    layers = frame_layers(record, geoms, profiler=profiler)
+    profiler.stop()
+    assert len(layers['coastlines'][0]) == 2
+    assert set(r['stage'] for r in profiler.report()) == {'coastlines', 'vectors'}
+
+
+def test_pipeline_stats_include_memory():
+    profiler = profiling.MemoryProfiler()
+    pipeline = Pipeline([Stage('alloc', _allocate)], profiler=profiler)
+    assert list(pipeline.run([1, 2])) == [MIB // 8, MIB // 8 * 2]
+    profiler.stop()
+    assert pipeline.stats()[0]['peak'] >= 2 * MIB
+
+
+def test_stage_in_other_thread_refused():
+    profiler = profiling.MemoryProfiler()
+    inside = threading.Event()
+    leave = threading.Event()
+
+    def other():
+        with profiler.stage('other'):
+            inside.set()
+            leave.wait(10)
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    try:
+        assert inside.wait(10)
+        with pytest.raises(RuntimeError):
+            with profiler.stage('main'):
+                pass
+    finally:
+        leave.set()
+        thread.join()
+    with profiler.stage('main'):
+        pass
+    profiler.stop()
+
+
+def test_peak_without_reset_peak(monkeypatch):
+    # Python before 3.9
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    profiler = profiling.MemoryProfiler()
+    with profiler.stage('big'):
+        _allocate(8)
+    with profiler.stage('small'):
+        _allocate(1)
+    profiler.stop()
+    report = {record['stage']: record for record in profiler.report()}
+    assert report['big']['peak'] >= 8 * MIB
+    assert MIB <= report['small']['peak'] < 4 * MIB
+
+
+def test_pipeline_profiled_workers():
+    profiler = profiling.MemoryProfiler()
+    with pytest.warns(UserWarning):
+        pipeline = Pipeline([Stage('a', _allocate, workers=3), Stage('b', lambda x: _allocate(1) + x, workers=2)],
+                            profiler=profiler)
+    assert list(pipeline.run([1] * 6)) == [MIB // 8 * 2] * 6
+    profiler.stop()
+    assert all(s['peak'] >= MIB for s in pipeline.stats())
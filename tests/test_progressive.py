@@ -0,0 +1,94 @@
+import numpy as np
+from shapely.geometry import Polygon
+from plotdarn import plotting
+from plotdarn.fitted_vectors import sdarn_get_potential
+from plotdarn.frame import FrameContext
+from plotdarn.plotdarn import plot_superdarn_progressive
+from plotdarn.progressive import ProgressiveRenderer
+
+GEOMS = [Polygon([(-60, 60), (-45, 61), (-30, 62), (-20, 75), (-35, 78), (-50, 80)]),
+         Polygon([(10, 55), (30, 58), (25, 70)])]
+
+
+def test_preview_then_refined(record):
+    for key in ('vector.mlat', 'vector.mlon', 'vector.kvect', 'vector.vel.median'):
+        record[key] = np.tile(record[key], 10)
+    renderer = ProgressiveRenderer(GEOMS)
+    renderer.render(record)
+    # The preview is replaced by the refinement, so check the preview layers directly too
+    preview = renderer.preview_layers(record, FrameContext.from_record(record))
+    assert preview['contours'] == ([], [])
+    assert len(preview['vectors'][0]['x']) < 500
+    assert renderer.wait(30)
+    assert renderer.error is None
+    assert len(renderer.sources['contours'].data['xs']) > 0
+    assert len(renderer.sources['vectors_inside'].data['x']) + \
+        len(renderer.sources['vectors_outside'].data['x']) == 500
+
+
+def test_refined_contours_match_image(record):
+    # A two cell pattern peaking at about +/-40 kV at 75 degrees
+    coeffs = np.zeros(49)
+    coeffs[2] = 4e4 / sdarn_get_potential(np.eye(49)[2], record['latmin'], 75, 0)
+    record['N+2'] = coeffs
+    renderer = ProgressiveRenderer(GEOMS)
+    renderer.render(record)
+    assert renderer.wait(30)
+    assert renderer.error is None
+    image = renderer.sources['potential_image'].data['image'][0]
+    resolution = image.shape[0]
+    centres = (np.arange(resolution) + 0.5) * 2. * plotting.IMAGE_EXTENT / resolution - plotting.IMAGE_EXTENT
+    extrema = []
+    for index in (np.nanargmax(image), np.nanargmin(image)):
+        row, col = np.unravel_index(index, image.shape)
+        extrema.append((centres[col], centres[row]))
+    # The innermost contour around each cell is centred on the image extremum of that cell
+    xs, ys = renderer.sources['contours'].data['xs'], renderer.sources['contours'].data['ys']
+    rings = sorted(zip(xs, ys), key=lambda line: np.ptp(line[0]) + np.ptp(line[1]))
+    for x, y in extrema:
+        near = min(np.hypot(np.mean(cx) - x, np.mean(cy) - y) for cx, cy in rings[:2])
+        assert near < 3
+
+
+def test_cancel_keeps_preview(record):
+    renderer = ProgressiveRenderer(GEOMS)
+    renderer.refinements = lambda record, frame: [('contours', lambda: renderer.cancel() or ([[0, 1]], [[0, 1]]))]
+    renderer.render(record)
+    assert renderer.wait(30)
+    assert renderer.sources['contours'].data['xs'] == []
+
+
+def test_error_belongs_to_current_record(record):
+    renderer = ProgressiveRenderer(GEOMS)
+
+    def fail():
+        raise RuntimeError('bad layer')
+
+    renderer.refinements = lambda record, frame: [('contours', fail)]
+    renderer.render(record)
+    assert renderer.wait(30)
+    assert isinstance(renderer.error, RuntimeError)
+    renderer.refinements = lambda record, frame: []
+    renderer.render(record)
+    assert renderer.wait(30)
+    assert renderer.error is None
+
+
+def test_render_reuses_figure(records):
+    renderer = ProgressiveRenderer(GEOMS)
+    figure = renderer.render(records[0])
+    sources = dict(renderer.sources)
+    renderer.wait(30)
+    assert renderer.render(records[5]) is figure
+    renderer.wait(30)
+    assert all(renderer.sources[name] is source for name, source in sources.items())
+    assert len(renderer.sources['vectors_inside'].data['x']) + \
+        len(renderer.sources['vectors_outside'].data['x']) == len(records[5]['vector.mlat'])
+
+
+def test_plot_superdarn_progressive(record):
+    renderer = plot_superdarn_progressive(record, GEOMS, show_potential=True)
+    assert isinstance(renderer, ProgressiveRenderer)
+    assert renderer.figure is not None
+    assert renderer.wait(30)
+    assert renderer.error is None
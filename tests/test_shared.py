@@ -0,0 +1,67 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytest
+from shapely.geometry import Polygon
+from plotdarn import plotting, shared, fitted_vectors
+from plotdarn.frame import FrameContext
+from plotdarn.fitted_vectors import grid_basis
+
+pytest.importorskip('multiprocessing.shared_memory')
+
+GEOMS = [Polygon([(-60, 60), (-30, 62), (-20, 75), (-50, 80)]), Polygon([(10, 55), (30, 58), (25, 70)]),
+         Polygon([(100, -30), (120, -20), (110, -10)])]
+
+
+def _worker_sum(name):
+    return float(shared.attached_layers()['coastlines'][0].sum()), name in shared._attached[0]
+
+
+def test_create_attach_read_only():
+    arrays = {'a': np.arange(10.), 'b': np.ones((3, 4), dtype=np.float32)}
+    with shared.SharedArrays.create(arrays) as owner:
+        other = shared.SharedArrays.attach(owner.handle)
+        np.testing.assert_array_equal(other['b'], arrays['b'])
+        with pytest.raises(ValueError):
+            other['a'][0] = 1
+        other.close()
+        name = owner.handle[0]
+    with pytest.raises(FileNotFoundError):
+        shared.SharedArrays.attach((name, {}))
+
+
+def test_static_layers_match_plotting(record):
+    with shared.share_static_layers(GEOMS, [('potential_grid', (50, 6, 80))]) as segment:
+        layers = shared.static_layers(segment)
+        expected = plotting.coastlines(FrameContext.from_record(record), GEOMS)
+        xs, ys = plotting.coastlines_flat(FrameContext.from_record(record), *layers['coastlines'])
+        assert len(xs) == len(expected[0]) == 2
+        for got, want in zip(xs, expected[0]):
+            np.testing.assert_array_almost_equal(got, want)
+        assert set(layers) == {'coastlines'}
+        assert not any(name.startswith('gridlines') for name in segment.keys())
+        np.testing.assert_array_equal(segment['basis:potential_grid:50:6:80'], grid_basis('potential_grid', 50, 6, 80))
+
+
+def test_workers_attach():
+    with shared.share_static_layers(GEOMS) as segment:
+        with ProcessPoolExecutor(2, initializer=shared.init_worker, initargs=(segment.handle,)) as pool:
+            results = list(pool.map(_worker_sum, ['coastlines.glat'] * 4))
+        expected = float(segment['coastlines.glat'].sum())
+    assert results == [(expected, True)] * 4
+
+
+def test_record_grid_bases_are_used(records):
+    bases = shared.record_grid_bases(records)
+    assert bases == [('potential_grid', (60.0, 6, 80))]
+    frame = FrameContext.from_record(records[0])
+    with shared.share_static_layers(GEOMS, bases) as segment:
+        shared.static_layers(segment)
+        fitted_vectors._potential_grid_basis.cache_clear()
+        try:
+            pot = plotting.potential_grid(frame)
+            basis = grid_basis('potential_grid', frame.hmb_lat, frame.order, 80)
+            assert np.shares_memory(basis, segment['basis:potential_grid:60.0:6:80'])
+        finally:
+            fitted_vectors._INSTALLED_BASES.clear()
+            fitted_vectors._potential_grid_basis.cache_clear()
+    np.testing.assert_allclose(pot, plotting.potential_grid(frame), rtol=1e-12)
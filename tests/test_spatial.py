@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from plotdarn import spatial
+
+
+def _columns(n=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    x, y = rng.uniform(-40, 40, (2, n))
+    ang = rng.uniform(-180, 180, n)
+    m = rng.uniform(0, 1000, n)
+    return dict(x=x, y=y, m=m, ang=ang, le=m * 0.005, an=ang, mlat=90 - np.hypot(x, y), mlt=np.zeros(n),
+                mlon=np.zeros(n))
+
+
+def test_decimate_one_vector_per_cell():
+    columns = _columns()
+    out = spatial.decimate(columns, 10.0, 'first')
+    cells = set(zip(np.floor(out['x'] / 10), np.floor(out['y'] / 10)))
+    assert len(cells) == len(out['x']) == 64
+    assert out['count'].sum() == len(columns['x'])
+
+
+def test_decimate_max_keeps_fastest():
+    columns = _columns()
+    out = spatial.decimate(columns, 40.0, 'max')
+    for i in range(len(out['x'])):
+        cell = (np.floor(columns['x'] / 40) == np.floor(out['x'][i] / 40)) & \
+               (np.floor(columns['y'] / 40) == np.floor(out['y'][i] / 40))
+        assert out['m'][i] == columns['m'][cell].max()
+
+
+def test_decimate_mean_is_vector_mean():
+    columns = dict(x=np.array([1., 2., 30.]), y=np.array([1., 2., 30.]), m=np.array([100., 100., 50.]),
+                   ang=np.array([0., 90., 10.]), le=np.zeros(3), an=np.zeros(3))
+    out = spatial.decimate(columns, 10.0)
+    np.testing.assert_allclose(out['m'], [100 / np.sqrt(2), 50])
+    np.testing.assert_allclose(out['ang'], [45, 10])
+    np.testing.assert_array_equal(out['count'], [2, 1])
+
+
+def test_decimate_empty_and_bad_method():
+    columns = {name: values[:0] for name, values in _columns().items()}
+    assert len(spatial.decimate(columns, 5.0)['x']) == 0
+    with pytest.raises(ValueError):
+        spatial.decimate(_columns(), 5.0, 'median')
+
+
+def test_cell_size_scales_with_zoom():
+    assert spatial.cell_size(80) == 2 * spatial.cell_size(40)
+
+
+def _index(n_frames=3, n=5000):
+    index = spatial.VectorIndex()
+    points = {}
+    for key in range(n_frames):
+        columns = _columns(n, seed=key)
+        index.add_frame(key, columns['x'], columns['y'])
+        points[key] = (columns['x'], columns['y'])
+    return index, points
+
+
+def test_index_nearest_matches_brute_force():
+    index, points = _index()
+    found = index.nearest(3.3, -7.1, k=5)
+    dist = sorted((np.hypot(x - 3.3, y + 7.1)[i], key, i) for key, (x, y) in points.items() for i in range(len(x)))
+    assert [(key, i) for key, i, _ in found] == [(key, i) for _, key, i in dist[:5]]
+
+
+def test_index_radius_box_polygon():
+    index, points = _index()
+    within = index.radius(0, 0, 10)
+    box = index.box(-5, -20, 15, 3)
+    triangle = index.polygon([0, 30, 0], [0, 0, 30])
+    for key, (x, y) in points.items():
+        np.testing.assert_array_equal(within[key], np.flatnonzero(np.hypot(x, y) <= 10))
+        np.testing.assert_array_equal(box[key], np.flatnonzero((x >= -5) & (x <= 15) & (y >= -20) & (y <= 3)))
+        np.testing.assert_array_equal(triangle[key], np.flatnonzero((x > 0) & (y > 0) & (x + y < 30)))
+
+
+def test_index_streaming_frames(records):
+    index = spatial.VectorIndex(max_frames=3)
+    keys = [index.add_record(r) for r in records]
+    assert index.keys() == keys[-3:]
+    assert len(index) == sum(len(r['vector.mlat']) for r in records[-3:])
+    index.remove_frame(keys[-1])
+    assert index.keys() == keys[-3:-1]
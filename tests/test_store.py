@@ -0,0 +1,63 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from plotdarn.store import StoreWriter, MapStore
+from plotdarn.plotdarn import read_records
+from plotdarn.utils import record_time
+
+
+@pytest.fixture
+def store(tmpdir, records):
+    with StoreWriter(str(tmpdir.join('store'))) as writer:
+        writer.add_records(records)
+    return MapStore(str(tmpdir.join('store')))
+
+
+def test_store_round_trip(store, records):
+    assert len(store) == len(records)
+    for i, expected in enumerate(records):
+        res = store.record(i)
+        assert record_time(res) == record_time(expected)
+        assert res['fit.order'] == expected['fit.order']
+        np.testing.assert_array_equal(res['N+2'], expected['N+2'])
+        for name in ['boundary.mlat', 'vector.mlat', 'vector.mlon', 'vector.kvect', 'vector.vel.median']:
+            np.testing.assert_array_equal(res[name], expected[name])
+
+
+def test_store_columns_are_memory_mapped(store):
+    assert isinstance(store.columns['vector.mlat'], np.memmap)
+    assert isinstance(store.record(3)['vector.mlat'], np.memmap)
+
+
+def test_store_time_slice(store, records):
+    start = datetime(2012, 6, 15, 22, 6)
+    end = datetime(2012, 6, 15, 22, 12)
+    res = store.records(start, end)
+    assert [record_time(r) for r in res] == [record_time(r) for r in records[3:6]]
+
+
+def test_store_ragged_column_slice(store, records):
+    res = store.column('vector.vel.median', datetime(2012, 6, 15, 22, 6), datetime(2012, 6, 15, 22, 10))
+    expected = np.concatenate([records[3]['vector.vel.median'], records[4]['vector.vel.median']])
+    np.testing.assert_array_equal(res, expected)
+
+
+def test_store_order_too_large(tmpdir, records):
+    with pytest.raises(ValueError):
+        with StoreWriter(str(tmpdir.join('store')), max_order=4) as writer:
+            writer.add_records(records)
+
+
+def test_read_records_from_store(store, records):
+    res = read_records(store.directory, start=datetime(2012, 6, 15, 22, 14))
+    assert len(res) == len(records) - 7
+
+
+def test_empty_store(tmpdir):
+    with StoreWriter(str(tmpdir.join('store'))):
+        pass
+    store = MapStore(str(tmpdir.join('store')))
+    assert len(store) == 0
+    assert store.records() == []
+    assert len(store.column('vector.mlat')) == 0
+    assert len(store.column('latmin', datetime(2012, 6, 15))) == 0
@@ -0,0 +1,39 @@
+import json
+import pytest
+from plotdarn.plotdarn import frame_layers, render_layers
+from plotdarn.template import FrameTemplate
+
+
+def _normalise(node, ids):
+    # Model ids differ between documents, number them in order of appearance
+    if isinstance(node, dict):
+        return {key: ids.setdefault(value, len(ids)) if key in ('id', 'root_id') else _normalise(value, ids)
+                for key, value in node.items()}
+    if isinstance(node, list):
+        return [_normalise(value, ids) for value in node]
+    return node
+
+
+@pytest.mark.parametrize('show_potential', [False, True])
+def test_spliced_frame_matches_json_item(records, show_potential):
+    from bokeh.embed import json_item
+    template = FrameTemplate(frame_layers(records[0], [], show_potential=show_potential, image_budget=0.001))
+    layers = frame_layers(records[4], [], show_potential=show_potential, image_budget=0.001)
+    spliced = json.loads(template.json(layers, title='Frame 4'))
+    expected = json_item(render_layers(layers, title='Frame 4'), target='plotdarn')
+    # Compared as text, the documents hold NaN
+    assert json.dumps(_normalise(spliced, {}), sort_keys=True) == json.dumps(_normalise(expected, {}), sort_keys=True)
+
+
+def test_layers_must_match(records):
+    template = FrameTemplate(frame_layers(records[0], []))
+    with pytest.raises(ValueError):
+        template.json(frame_layers(records[1], [], show_potential=True, image_budget=0.001))
+
+
+def test_html(records):
+    template = FrameTemplate(frame_layers(records[0], []), title='SuperDarn')
+    page = template.html(frame_layers(records[1], []), title='</script> & more')
+    assert '<title>&lt;/script&gt; &amp; more</title>' in page
+    assert page.count('</script>') == page.count('<script')
+    assert 'Bokeh.embed.embed_item(' in page
@@ -0,0 +1,83 @@
+import numpy as np
+from plotdarn import timeseries
+from plotdarn.fitted_vectors import sdarn_get_potential
+from plotdarn.frame import FrameContext
+from plotdarn.store import StoreWriter, MapStore
+
+
+def _brute_force(record, n=400):
+    frame = FrameContext.from_record(record)
+    mlat, mlt = np.meshgrid(np.linspace(record['latmin'], 90, n), np.linspace(0, 24, n, endpoint=False))
+    pot = sdarn_get_potential(frame.rotated_coeffs, frame.hmb_lat, mlat.ravel(), mlt.ravel())
+    return pot.max(), pot.min()
+
+
+def test_records_timeseries_matches_brute_force(records):
+    summary = timeseries.records_timeseries(records, chunk_size=4)
+    assert len(summary['time']) == len(records)
+    for i in (0, 5, 9):
+        pot_max, pot_min = _brute_force(records[i])
+        np.testing.assert_allclose(summary['pot_max'][i], pot_max, rtol=1e-3, atol=1e-3)
+        np.testing.assert_allclose(summary['pot_min'][i], pot_min, rtol=1e-3, atol=1e-3)
+    np.testing.assert_allclose(summary['cpcp'], summary['pot_max'] - summary['pot_min'], rtol=1e-6)
+    np.testing.assert_array_equal(summary['n_vectors'], [20 + i for i in range(10)])
+
+
+def test_extremum_location(records):
+    summary = timeseries.records_timeseries(records[:1])
+    frame = FrameContext.from_record(records[0])
+    at_max = sdarn_get_potential(frame.rotated_coeffs, frame.hmb_lat, summary['pot_max_mlat'][0],
+                                 summary['pot_max_mlt'][0])
+    np.testing.assert_allclose(at_max, summary['pot_max'][0], rtol=1e-5)
+
+
+def test_extremum_in_magnetic_longitude(records):
+    record = dict(records[0], **{'start.second': 1.0})
+    summary = timeseries.records_timeseries([record])
+    # The unrotated coefficients are a function of magnetic longitude, MLT = mlon / 15 + UT - 4.73 in hours
+    ut = 22 + 1 / 3600.
+    mlon_lt = (summary['pot_max_mlt'][0] - ut + 4.73) % 24
+    at_max = sdarn_get_potential(record['N+2'], record['latmin'], summary['pot_max_mlat'][0], mlon_lt)
+    np.testing.assert_allclose(at_max, summary['pot_max'][0], rtol=1e-5)
+
+
+def test_grid_blocks(records, monkeypatch):
+    summary = timeseries.records_timeseries(records)
+    monkeypatch.setattr(timeseries, 'GRID_BYTES', 1)
+    for name in timeseries.SUMMARY_COLUMNS:
+        np.testing.assert_array_equal(timeseries.records_timeseries(records)[name], summary[name])
+
+
+def test_mixed_orders_and_boundaries(records):
+    records = [dict(records[1], latmin=55.0, **{'fit.order': 4, 'N+2': records[1]['N+2'][:25]}), records[2]]
+    summary = timeseries.records_timeseries(records)
+    for i, record in enumerate(records):
+        single = timeseries.records_timeseries([record])
+        for name in timeseries.SUMMARY_COLUMNS:
+            np.testing.assert_array_equal(summary[name][i], single[name][0])
+    assert summary['hmb_lat'][0] == 55.0
+
+
+def test_store_timeseries_matches_records(records, tmp_path):
+    with StoreWriter(str(tmp_path / 'store')) as writer:
+        writer.add_records(records)
+    from_store = timeseries.store_timeseries(MapStore(str(tmp_path / 'store')), chunk_size=3)
+    from_records = timeseries.records_timeseries(records)
+    for name in timeseries.SUMMARY_COLUMNS[1:]:
+        np.testing.assert_allclose(from_store[name], from_records[name], rtol=1e-5)
+    np.testing.assert_array_equal(from_store['time'], from_records['time'])
+
+
+def test_write_read_timeseries(records, tmp_path):
+    summary = timeseries.records_timeseries(records)
+    timeseries.write_timeseries(summary, str(tmp_path / 'summary.npz'))
+    read = timeseries.read_timeseries(str(tmp_path / 'summary.npz'))
+    for name in timeseries.SUMMARY_COLUMNS:
+        np.testing.assert_array_equal(read[name], summary[name])
+
+
+def test_store_timeseries_empty(tmp_path):
+    with StoreWriter(str(tmp_path / 'store')):
+        pass
+    summary = timeseries.store_timeseries(MapStore(str(tmp_path / 'store')))
+    assert all(len(summary[name]) == 0 for name in timeseries.SUMMARY_COLUMNS)
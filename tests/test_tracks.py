@@ -0,0 +1,72 @@
+import datetime as dt
+import numpy as np
+import pytest
+from plotdarn import convert, tracks
+from plotdarn.fitted_vectors import sdarn_get_potential
+from plotdarn.frame import FrameContext
+from plotdarn.utils import record_time
+
+
+def _track(records, n=200):
+    start = record_time(records[0])
+    times = [start + dt.timedelta(seconds=s) for s in np.linspace(0, 17 * 60, n)]
+    glat = np.linspace(60, 85, n)
+    glon = np.linspace(-120, 40, n)
+    return times, glat, glon
+
+
+def test_nearest_matches_single_record(records):
+    times, glat, glon = _track(records)
+    values = tracks.track_values(times, glat, glon, records)
+    i = 57
+    record = records[values['record'][i]]
+    frame = FrameContext.from_record(record)
+    assert abs((record_time(record) - times[i]).total_seconds()) <= 60
+    mlat, mlon = convert.arr_geo_to_mag(glat[i:i + 1], glon[i:i + 1], frame.dtime)
+    mlt = convert.mlon_to_mlt(mlon, times[i])
+    np.testing.assert_allclose(values['mlt'][i], mlt, atol=1e-3)
+    np.testing.assert_allclose(values['potential'][i],
+                               sdarn_get_potential(frame.rotated_coeffs, frame.hmb_lat, mlat, values['mlt'][i:i + 1]))
+
+
+def test_potential_in_magnetic_longitude(records):
+    times, glat, glon = _track(records)
+    values = tracks.track_values(times, glat, glon, records)
+    record_times = [record_time(r) for r in records]
+    rows = [i for i, t in enumerate(times) if t in record_times]
+    assert rows
+    for i in rows:
+        record = records[values['record'][i]]
+        ut = times[i].hour + times[i].minute / 60. + times[i].second / 3600.
+        # The unrotated coefficients are a function of magnetic longitude, MLT = mlon / 15 + UT - 4.73 in hours
+        mlon_lt = (values['mlt'][i] - ut + 4.73) % 24
+        np.testing.assert_allclose(values['potential'][i], sdarn_get_potential(
+            record['N+2'], record['latmin'], values['mlat'][i:i + 1], [mlon_lt]), rtol=1e-9)
+
+
+def test_linear_blends_between_records(records):
+    times, glat, glon = _track(records)
+    nearest = tracks.track_values(times, glat, glon, records)
+    linear = tracks.track_values(times, glat, glon, records, method='linear')
+    at_record = np.array([t in [record_time(r) for r in records] for t in times])
+    assert at_record.any()
+    np.testing.assert_allclose(linear['potential'][at_record], nearest['potential'][at_record], rtol=1e-6)
+    np.testing.assert_allclose(linear['magnitude'], np.hypot(linear['vel_north'], linear['vel_east']))
+
+
+def test_max_gap(records):
+    times, glat, glon = _track(records[:2])
+    values = tracks.track_values(times, glat, glon, records[:2], max_gap=90)
+    late = np.array([(t - record_time(records[1])).total_seconds() > 90 for t in times])
+    assert np.all(np.isnan(values['potential'][late]))
+    assert not np.any(np.isnan(values['potential'][~late]))
+
+
+def test_bad_method(records):
+    with pytest.raises(ValueError):
+        tracks.track_values(*_track(records), records=records, method='cubic')
+
+
+def test_no_records(records):
+    with pytest.raises(ValueError):
+        tracks.track_values(*_track(records), records=[])
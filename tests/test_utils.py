@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 from plotdarn.utils import scale_velocity, points_inside_boundary
 
 
@@ -82,3 +83,41 @@ def test_points_inside_mulitple_array():
     by = np.array([1, 1, 2, 2])
     inside = points_inside_boundary(np.array([1.1, 2, 1.5, 1.2]), np.array([1.1, 2.1, 1.5, 3]), bx, by)
     np.testing.assert_array_equal(inside, np.array([True, False, True, False]))
+
+
+def test_precision_setting():
+    from plotdarn.utils import get_precision, set_precision, as_precision
+    assert get_precision() == np.float64
+    assert get_precision('float32') == np.float32
+    with pytest.raises(ValueError):
+        get_precision('float16')
+    set_precision('float32')
+    try:
+        assert as_precision(np.zeros(3)).dtype == np.float32
+        assert as_precision(np.zeros(3, dtype=int)).dtype.kind == 'i'
+    finally:
+        set_precision('float64')
+
+
+def test_precision_context_is_per_thread():
+    import threading
+    from plotdarn.utils import get_precision, precision
+    entered = threading.Event()
+    leave = threading.Event()
+    seen = []
+
+    def other():
+        with precision('float32'):
+            seen.append(get_precision())
+            entered.set()
+            leave.wait(10)
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    try:
+        assert entered.wait(10)
+        assert get_precision() == np.float64
+    finally:
+        leave.set()
+        thread.join()
+    assert seen == [np.float32]
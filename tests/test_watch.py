@@ -0,0 +1,175 @@
+import os
+import json
+import struct
+import threading
+import pytest
+from plotdarn.utils import record_time
+from plotdarn.watch import Watcher, WatchState, complete_length, publish
+
+
+def frame(minute):
+    payload = json.dumps({'start.minute': minute}).encode()
+    return struct.pack('<ii', 65537, 8 + len(payload)) + payload
+
+
+def append(path, *minutes, partial=False):
+    data = b''.join(frame(m) for m in minutes)
+    with open(path, 'ab') as fh:
+        fh.write(data[:-3] if partial else data)
+
+
+@pytest.fixture
+def watcher_factory(tmpdir, record):
+    decoded = []
+
+    def decode(raw):
+        records = []
+        offset = 0
+        while offset < len(raw):
+            size = struct.unpack_from('<ii', raw, offset)[1]
+            records.append(dict(record, **json.loads(raw[offset + 8:offset + size].decode())))
+            offset += size
+        decoded.extend(records)
+        return records
+
+    def make(**kwargs):
+        watcher = Watcher(str(tmpdir.join('in')), str(tmpdir.join('out', '%H%M.txt')), decode=decode,
+                          render=lambda r: 'frame {:%H:%M}'.format(record_time(r)), **kwargs)
+        watcher.decoded = decoded
+        return watcher
+
+    tmpdir.mkdir('in')
+    return make
+
+
+def test_complete_length():
+    raw = frame(0) + frame(2) + frame(4)[:-1]
+    assert complete_length(raw) == (len(frame(0)) * 2, 2)
+    assert complete_length(raw, 1) == (len(frame(0)), 1)
+    assert complete_length(b'') == (0, 0)
+
+
+def test_incremental_cycles(tmpdir, watcher_factory):
+    path = str(tmpdir.join('in', '20120615.map'))
+    append(path, 2, 4, partial=True)
+    watcher = watcher_factory()
+    metrics = watcher.cycle()
+    assert metrics['rendered'] == 1 and metrics['files'] == 1 and metrics['backlog'] == 0
+    assert os.listdir(str(tmpdir.join('out'))) == ['2202.txt']
+    assert tmpdir.join('out', '2202.txt').read() == 'frame 22:02'
+
+    assert watcher.cycle()['files'] == 0
+    # Complete the partial record and add another, only those two are decoded
+    with open(path, 'ab') as fh:
+        fh.write(frame(4)[-3:] + frame(6))
+    assert watcher.cycle()['rendered'] == 2
+    assert [r['start.minute'] for r in watcher.decoded] == [2, 4, 6]
+    assert sorted(os.listdir(str(tmpdir.join('out')))) == ['2202.txt', '2204.txt', '2206.txt']
+
+    # A restarted watcher resumes from the state file
+    append(path, 8)
+    restarted = watcher_factory()
+    assert restarted.cycle()['rendered'] == 1
+    assert [r['start.minute'] for r in restarted.decoded][-1] == 8
+    state = WatchState(str(tmpdir.join('in', '.plotdarn-watch.json')))
+    assert state.watermark('20120615.map')['records'] == 4
+    assert state.watermark('20120615.map')['offset'] == os.path.getsize(path)
+
+
+def test_replaced_file_skips_rendered(tmpdir, watcher_factory):
+    path = str(tmpdir.join('in', 'a.map'))
+    append(path, 2, 4, 6)
+    watcher = watcher_factory()
+    watcher.cycle()
+    os.remove(path)
+    append(path, 6, 8)
+    assert watcher.cycle()['rendered'] == 1
+
+
+def test_backlog(tmpdir, watcher_factory):
+    append(str(tmpdir.join('in', 'a.map')), 2, 4, 6)
+    append(str(tmpdir.join('in', 'b.map')), 10)
+    watcher = watcher_factory(max_records=2, interval=0)
+    metrics = watcher.cycle()
+    assert metrics['rendered'] == 2
+    assert metrics['backlog'] == 1 and metrics['backlog_files'] == 2
+    watcher.run(cycles=3)
+    assert len(os.listdir(str(tmpdir.join('out')))) == 4
+    stats = watcher.stats()
+    assert stats['cycles'] == 4 and stats['rendered'] == 4 and stats['backlog'] == 0
+    assert stats['lag'] > 0
+
+
+def test_run_stops(tmpdir, watcher_factory):
+    stop = threading.Event()
+    watcher = watcher_factory(interval=60)
+    thread = threading.Thread(target=watcher.run, kwargs={'stop': stop})
+    thread.start()
+    stop.set()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_publish_replaces_atomically(tmpdir):
+    target = str(tmpdir.join('sub', 'frame.html'))
+    publish(target, 'one')
+    publish(target, b'two')
+    assert tmpdir.join('sub', 'frame.html').read() == 'two'
+    assert os.listdir(str(tmpdir.join('sub'))) == ['frame.html']
+
+
+def test_replaced_file_larger(tmpdir, watcher_factory):
+    path = str(tmpdir.join('in', 'a.map'))
+    append(path, 2, 4)
+    watcher = watcher_factory()
+    assert watcher.cycle()['rendered'] == 2
+    # Replaced in place by a larger file, then appended to
+    with open(path, 'wb') as fh:
+        fh.write(frame(10) + frame(12) + frame(14))
+    assert watcher.cycle()['rendered'] == 3
+    append(path, 16)
+    assert watcher.cycle()['rendered'] == 1
+    assert [r['start.minute'] for r in watcher.decoded] == [2, 4, 10, 12, 14, 16]
+    assert watcher.state.watermark('a.map')['records'] == 4
+
+
+def test_bad_records_are_skipped(tmpdir, watcher_factory):
+    path = str(tmpdir.join('in', 'a.map'))
+    append(path, 2)
+    with open(path, 'ab') as fh:
+        fh.write(struct.pack('<ii', 65537, 11) + b'bad')
+    append(path, 4, 6)
+
+    def render(record):
+        if record['start.minute'] == 6:
+            raise ValueError('cannot render')
+        return 'frame'
+
+    watcher = watcher_factory(interval=0)
+    watcher.render = render
+    watcher.run(cycles=2)
+    assert sorted(os.listdir(str(tmpdir.join('out')))) == ['2202.txt', '2204.txt']
+    assert watcher.history[0]['errors'] == 2 and watcher.history[1]['files'] == 0
+    assert [message.split(':')[0] for _, message in watcher.errors] == ['decode', 'render']
+    assert watcher.stats()['errors'] == 2
+    # The bad records are not retried after a restart
+    assert watcher_factory().cycle()['files'] == 0
+
+
+def test_unreadable_file_is_retried(tmpdir, watcher_factory):
+    append(str(tmpdir.join('in', 'a.map')), 2)
+    append(str(tmpdir.join('in', 'b.map')), 4)
+    failing = {'a.map'}
+
+    def read_bytes(filename, offset, size):
+        if os.path.basename(filename) in failing:
+            raise IOError('unreadable')
+        with open(filename, 'rb') as fh:
+            fh.seek(offset)
+            return fh.read(size - offset)
+
+    watcher = watcher_factory(read_bytes=read_bytes)
+    metrics = watcher.cycle()
+    assert metrics['errors'] == 1 and metrics['rendered'] == 1
+    failing.clear()
+    assert watcher.cycle()['rendered'] == 1